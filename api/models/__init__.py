@@ -1,8 +1,12 @@
 # initialise here so we can use in our model files
 # flask sqla alchemy is an interface btwn mysql and python
 from flask_sqlalchemy import SQLAlchemy
+
+from api.utils.routing import RoutingSession
+
 # db is entry point interacting with our database
-db = SQLAlchemy()
+# the session routes read-only requests to the replicas, see api.utils.routing
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # create models to describe structure of each of our tables, as they exist in the database
 # which SQLAlchemy will use to generate SQL queries for our CRUD operations
@@ -17,4 +21,5 @@ film_actor = db.Table('film_actor',
 
 # import models after association tables are defined
 from api.models.actor import Actor
-from api.models.film import Film
\ No newline at end of file
+from api.models.film import Film
+from api.models.version import ApiVersion
\ No newline at end of file
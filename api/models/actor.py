@@ -12,4 +12,6 @@ class Actor(db.Model):
     films = db.relationship('Film', secondary=film_actor, back_populates='actors')
 
 
-
+# ?q= searches first and last name
+from api.models.search import add_fulltext_index
+add_fulltext_index(Actor, 'first_name', 'last_name')
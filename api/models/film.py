@@ -1,6 +1,71 @@
+from sqlalchemy import inspect
+from sqlalchemy.orm import deferred
+
 # import db from __init__.py
 from api.models import db, film_actor
 
+# allowed special features, in the order of sakila's SET column: bit i stands for SPECIAL_FEATURES[i]
+SPECIAL_FEATURES = ('Trailers', 'Commentaries', 'Deleted Scenes', 'Behind the Scenes')
+FEATURE_BITS = {feature: 1 << i for i, feature in enumerate(SPECIAL_FEATURES)}
+FEATURE_MATCH_MODES = ('any', 'all', 'none')
+
+
+def features_mask(features):
+    """
+    bitmask for an iterable of feature names, raises KeyError for unknown features
+    """
+    mask = 0
+    for feature in features:
+        mask |= FEATURE_BITS[feature]
+    return mask
+
+
+def matching_masks(bits, mode):
+    """
+    every stored mask that matches the requested bits in the given mode
+
+    there are only 16 possible masks, so a filter becomes one indexed
+    special_features_mask IN (...) lookup instead of a string match per feature
+    """
+    masks = range(1 << len(SPECIAL_FEATURES))
+    if mode == 'any':
+        return [mask for mask in masks if mask & bits]
+    if mode == 'all':
+        return [mask for mask in masks if mask & bits == bits]
+    return [mask for mask in masks if not mask & bits]
+
+
+def _mask_expression(column):
+    # ',a,b,' LIKE '%,a,%' per feature, portable across MySQL (SET or varchar) and SQLite.
+    # no features (NULL) is mask 0, like COALESCE(special_features + 0, 0) on a sakila SET column
+    padded = db.literal(',') + column + db.literal(',')
+    return sum(
+        db.case((padded.like(f'%,{feature},%'), bit), else_=0)
+        for feature, bit in FEATURE_BITS.items()
+    )
+
+
+# engine -> whether its film table has the special_features_mask column
+_has_mask_column = {}
+
+
+def mask_filter(bits, mode):
+    """
+    special features filter as a mask IN (...) predicate
+
+    uses the indexed special_features_mask column where the database has it, and
+    otherwise works the mask out per row from special_features (same result, no
+    index). whether the column exists is looked up once per engine, restart the
+    workers after running the migration
+    """
+    bind = db.session.get_bind()
+    present = _has_mask_column.get(bind)
+    if present is None:
+        columns = inspect(bind).get_columns(Film.__tablename__)
+        present = _has_mask_column[bind] = any(col['name'] == 'special_features_mask' for col in columns)
+    mask = Film.special_features_mask if present else _mask_expression(Film.special_features)
+    return mask.in_(matching_masks(bits, mode))
+
 # represents table
 class Film(db.Model):
 
@@ -16,8 +81,25 @@ class Film(db.Model):
     replacement_cost = db.Column(db.Float(asdecimal=True), nullable=False)
     rating = db.Column(db.String(255), nullable=True)
     special_features = db.Column(db.String(255), nullable=True)
+    # computed by the database from special_features, only used for filtering (see mask_filter).
+    # deferred so loading a film never selects it, and not fetched back after an insert
+    # (eager_defaults below), a database the migration has not run on yet
+    # (python -m migrations.film_special_features_mask) works without it
+    special_features_mask = deferred(db.Column(
+        db.SmallInteger,
+        db.Computed(_mask_expression(special_features), persisted=True),
+        index=True
+    ))
 
     # many-to-many relationship
     actors = db.relationship('Actor', secondary=film_actor, back_populates='films')
 
+    # no INSERT ... RETURNING of the server computed mask
+    __mapper_args__ = {'eager_defaults': False}
+
+
+
 
+# ?q= searches title and description
+from api.models.search import add_fulltext_index
+add_fulltext_index(Film, 'title', 'description')
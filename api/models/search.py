@@ -0,0 +1,45 @@
+# full-text indexes for the ?q= search
+# MySQL (production): a FULLTEXT index on the searched columns
+# SQLite (local/tests): an external content FTS5 table kept in sync by triggers
+#
+# both are only created by db.create_all(), an existing sakila database needs e.g.
+#   ALTER TABLE film ADD FULLTEXT INDEX ft_film (title, description);
+#   ALTER TABLE actor ADD FULLTEXT INDEX ft_actor (first_name, last_name);
+
+from sqlalchemy import DDL, event
+
+from api.models import db
+
+
+def fts_table_name(model):
+    return f'{model.__tablename__}_fts'
+
+
+def add_fulltext_index(model, *columns):
+    """
+    index the given column names of a model for full-text search
+    """
+    table = model.__table__
+    key = model.__mapper__.primary_key[0].name
+    fts = fts_table_name(model)
+    names = ', '.join(columns)
+    new_values = ', '.join(f'new.{name}' for name in columns)
+    old_values = ', '.join(f'old.{name}' for name in columns)
+
+    # mysql_prefix makes this CREATE FULLTEXT INDEX, other databases skip it
+    db.Index(f'ft_{table.name}', *[table.c[name] for name in columns], mysql_prefix='FULLTEXT').ddl_if(dialect='mysql')
+
+    statements = [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({names}, content='{table.name}', content_rowid='{key}')",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table.name} BEGIN "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.{key}, {new_values}); END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table.name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{key}, {old_values}); END",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE ON {table.name} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.{key}, {old_values}); "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.{key}, {new_values}); END",
+    ]
+    for statement in statements:
+        event.listen(table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    # the triggers go with the content table, the virtual table has to be dropped by hand
+    event.listen(table, 'before_drop', DDL(f'DROP TABLE IF EXISTS {fts}').execute_if(dialect='sqlite'))
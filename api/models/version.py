@@ -0,0 +1,13 @@
+# import db from __init__.py
+from api.models import db
+
+
+# version number per entity/collection, bumped by every write that changes it
+# (see api.utils.versions). not part of sakila, db.create_all() creates it and
+# an existing database gets it from python -m migrations.api_version
+class ApiVersion(db.Model):
+    __tablename__ = 'api_version'
+
+    # "film:5" for an entity, "film" for a collection, 191 chars fit a utf8mb4 index
+    key_name = db.Column(db.String(191), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
@@ -1,10 +1,58 @@
-from flask import Blueprint
+from flask import Blueprint, current_app, jsonify
+
+from api.models import db
 
 from api.routes.actor import actors_router
 from api.routes.film import films_router
+from api.utils.admission import admission
+from api.utils.coalescing import single_flight
+from api.utils.entities import entity_cache
+from api.utils.metrics import render_metrics
+from api.utils.pool import pool_status
+from api.utils.routing import replica_engines
 
 # base router
 routes = Blueprint('api', __name__, url_prefix='/api')
 
 routes.register_blueprint(actors_router)
 routes.register_blueprint(films_router)
+
+
+# hit/miss/eviction counters of the single entity cache
+@routes.get('/cache')
+def get_cache_stats():
+    return jsonify(entity_cache.stats()), 200
+
+
+# admitted/shed request counts and units in flight of the admission control
+@routes.get('/admission')
+def get_admission_stats():
+    return jsonify(admission.stats()), 200
+
+
+# view calls run and responses shared by the request coalescing
+@routes.get('/coalescing')
+def get_coalescing_stats():
+    return jsonify(single_flight.stats()), 200
+
+
+# connection pool usage of this worker, for sizing DB_POOL_SIZE/DB_MAX_OVERFLOW
+@routes.get('/pool')
+def get_pool_stats():
+    stats = pool_status(db.engine)
+    stats['replicas'] = {key: pool_status(engine) for key, engine in replica_engines(db.engines).items()}
+    # served through asgi.py the queries go to the asyncio engines instead
+    async_engines = current_app.extensions.get('asgi_engines')
+    if async_engines:
+        stats['async'] = {key or 'primary': pool_status(engine.sync_engine) for key, engine in async_engines.items()}
+    return jsonify(stats), 200
+
+
+# prometheus text format, summed over all workers of the node in multiprocess mode
+@routes.get('/metrics')
+def get_metrics():
+    metrics = render_metrics()
+    if metrics is None:
+        return jsonify({"error": "Metrics need the prometheus_client package"}), 501
+    body, content_type = metrics
+    return body, 200, {'Content-Type': content_type}
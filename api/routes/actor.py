@@ -2,23 +2,38 @@ from flask import (
     Blueprint, 
     request, 
     jsonify, 
-    url_for
+    url_for,
+    current_app,
+    g
 )
 
 from marshmallow import ValidationError
 
-from api.models import db
+from api.models import db, film_actor
 from api.models.actor import Actor
 from api.models.film import Film
 
 from api.schemas.actor import (
     actor_schema, 
     actors_schema, 
-    actor_create_update_schema
+    actor_create_update_schema,
+    actor_bulk_schema
 )
 
 from api.schemas.film import films_schema
 from api.utils.pagination import paginate_query
+from api.utils.aggregates import actor_stats
+from api.utils.associations import AssociationChange, full_replacement, sync_associations
+from api.utils.bulk import bulk_response, bulk_write
+from api.utils.counts import count_cache
+from api.utils.entities import entity_cache, fetch_entity
+from api.utils.etags import conditional
+from api.utils.exports import EXPORT_FORMATS, EXPORT_LINK_MODES, export_response
+from api.utils.embeds import ACTOR_EMBEDS, FILM_EMBEDS, embed_keys, embed_related, embed_templates, parse_embed
+from api.utils.fields import sparse_schema
+from api.utils.links import LINK_MODES
+from api.utils.search import MAX_SEARCH_LENGTH, apply_search
+from api.utils.versions import collection_key, entity_key, versions
 
 # here we implement a RESTFul "actors" resource
 
@@ -26,21 +41,57 @@ from api.utils.pagination import paginate_query
 # we can insert this into our Flask app
 actors_router = Blueprint('actors', __name__, url_prefix ='/actors')
 
-@actors_router.get('/')
-def get_all_actors():
+# listings whose cached totals change when an actor is written
+COUNT_ENDPOINTS = (
+    'api.actors.get_all_actors',
+    'api.films.get_film_actors',
+    'api.actors.get_actor_films'
+)
+
+
+def invalidate_actors(actor_ids=(), film_ids=()):
+    """
+    drop everything cached about written actors and bump the ETag versions
+
+    film_ids are the films on either side of the actors' association changes
+    """
+    count_cache.invalidate(*COUNT_ENDPOINTS)
+    entity_cache.invalidate(Actor, *actor_ids)
+    entity_cache.invalidate(Film, *film_ids)
+    versions.bump(
+        collection_key(Actor),
+        collection_key(film_actor),
+        *[entity_key(Actor, actor_id) for actor_id in set(actor_ids)],
+        *[entity_key(Film, film_id) for film_id in set(film_ids)]
+    )
+    # the /stats summary follows the written rows
+    actor_stats.refresh(actor_ids)
+
+
+def filter_actors():
+    """
+    actor query with the filters and ?q= search of the request applied,
+    shared by the listing and the export
 
+    returns:
+        (query, search score or None, filter params for links, error message)
+    """
     # base query
     query = Actor.query
 
     # filtering
     first_name = request.args.get("first_name")
     last_name = request.args.get("last_name")
+    q = request.args.get("q")
 
     if first_name and len(first_name) > 45:
-        return jsonify({"error":"Invalid first name length"}), 400
+        return None, None, None, "Invalid first name length"
 
     if last_name and len(last_name) > 45:
-        return jsonify({"error":"Invalid last name length"}), 400
+        return None, None, None, "Invalid last name length"
+
+    if q and len(q) > MAX_SEARCH_LENGTH:
+        return None, None, None, "Invalid search length"
 
     # apply filters
     filter_conditions = []
@@ -55,19 +106,59 @@ def get_all_actors():
     if filter_conditions:
         query = query.filter(db.and_(*filter_conditions))
 
+    # full-text search over first and last name, ranked by relevance
+    score = None
+    if q and q.strip():
+        query, score = apply_search(query, Actor, [Actor.first_name, Actor.last_name], q)
+
+    filters = {
+        'q': q,
+        'first_name': first_name,
+        'last_name': last_name
+    }
+    return query, score, filters, None
+
+
+@actors_router.get('/')
+@conditional(lambda: [collection_key(Actor)] + embed_keys(ACTOR_EMBEDS))
+def get_all_actors():
+
+    # sparse fieldset
+    schema, error = sparse_schema(actors_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    # embedded relationships
+    embeds, error = parse_embed(ACTOR_EMBEDS, request.args.get("embed"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    # filters and search
+    query, score, filters, error = filter_actors()
+    if error:
+        return jsonify({"error": error}), 400
+
     # apply pagination
     result,status = paginate_query(
         query=query,
-        schema=actors_schema,
+        schema=schema,
         endpoint='api.actors.get_all_actors',
+        sort_key=score,
+        sort_desc=score is not None,
         # include search param in pagination links
-        first_name=first_name,
-        last_name=last_name
+        **filters
     )
 
     if status != 200:
         return result,status
 
+    # nest the related rows, one batched query for the whole page
+    for name in embeds:
+        embed_related(result['items'], name, *ACTOR_EMBEDS[name])
+    templates = embed_templates(ACTOR_EMBEDS, embeds)
+    if templates:
+        result['_links']['embedded'] = templates
+
     # rename 'items' to 'actors' for clarity
     response = {
         'actors': result['items'],
@@ -79,24 +170,88 @@ def get_all_actors():
 
 
 
+# filmography sizes from the in-process summary (see api.utils.aggregates),
+# no table scan per request
+@actors_router.get('/stats')
+def get_actor_stats():
+    return jsonify(actor_stats.snapshot()), 200
+
+
+@actors_router.get('/export')
+@conditional(lambda: [collection_key(Actor)])
+def export_actors():
+
+    # ndjson (default) or csv
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Invalid format. Options are ndjson and csv"}), 400
+
+    # sparse fieldset
+    schema, error = sparse_schema(actors_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    if request.args.get("links", "full") not in EXPORT_LINK_MODES:
+        return jsonify({"error": "Invalid links. Options are full and none"}), 400
+
+    # same filters and search as the listing
+    query, score, filters, error = filter_actors()
+    if error:
+        return jsonify({"error": error}), 400
+
+    # streamed straight from a server-side cursor, no pages
+    return export_response(query, schema, export_format, 'actors', sort_key=score, sort_desc=score is not None)
+
+
 @actors_router.get('/<actor_id>')
+@conditional(lambda actor_id: [entity_key(Actor, actor_id)] + embed_keys(ACTOR_EMBEDS))
 def get_actor(actor_id):
-    # when we refer to it statically 
-    # refer to whole table
-    actor = Actor.query.get(actor_id)
+    # sparse fieldset
+    schema, error = sparse_schema(actor_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
 
-    if actor is None:
+    # embedded relationships
+    embeds, error = parse_embed(ACTOR_EMBEDS, request.args.get("embed"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    if request.args.get("links", "full") not in LINK_MODES:
+        return jsonify({"error": "Invalid links. Options are full, templated and none"}), 400
+
+    # cached, or select just the columns the schema needs, no ORM instance
+    data = fetch_entity(schema, actor_id)
+
+    if data is None:
         return jsonify({"error":"Actor not found"}), 404
-        
-    return actor_schema.dump(actor)
+
+    if embeds:
+        # copy, the cached dict is shared between requests
+        data = dict(data)
+        for name in embeds:
+            embed_related([data], name, *ACTOR_EMBEDS[name])
+        templates = embed_templates(ACTOR_EMBEDS, embeds)
+        if templates:
+            data['_links'] = {**data['_links'], 'embedded': templates}
+
+    return data
 
 
 @actors_router.get('/<actor_id>/films')
+@conditional(lambda actor_id: [entity_key(Actor, actor_id), collection_key(Film), collection_key(film_actor)] + embed_keys(FILM_EMBEDS))
 def get_actor_films(actor_id):
 
-    actor = Actor.query.get(actor_id)
+    # sparse fieldset
+    schema, error = sparse_schema(films_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
 
-    if actor is None:
+    # embedded relationships
+    embeds, error = parse_embed(FILM_EMBEDS, request.args.get("embed"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    if fetch_entity(actor_schema, actor_id) is None:
         return jsonify({"error":"Actor not found"}), 404
     
     # find all films with actor
@@ -105,7 +260,7 @@ def get_actor_films(actor_id):
     # pagination
     result, status = paginate_query(
         query=query,
-        schema=films_schema,
+        schema=schema,
         endpoint='api.actors.get_actor_films',
         actor_id=actor_id
     )
@@ -113,6 +268,13 @@ def get_actor_films(actor_id):
     if status != 200:
         return result,status
 
+    # nest the related rows, one batched query for the whole page
+    for name in embeds:
+        embed_related(result['items'], name, *FILM_EMBEDS[name])
+    templates = embed_templates(FILM_EMBEDS, embeds)
+    if templates:
+        result['_links']['embedded'] = templates
+
     response = {
         'actor_id': actor_id,
         'films': result['items'],
@@ -132,22 +294,60 @@ def create_actor():
         actor = actor_create_update_schema.load(actor_data)
     except ValidationError as err:
         return jsonify(err.messages), 400
-    
-    if hasattr(actor_create_update_schema, "_films_to_associate"):
-        actor.films = actor_create_update_schema._films_to_associate
 
     try:
         # add Actor model object to database
         db.session.add(actor)
+        # flush for the new actor_id, then link the films
+        db.session.flush()
+        film_ids = sync_associations(Actor.films, {actor.actor_id: g.pop('film_changes', None)})
         # update database
         db.session.commit()
-        # serialize created actor, outputted to user
-        return jsonify(actor_schema.dump(actor)), 201
     except Exception as e:
         # rollback current transaction
         db.session.rollback()
         return jsonify({"error": "Failed to create actor"}), 500
 
+    invalidate_actors([actor.actor_id], film_ids)
+    # serialize created actor, outputted to user
+    return jsonify(actor_schema.dump(actor)), 201
+
+
+@actors_router.post('/bulk')
+def create_actors_bulk():
+    return write_actors_bulk(partial=False)
+
+
+@actors_router.patch('/bulk')
+def edit_actors_bulk():
+    return write_actors_bulk(partial=True)
+
+
+def write_actors_bulk(partial):
+    # get json data from request, an array of actors
+    actors_data = request.json
+    max_items = current_app.config['BULK_MAX_ITEMS']
+
+    if not isinstance(actors_data, list) or not actors_data:
+        return jsonify({"error": "Expected a non-empty array of actors"}), 400
+
+    if len(actors_data) > max_items:
+        return jsonify({"error": f"At most {max_items} actors per request"}), 413
+
+    try:
+        # validate everything, then batched INSERT/UPDATEs in one transaction
+        results, actor_ids, film_ids = bulk_write(
+            Actor, actor_bulk_schema, Actor.films, 'film_ids', actors_data, partial=partial
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return jsonify({"error": "Failed to write actors"}), 500
+
+    invalidate_actors(actor_ids, film_ids)
+    response, status = bulk_response(results, 'actor', actor_schema)
+    return jsonify(response), status
+
 
 @actors_router.put('/<actor_id>')
 def replace_actor(actor_id):
@@ -159,7 +359,6 @@ def replace_actor(actor_id):
     if old_actor is None:
         return jsonify({"error":"Actor not found"}), 404
 
-
     try:
         # check that it fits with schema
         updated_actor = actor_create_update_schema.load(
@@ -167,19 +366,21 @@ def replace_actor(actor_id):
             instance = old_actor,
             partial = False
         )
-        if hasattr(actor_create_update_schema, "_films_to_associate"):
-            updated_actor.films = actor_create_update_schema._films_to_associate
     except ValidationError as err:
         return jsonify(err.messages), 400
     
     try:
+        # a replacement without film_ids unlinks every film, only the changed film_actor rows are written
+        film_ids = sync_associations(Actor.films, {old_actor.actor_id: full_replacement(g.pop('film_changes', None))})
         db.session.commit()
-        return jsonify(actor_schema.dump(old_actor)), 200
     except:
         # rollback current transaction
         db.session.rollback()
         return jsonify({"error": "Failed to replace actor"}), 500
 
+    invalidate_actors([actor_id], film_ids)
+    return jsonify(actor_schema.dump(old_actor)), 200
+
 
 @actors_router.patch('/<actor_id>')
 def edit_actor(actor_id):
@@ -190,7 +391,6 @@ def edit_actor(actor_id):
     if old_actor is None:
         return jsonify({"error":"Actor not found"}), 404
 
-
     try:
         # check that it fits with schema
         updated_actor = actor_create_update_schema.load(
@@ -198,19 +398,21 @@ def edit_actor(actor_id):
             instance = old_actor,
             partial=True
         )
-        if hasattr(actor_create_update_schema, "_films_to_associate"):
-            updated_actor.films = actor_create_update_schema._films_to_associate
     except ValidationError as err:
         return jsonify(err.messages), 400
     
     try:
+        # only the film_actor rows that actually change are written
+        film_ids = sync_associations(Actor.films, {old_actor.actor_id: g.pop('film_changes', None)})
         db.session.commit()
-        return jsonify(actor_schema.dump(old_actor)), 200
     except:
         # rollback current transaction
         db.session.rollback()
         return jsonify({"error": "Failed to update actor"}), 500
 
+    invalidate_actors([actor_id], film_ids)
+    return jsonify(actor_schema.dump(old_actor)), 200
+
 
 
 @actors_router.delete('/<actor_id>')
@@ -221,8 +423,12 @@ def delete_actor(actor_id):
     if actor is None:
         return jsonify({"Error": "Actor not found"}), 404
 
+    # unlink with one DELETE, so the ORM has no films left to load
+    film_ids = sync_associations(Actor.films, {actor.actor_id: AssociationChange(set(), set(), set())})
+
     # delete
     db.session.delete(actor)
     db.session.commit()
+    invalidate_actors([actor_id], film_ids)
     return jsonify({}), 204
     
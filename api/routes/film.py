@@ -1,17 +1,30 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, g, request, jsonify
 from marshmallow import ValidationError
 
-from api.models import db
-from api.models.film import Film
+from api.models import db, film_actor
+from api.models.film import Film, FEATURE_MATCH_MODES, features_mask, mask_filter
 from api.models.actor import Actor
 
 from api.schemas.film import (
     film_schema, 
     films_schema, 
-    film_create_update_schema
+    film_create_update_schema,
+    film_bulk_schema
 )
 from api.schemas.actor import actors_schema
 from api.utils.pagination import paginate_query
+from api.utils.aggregates import actor_stats, film_stats
+from api.utils.associations import AssociationChange, full_replacement, sync_associations
+from api.utils.bulk import bulk_response, bulk_write
+from api.utils.counts import count_cache
+from api.utils.entities import entity_cache, fetch_entity
+from api.utils.etags import conditional
+from api.utils.exports import EXPORT_FORMATS, EXPORT_LINK_MODES, export_response
+from api.utils.embeds import ACTOR_EMBEDS, FILM_EMBEDS, embed_keys, embed_related, embed_templates, parse_embed
+from api.utils.fields import sparse_schema
+from api.utils.links import LINK_MODES
+from api.utils.search import MAX_SEARCH_LENGTH, apply_search
+from api.utils.versions import collection_key, entity_key, versions
 
 # here we implement a RESTFul "actors" resource
 
@@ -19,10 +32,42 @@ from api.utils.pagination import paginate_query
 # we can insert this into our Flask app
 films_router = Blueprint('films',__name__, url_prefix ='/films')
 
+# listings whose cached totals change when a film is written
+COUNT_ENDPOINTS = (
+    'api.films.get_all_films',
+    'api.actors.get_actor_films',
+    'api.films.get_film_actors'
+)
 
-@films_router.get('')
-def get_all_films():
 
+def invalidate_films(film_ids=(), actor_ids=()):
+    """
+    drop everything cached about written films and bump the ETag versions
+
+    actor_ids are the actors on either side of the films' association changes
+    """
+    count_cache.invalidate(*COUNT_ENDPOINTS)
+    entity_cache.invalidate(Film, *film_ids)
+    entity_cache.invalidate(Actor, *actor_ids)
+    versions.bump(
+        collection_key(Film),
+        collection_key(film_actor),
+        *[entity_key(Film, film_id) for film_id in set(film_ids)],
+        *[entity_key(Actor, actor_id) for actor_id in set(actor_ids)]
+    )
+    # the /stats summaries follow the written rows
+    film_stats.refresh(film_ids)
+    actor_stats.refresh(actor_ids)
+
+
+def filter_films():
+    """
+    film query with the filters and ?q= search of the request applied,
+    shared by the listing and the export
+
+    returns:
+        (query, search score or None, filter params for links, error message)
+    """
     release_year = request.args.get("release_year", type=int)
     language_id = request.args.get("language_id", type=int)
     original_language_id = request.args.get("original_language_id", type=int)
@@ -32,7 +77,8 @@ def get_all_films():
     replacement_cost = request.args.get("replacement_cost", type=float)
     rating = request.args.get("rating")
     special_features = request.args.get("special_features")
-
+    special_features_match = request.args.get("special_features_match", "all")
+    q = request.args.get("q")
 
     # start query
     query = Film.query
@@ -41,82 +87,127 @@ def get_all_films():
     filter_conditions = []
 
     # validate queries
+
+    if q and len(q) > MAX_SEARCH_LENGTH:
+        return None, None, None, "Invalid search length"
     
     if release_year is not None:
         if release_year < 1850 or release_year > 2025:
-            return jsonify({"error": "Invalid release year. Must be between 1850 and present year"}), 400
+            return None, None, None, "Invalid release year. Must be between 1850 and present year"
         filter_conditions.append(Film.release_year == release_year)
 
     if language_id is not None:
         if language_id <= 0:
-            return jsonify({"error": "Invalid language id"}), 400
+            return None, None, None, "Invalid language id"
         filter_conditions.append(Film.language_id == language_id)
 
     if original_language_id is not None:
         if original_language_id <= 0:
-            return jsonify({"error": "Invalid language id"}), 400
+            return None, None, None, "Invalid language id"
         filter_conditions.append(Film.original_language_id == original_language_id)
 
     if rental_duration is not None:
         if rental_duration <= 0:
-            return jsonify({"error": "Invalid rental duration"}), 400
+            return None, None, None, "Invalid rental duration"
         filter_conditions.append(Film.rental_duration == rental_duration)
 
     if rental_rate is not None:
         if rental_rate <= 0:
-            return jsonify({"error": "Invalid rental rate"}), 400
+            return None, None, None, "Invalid rental rate"
         filter_conditions.append(Film.rental_rate == rental_rate)
 
     if length is not None:
         if length <= 0:
-            return jsonify({"error": "Invalid length"}), 400
+            return None, None, None, "Invalid length"
         filter_conditions.append(Film.length == length)
 
     if replacement_cost is not None:
         if replacement_cost <= 0:
-            return jsonify({"error": "Invalid replacement cost"}), 400
+            return None, None, None, "Invalid replacement cost"
         filter_conditions.append(Film.replacement_cost == replacement_cost)
 
     if rating is not None:
         if rating not in ['G', 'PG', 'PG-13', 'R', 'NC-17']:
-            return jsonify({"error": "Invalid rating. Options are G, PG, PG-13, R and NC-17"}), 400
+            return None, None, None, "Invalid rating. Options are G, PG, PG-13, R and NC-17"
         filter_conditions.append(Film.rating == rating)
 
     if special_features:
 
-        all_features = {'Trailers', 'Commentaries', 'Deleted Scenes', 'Behind the Scenes'}
-        requested_features = [feat.strip() for feat in special_features.split(",")]
-        
+        if special_features_match not in FEATURE_MATCH_MODES:
+            return None, None, None, "Invalid special features match. Options are any, all and none"
+
         # validate
-        if not set(requested_features).issubset(all_features):
-            return jsonify({"error": "Invalid special feature"}), 400
-        
-        # one filter per requested feature
-        for feature in requested_features:
-            filter_conditions.append(Film.special_features.ilike(f'%{feature}%'))
+        try:
+            bits = features_mask(feat.strip() for feat in special_features.split(","))
+        except KeyError:
+            return None, None, None, "Invalid special feature"
+
+        # one indexed lookup on the bitmask column instead of a string match per feature
+        filter_conditions.append(mask_filter(bits, special_features_match))
 
     # apply all filters with AND logic
     if filter_conditions:
         query = query.filter(db.and_(*filter_conditions))
 
+    # full-text search over title and description, ranked by relevance
+    score = None
+    if q and q.strip():
+        query, score = apply_search(query, Film, [Film.title, Film.description], q)
+
+    filters = {
+        'q': q,
+        'release_year': release_year,
+        'language_id': language_id,
+        'original_language_id': original_language_id,
+        'rental_duration': rental_duration,
+        'rental_rate': rental_rate,
+        'length': length,
+        'replacement_cost': replacement_cost,
+        'rating': rating,
+        'special_features': special_features,
+        'special_features_match': special_features_match if special_features else None
+    }
+    return query, score, filters, None
+
+
+@films_router.get('')
+@conditional(lambda: [collection_key(Film)] + embed_keys(FILM_EMBEDS))
+def get_all_films():
+
+    # sparse fieldset
+    schema, error = sparse_schema(films_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    # embedded relationships
+    embeds, error = parse_embed(FILM_EMBEDS, request.args.get("embed"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    # filters and search
+    query, score, filters, error = filter_films()
+    if error:
+        return jsonify({"error": error}), 400
+
     # apply pagination
     result,status = paginate_query(
         query=query,
-        schema=films_schema,
+        schema=schema,
         endpoint='api.films.get_all_films',
+        sort_key=score,
+        sort_desc=score is not None,
         # include search param in pagination links
-        release_year=release_year,
-        language_id=language_id,
-        original_language_id=original_language_id,
-        rental_duratio=rental_duration,
-        rental_rate=rental_rate,
-        length=length,
-        replacement_cost=replacement_cost,
-        rating=rating,
-        special_features=special_features
+        **filters
     )
     if status != 200:
         return result,status
+
+    # nest the related rows, one batched query for the whole page
+    for name in embeds:
+        embed_related(result['items'], name, *FILM_EMBEDS[name])
+    templates = embed_templates(FILM_EMBEDS, embeds)
+    if templates:
+        result['_links']['embedded'] = templates
         
 
     # rename 'items' to 'actors' for clarity
@@ -129,23 +220,87 @@ def get_all_films():
     return jsonify(response), status
 
 
+# catalog aggregates from the in-process summary (see api.utils.aggregates),
+# no table scan per request
+@films_router.get('/stats')
+def get_film_stats():
+    return jsonify(film_stats.snapshot()), 200
+
+
+@films_router.get('/export')
+@conditional(lambda: [collection_key(Film)])
+def export_films():
+
+    # ndjson (default) or csv
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "Invalid format. Options are ndjson and csv"}), 400
+
+    # sparse fieldset
+    schema, error = sparse_schema(films_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    if request.args.get("links", "full") not in EXPORT_LINK_MODES:
+        return jsonify({"error": "Invalid links. Options are full and none"}), 400
+
+    # same filters and search as the listing
+    query, score, filters, error = filter_films()
+    if error:
+        return jsonify({"error": error}), 400
+
+    # streamed straight from a server-side cursor, no pages
+    return export_response(query, schema, export_format, 'films', sort_key=score, sort_desc=score is not None)
+
+
 @films_router.get('/<film_id>')
+@conditional(lambda film_id: [entity_key(Film, film_id)] + embed_keys(FILM_EMBEDS))
 def get_film(film_id):
-    # when we refer to it statically 
-    # refer to whole table
-    film = Film.query.get(film_id)
+    # sparse fieldset
+    schema, error = sparse_schema(film_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
 
-    if film is None:
+    # embedded relationships
+    embeds, error = parse_embed(FILM_EMBEDS, request.args.get("embed"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    if request.args.get("links", "full") not in LINK_MODES:
+        return jsonify({"error": "Invalid links. Options are full, templated and none"}), 400
+
+    # cached, or select just the columns the schema needs, no ORM instance
+    data = fetch_entity(schema, film_id)
+
+    if data is None:
         return jsonify({"error":"Film not found"}), 404
-        
-    return film_schema.dump(film)
+
+    if embeds:
+        # copy, the cached dict is shared between requests
+        data = dict(data)
+        for name in embeds:
+            embed_related([data], name, *FILM_EMBEDS[name])
+        templates = embed_templates(FILM_EMBEDS, embeds)
+        if templates:
+            data['_links'] = {**data['_links'], 'embedded': templates}
+
+    return data
 
 @films_router.get('/<film_id>/actors')
+@conditional(lambda film_id: [entity_key(Film, film_id), collection_key(Actor), collection_key(film_actor)] + embed_keys(ACTOR_EMBEDS))
 def get_film_actors(film_id):
 
-    film = Film.query.get(film_id)
+    # sparse fieldset
+    schema, error = sparse_schema(actors_schema, request.args.get("fields"))
+    if error:
+        return jsonify({"error": error}), 400
 
-    if film is None:
+    # embedded relationships
+    embeds, error = parse_embed(ACTOR_EMBEDS, request.args.get("embed"))
+    if error:
+        return jsonify({"error": error}), 400
+
+    if fetch_entity(film_schema, film_id) is None:
         return jsonify({"error":"Film not found"}), 404
     
     query = Actor.query.join(Film.actors).filter(Film.film_id == film_id)
@@ -153,7 +308,7 @@ def get_film_actors(film_id):
     # apply pagination
     result,status = paginate_query(
         query=query,
-        schema=actors_schema,
+        schema=schema,
         endpoint='api.films.get_film_actors',
         film_id=film_id
     )
@@ -161,6 +316,13 @@ def get_film_actors(film_id):
     if status != 200:
         return result,status
 
+    # nest the related rows, one batched query for the whole page
+    for name in embeds:
+        embed_related(result['items'], name, *ACTOR_EMBEDS[name])
+    templates = embed_templates(ACTOR_EMBEDS, embeds)
+    if templates:
+        result['_links']['embedded'] = templates
+
     # rename 'items' to 'actors' for clarity
     response = {
         'film_id': film_id,
@@ -183,22 +345,59 @@ def create_film():
     except ValidationError as err:
         return jsonify(err.messages), 400
 
-    if hasattr(film_create_update_schema, "_actors_to_associate"):
-        film.actors = film_create_update_schema._actors_to_associate
-
 
     try:
         # add to database
         db.session.add(film)
+        # flush for the new film_id, then link the actors
+        db.session.flush()
+        actor_ids = sync_associations(Film.actors, {film.film_id: g.pop('actor_changes', None)})
         # update database
         db.session.commit()
-        # serialise created film, outputted to user
-        return jsonify(film_schema.dump(film)), 201
-
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": "Failed to update film"}), 500
 
+    invalidate_films([film.film_id], actor_ids)
+    # serialise created film, outputted to user
+    return jsonify(film_schema.dump(film)), 201
+
+@films_router.post('/bulk')
+def create_films_bulk():
+    return write_films_bulk(partial=False)
+
+
+@films_router.patch('/bulk')
+def edit_films_bulk():
+    return write_films_bulk(partial=True)
+
+
+def write_films_bulk(partial):
+    # get json data from request, an array of films
+    films_data = request.json
+    max_items = current_app.config['BULK_MAX_ITEMS']
+
+    if not isinstance(films_data, list) or not films_data:
+        return jsonify({"error": "Expected a non-empty array of films"}), 400
+
+    if len(films_data) > max_items:
+        return jsonify({"error": f"At most {max_items} films per request"}), 413
+
+    try:
+        # validate everything, then batched INSERT/UPDATEs in one transaction
+        results, film_ids, actor_ids = bulk_write(
+            Film, film_bulk_schema, Film.actors, 'actor_ids', films_data, partial=partial
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return jsonify({"error": "Failed to write films"}), 500
+
+    invalidate_films(film_ids, actor_ids)
+    response, status = bulk_response(results, 'film', film_schema)
+    return jsonify(response), status
+
+
 @films_router.put('/<film_id>')
 def replace_film(film_id):
     
@@ -216,19 +415,21 @@ def replace_film(film_id):
             instance=old_film,
             partial = False
         )
-        if hasattr(film_create_update_schema, "_actors_to_associate"):
-            updated_film.actors = film_create_update_schema._actors_to_associate
     except ValidationError as err:
         return jsonify(err.messages), 400
     
     try:
+        # a replacement without actor_ids unlinks every actor, only the changed film_actor rows are written
+        actor_ids = sync_associations(Film.actors, {old_film.film_id: full_replacement(g.pop('actor_changes', None))})
         db.session.commit()
-        return jsonify(film_schema.dump(old_film)), 200
     except:
         # rollback current transaction
         db.session.rollback()
         return jsonify({"error": "Failed to replace film"}), 500
 
+    invalidate_films([film_id], actor_ids)
+    return jsonify(film_schema.dump(old_film)), 200
+
 
 @films_router.patch('/<film_id>')
 def edit_film(film_id):
@@ -247,19 +448,21 @@ def edit_film(film_id):
             instance=old_film,
             partial=True
         )
-        if hasattr(film_create_update_schema, "_actors_to_associate"):
-            updated_film.actors = film_create_update_schema._actors_to_associate
     except ValidationError as err:
         return jsonify(err.messages), 400
     
     try:
+        # only the film_actor rows that actually change are written
+        actor_ids = sync_associations(Film.actors, {old_film.film_id: g.pop('actor_changes', None)})
         db.session.commit()
-        return jsonify(film_schema.dump(old_film)), 200
     except:
         # rollback current transaction
         db.session.rollback()
         return jsonify({"error": "Failed to replace film"}), 500
 
+    invalidate_films([film_id], actor_ids)
+    return jsonify(film_schema.dump(old_film)), 200
+
 
 @films_router.delete('/<film_id>')
 def delete_film(film_id):
@@ -268,8 +471,12 @@ def delete_film(film_id):
 
     if film is None:
         return jsonify({"Error":"Film not found"}), 404
+
+    # unlink with one DELETE, so the ORM has no actors left to load
+    actor_ids = sync_associations(Film.actors, {film.film_id: AssociationChange(set(), set(), set())})
     
     db.session.delete(film)
     db.session.commit()
+    invalidate_films([film_id], actor_ids)
     return jsonify({}), 204
 
@@ -1,16 +1,25 @@
+from flask import g
 from marshmallow import fields, post_dump, ValidationError, validates_schema
 from api.models.actor import Actor
 from api.models.film import Film
 from api.models import db
 
 from api.schemas import ma
-from flask import url_for, jsonify
+from api.utils.associations import association_change, existing_ids
+from api.utils.links import item_links
+from api.utils.timing import TimedDump
+
+# rel -> (endpoint, url parameter) for the _links of every serialized actor
+ACTOR_LINKS = {
+    "self": ("api.actors.get_actor", "actor_id"),
+    "films": ("api.actors.get_actor_films", "actor_id")
+}
 
 # inherit from Marshmallow class -> serializer
  
 #  auto-generate a schema for getting Actor models
 # can use this serialize and validate actor data
-class ActorSchema(ma.SQLAlchemyAutoSchema):
+class ActorSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Actor
         # makes load() return model instance
@@ -18,24 +27,20 @@ class ActorSchema(ma.SQLAlchemyAutoSchema):
         # exclude films this actor is in in serialization (as only want it as link)
         exclude = ['films']  
         
+    link_spec = ACTOR_LINKS
 
     # after serializing
     @post_dump
-    def add_links(self, data, **kwargs):
-        data['_links'] = {
-            "self": {
-                "href": url_for("api.actors.get_actor", actor_id=data['actor_id'], _external=True)
-            },
-            "films": {
-                "href": url_for("api.actors.get_actor_films", actor_id=data['actor_id'], _external=True)
-            }
-        }
+    def add_links(self, data, many=False, **kwargs):
+        links = item_links(self.link_spec, data, many)
+        if links is not None:
+            data['_links'] = links
         return data
 
 
 #  auto-generate a schema for getting Actor models
 # can use this serialize and validate actor data
-class ActorCreateUpdateSchema(ma.SQLAlchemyAutoSchema):
+class ActorCreateUpdateSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Actor
         # makes load() return model instance
@@ -47,46 +52,53 @@ class ActorCreateUpdateSchema(ma.SQLAlchemyAutoSchema):
     
     # accept list of film IDs for creating/updating relationships
     film_ids = fields.List(fields.Integer(), allow_none=True)
+    # or link/unlink single films without sending the whole list
+    add_film_ids = fields.List(fields.Integer())
+    remove_film_ids = fields.List(fields.Integer())
+
+    link_spec = ACTOR_LINKS
 
 
     @validates_schema
     def validate_and_associate_films(self, data, **kwargs):
-        # process film IDs before loading
-        film_ids = data.pop('film_ids', [])
+        # process film IDs before loading, None when the films are left as they are
+        change = association_change(data, 'film_ids')
 
-        # validate film IDs
-        if film_ids:
-            # get IDs of all films that exist in our database
-            existing_films = Film.query.filter(Film.film_id.in_(film_ids)).all()
-            existing_film_ids = [f.film_id for f in existing_films]
-
-            invalid_ids = [f_id for f_id in film_ids if f_id not in existing_film_ids]
+        # validate film IDs (only the ids, no Film objects)
+        if change is not None:
+            requested = (change.replace or set()) | change.add
+            invalid_ids = sorted(requested - existing_ids(Film.film_id, requested))
 
             if invalid_ids:
                 raise ValidationError(f"Invalid film IDs: {invalid_ids}")
 
-            # store films (NB not IDs), add to actor object later
-            self._films_to_associate = existing_films
-        else:
-            self._films_to_associate = []
+        # the schema is shared by every request, the change goes on the request's g
+        # and the route applies it as a diff against film_actor
+        g.film_changes = change
 
     # after serializing
     @post_dump
-    def add_links(self, data, **kwargs):
-        data['_links'] = {
-            "self": {
-                "href": url_for("api.actors.get_actor", actor_id=data['actor_id'], _external=True)
-            },
-            "films": {
-                "href": url_for("api.actors.get_actor_films", actor_id=data['actor_id'], _external=True)
-            }
-        }
+    def add_links(self, data, many=False, **kwargs):
+        links = item_links(self.link_spec, data, many)
+        if links is not None:
+            data['_links'] = links
         return data
     
 
 
+# bulk create/update: plain dicts, the route checks the film ids of the whole batch at once
+class ActorBulkSchema(ActorCreateUpdateSchema):
+    class Meta(ActorCreateUpdateSchema.Meta):
+        load_instance = False
+
+    # replaces the per actor validates_schema hook, which queries the films
+    def validate_and_associate_films(self, data, **kwargs):
+        pass
+
+
 # for get requests
 actor_schema = ActorSchema()
 actors_schema = ActorSchema(many=True)
 # for post/put/patch requests
-actor_create_update_schema = ActorCreateUpdateSchema()
\ No newline at end of file
+actor_create_update_schema = ActorCreateUpdateSchema()
+actor_bulk_schema = ActorBulkSchema()
\ No newline at end of file
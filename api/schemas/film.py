@@ -1,22 +1,32 @@
+from flask import g
 from marshmallow import fields, validates, ValidationError, post_dump, validates_schema
-from api.models.film import Film
+from api.models.film import Film, FEATURE_BITS
 from api.models.actor import Actor
 
 from api.schemas import ma
-from flask import url_for
 from api.models import db
+from api.utils.associations import association_change, existing_ids
+from api.utils.links import item_links
+from api.utils.timing import TimedDump
+
+# rel -> (endpoint, url parameter) for the _links of every serialized film
+FILM_LINKS = {
+    "self": ("api.films.get_film", "film_id"),
+    "actors": ("api.films.get_film_actors", "film_id")
+}
 
 # inherit from Marshmallow class -> serializer
  
 #  auto-generate a schema for Actor models
 # can use this serialize and validate actor data
-class FilmSchema(ma.SQLAlchemyAutoSchema):
+class FilmSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Film
         # makes load() return model instance
         load_instance = True
         # exclude actors from the default serialization
-        exclude = ['actors']  
+        # the feature bitmask is internal, clients only see special_features
+        exclude = ['actors', 'special_features_mask']  
         sqla_session = db.session
 
     ### validation
@@ -33,17 +43,13 @@ class FilmSchema(ma.SQLAlchemyAutoSchema):
     rating = fields.String(required=False, allow_none=True)
     special_features = fields.String(required=False, allow_none=True)
 
+    link_spec = FILM_LINKS
 
     @post_dump
-    def add_links(self, data, **kwargs):
-        data['_links'] = {
-            "self": {
-                "href": url_for("api.films.get_film", film_id=data['film_id'], _external=True)
-            },
-            "actors": {
-                "href": url_for("api.films.get_film_actors", film_id=data['film_id'], _external=True)
-            },
-        }
+    def add_links(self, data, many=False, **kwargs):
+        links = item_links(self.link_spec, data, many)
+        if links is not None:
+            data['_links'] = links
         return data
 
 
@@ -105,27 +111,25 @@ class FilmSchema(ma.SQLAlchemyAutoSchema):
 
     @validates("special_features")
     def validate_special_features(self, value, **kwargs):
-        # all allowable features
-        all_features = {'Trailers', 'Commentaries', 'Deleted Scenes', 'Behind the Scenes'}
-        
-        # split string input, trim extra whitespace and create set from it
-        value = set(value.split(","))
-
-        # check input set is subset of all features set
-        if not value.issubset(all_features):
+        # every comma separated feature has to be one of the allowed ones
+        if not FEATURE_BITS.keys() >= set(value.split(",")):
             raise ValidationError("Invalid special features. Options are: Trailers, Commentaries, Deleted Scenes, Behind the Scenes. Please separate all features with commas.")
 
-class FilmCreateUpdateSchema(ma.SQLAlchemyAutoSchema):
+class FilmCreateUpdateSchema(TimedDump, ma.SQLAlchemyAutoSchema):
     class Meta:
         model = Film
         # makes load() return model instance
         load_instance = True
         # exclude actors from the default serialization
-        exclude = ['actors']  
+        # the feature bitmask is internal, clients only see special_features
+        exclude = ['actors', 'special_features_mask']  
         sqla_session = db.session
 
     # accept list of actor IDs for creating/updating relationships
     actor_ids = fields.List(fields.Integer(), allow_none=True)
+    # or add/remove single cast members without sending the whole list
+    add_actor_ids = fields.List(fields.Integer())
+    remove_actor_ids = fields.List(fields.Integer())
     
     ### validation
     
@@ -141,6 +145,7 @@ class FilmCreateUpdateSchema(ma.SQLAlchemyAutoSchema):
     rating = fields.String(required=False, allow_none=True)
     special_features = fields.String(required=False, allow_none=True)
 
+    link_spec = FILM_LINKS
 
     # check title length
     @validates("title")
@@ -200,55 +205,52 @@ class FilmCreateUpdateSchema(ma.SQLAlchemyAutoSchema):
 
     @validates("special_features")
     def validate_special_features(self, value, **kwargs):
-        # all allowable features
-        all_features = {'Trailers', 'Commentaries', 'Deleted Scenes', 'Behind the Scenes'}
-        
-        # split string input, trim extra whitespace and create set from it
-        value = set(value.split(","))
-
-        # check input set is subset of all features set
-        if not value.issubset(all_features):
+        # every comma separated feature has to be one of the allowed ones
+        if not FEATURE_BITS.keys() >= set(value.split(",")):
             raise ValidationError("Invalid special features. Options are: Trailers, Commentaries, Deleted Scenes, Behind the Scenes. Please separate all features with commas.")
 
 
     @validates_schema
     def validate_and_associate_actors(self, data, **kwargs):
-        actor_ids = data.pop('actor_ids', [])
+        # None when the cast is left as it is
+        change = association_change(data, 'actor_ids')
         
-        # validate actor IDs
-        if actor_ids:
-            # get IDs of all actors that exist in our database
-            existing_actors = Actor.query.filter(Actor.actor_id.in_(actor_ids)).all()
-            existing_actor_ids = [a.actor_id for a in existing_actors]
-
-            invalid_ids = [a_id for a_id in actor_ids if a_id not in existing_actor_ids]
+        # validate actor IDs (only the ids, no Actor objects)
+        if change is not None:
+            requested = (change.replace or set()) | change.add
+            invalid_ids = sorted(requested - existing_ids(Actor.actor_id, requested))
 
             if invalid_ids:
-                raise ValidationError({"actor_ids":f"Invalid actor IDs: {actor_ids}"})
+                raise ValidationError({"actor_ids":f"Invalid actor IDs: {invalid_ids}"})
             
-            # store actors (NB not IDs), add to film instance later
-            self._actors_to_associate = existing_actors
-        else:
-            self._actors_to_associate =[]
+        # the schema is shared by every request, the change goes on the request's g
+        # and the route applies it as a diff against film_actor
+        g.actor_changes = change
         
 
 
     @post_dump
-    def add_links(self, data, **kwargs):
-        data['_links'] = {
-            "self": {
-                "href": url_for("api.films.get_film", film_id=data['film_id'], _external=True)
-            },
-            "actors": {
-                "href": url_for("api.films.get_film_actors", film_id=data['film_id'], _external=True)
-            },
-        }
+    def add_links(self, data, many=False, **kwargs):
+        links = item_links(self.link_spec, data, many)
+        if links is not None:
+            data['_links'] = links
         return data
 
 
 
+# bulk create/update: plain dicts, the route checks the actor ids of the whole batch at once
+class FilmBulkSchema(FilmCreateUpdateSchema):
+    class Meta(FilmCreateUpdateSchema.Meta):
+        load_instance = False
+
+    # replaces the per film validates_schema hook, which queries the actors
+    def validate_and_associate_actors(self, data, **kwargs):
+        pass
+
+
 # get requests
 film_schema = FilmSchema()
 films_schema = FilmSchema(many=True)
 # create/update requests
-film_create_update_schema = FilmCreateUpdateSchema()
\ No newline at end of file
+film_create_update_schema = FilmCreateUpdateSchema()
+film_bulk_schema = FilmBulkSchema()
\ No newline at end of file
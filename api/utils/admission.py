@@ -0,0 +1,408 @@
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+from api.utils.asgi import blocking, on_event_loop, sleep
+
+# redis is optional, without it (or without ADMISSION_REDIS_URL) every worker keeps its own limits
+try:
+    import redis
+except ImportError:
+    redis = None
+
+log = logging.getLogger(__name__)
+
+# requests of these blueprints go through admission, the /api/cache, /api/pool and
+# /api/metrics endpoints never touch the pool for long and stay reachable under load
+BLUEPRINTS = ('api.actors', 'api.films')
+
+# rough cost of a request relative to get_actor, ADMISSION_WEIGHTS overrides these.
+# listings also pay for the rows they ask for, see request_cost
+DEFAULT_WEIGHTS = {
+    'api.actors.get_all_actors': 2,
+    'api.films.get_all_films': 2,
+    'api.actors.get_actor_films': 2,
+    'api.films.get_film_actors': 2,
+    'api.actors.export_actors': 20,
+    'api.films.export_films': 20,
+    'api.actors.create_actors_bulk': 10,
+    'api.actors.edit_actors_bulk': 10,
+    'api.films.create_films_bulk': 10,
+    'api.films.edit_films_bulk': 10
+}
+
+# token buckets of clients not seen for a while are full again and can go, this bounds memory
+MAX_CLIENTS = 100000
+
+
+class LocalBackend:
+    """
+    limits of this worker only
+    """
+
+    poll_interval = 0.01   # seconds, of requests queued on the event loop (asgi.py)
+
+    def __init__(self):
+        self._buckets = OrderedDict()
+        self._in_flight = 0
+        self._released = threading.Condition()
+
+    def take(self, client, cost, rate, burst):
+        """
+        take `cost` tokens from the client's bucket, returns 0 or the seconds until
+        there are enough of them
+        """
+        now = time.monotonic()
+        with self._released:
+            tokens, last = self._buckets.pop(client, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[client] = (tokens, now)
+            if len(self._buckets) > MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, client, cost, burst):
+        """
+        give back tokens taken by a request that was not admitted after all
+        """
+        with self._released:
+            bucket = self._buckets.get(client)
+            if bucket is not None:
+                tokens, last = bucket
+                self._buckets[client] = (min(burst, tokens + cost), last)
+
+    def acquire(self, cost, capacity):
+        """
+        non blocking, returns a slot to release or None when the capacity is used up
+        """
+        with self._released:
+            if self._in_flight + cost > capacity:
+                return None
+            self._in_flight += cost
+            return cost
+
+    def release(self, slot):
+        with self._released:
+            self._in_flight -= slot
+            self._released.notify_all()
+
+    def wait(self, timeout):
+        """
+        block until some slot is released or `timeout` seconds passed
+        """
+        if on_event_loop():
+            # the condition would block the loop, and with it the requests holding the slots
+            sleep(min(timeout, self.poll_interval))
+            return
+        with self._released:
+            self._released.wait(timeout)
+
+    def in_flight(self):
+        return self._in_flight
+
+
+# token bucket in a hash, the server's clock so every worker agrees on the time
+_TAKE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'last')
+local tokens = tonumber(bucket[1]) or burst
+local last = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - last) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+# tokens back into a bucket, a bucket that expired in the meantime is full anyway
+_REFUND = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', math.min(tonumber(ARGV[2]), tokens + tonumber(ARGV[1])))
+end
+return 1
+"""
+
+# slots are "<id>:<cost>" members scored by the time they expire, so slots of a
+# worker that died holding them are dropped after ADMISSION_SLOT_TTL
+_ACQUIRE = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local used = 0
+for _, member in ipairs(redis.call('ZRANGE', KEYS[1], 0, -1)) do
+    used = used + tonumber(string.match(member, ':(%d+)$'))
+end
+if used + tonumber(ARGV[2]) > tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[4]), ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+class RedisBackend:
+    """
+    limits shared by every worker using the same redis
+
+    queued requests poll for a free slot. when redis can not be reached requests
+    are let through (and logged), the limits must not take the api down with them.
+    on the event loop (asgi.py) the redis calls run in a worker thread
+    """
+
+    poll_interval = 0.01   # seconds
+
+    def __init__(self, url, slot_ttl, prefix='sakila:admission:'):
+        self.client = redis.Redis.from_url(url)
+        self.slot_ttl = slot_ttl
+        self.prefix = prefix
+        self._take = self.client.register_script(_TAKE)
+        self._refund = self.client.register_script(_REFUND)
+        self._acquire = self.client.register_script(_ACQUIRE)
+
+    def take(self, client, cost, rate, burst):
+        try:
+            return float(blocking(self._take, keys=[f'{self.prefix}bucket:{client}'], args=[rate, burst, cost]))
+        except redis.RedisError as err:
+            log.warning('admission rate limit skipped, redis error: %s', err)
+            return 0
+
+    def refund(self, client, cost, burst):
+        try:
+            blocking(self._refund, keys=[f'{self.prefix}bucket:{client}'], args=[cost, burst])
+        except redis.RedisError as err:
+            log.warning('admission tokens not refunded, redis error: %s', err)
+
+    def acquire(self, cost, capacity):
+        slot = f'{uuid.uuid4().hex}:{cost}'
+        try:
+            admitted = blocking(
+                self._acquire, keys=[f'{self.prefix}slots'], args=[slot, cost, capacity, self.slot_ttl]
+            )
+        except redis.RedisError as err:
+            log.warning('admission concurrency limit skipped, redis error: %s', err)
+            return ''
+        return slot if admitted else None
+
+    def release(self, slot):
+        if not slot:
+            return
+        try:
+            blocking(self.client.zrem, f'{self.prefix}slots', slot)
+        except redis.RedisError as err:
+            log.warning('admission slot not released, redis error: %s', err)
+
+    def wait(self, timeout):
+        sleep(min(timeout, self.poll_interval))
+
+    def in_flight(self):
+        try:
+            slots = blocking(self.client.zrangebyscore, f'{self.prefix}slots', time.time(), '+inf')
+        except redis.RedisError:
+            return None
+        return sum(int(slot.rsplit(b':', 1)[1]) for slot in slots)
+
+
+class AdmissionControl:
+    """
+    per client token bucket rate limit in front of a weighted concurrency limit
+    with a bounded wait queue
+
+    a request costs its endpoint's weight (see request_cost) in tokens and in
+    concurrency. over the rate it gets a 429, when the concurrency is used up it
+    waits in the queue for up to queue_timeout seconds, and gets a 503 when the
+    queue is full or the wait runs out. both come with Retry-After
+    """
+
+    def __init__(self):
+        self.backend = LocalBackend()
+        self.rate = 0
+        self.burst = 0
+        self.capacity = 0
+        self.queue_size = 0
+        self.queue_timeout = 0
+        self.weights = dict(DEFAULT_WEIGHTS)
+        self.rows_per_unit = 100
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._counts = {'admitted': 0, 'queued': 0, 'rate_limited': 0, 'queue_full': 0, 'queue_timeout': 0}
+
+    def configure(self, config):
+        self.rate = config['ADMISSION_RATE']
+        self.burst = max(config['ADMISSION_BURST'], 1)
+        self.capacity = max(config['ADMISSION_MAX_CONCURRENCY'], 1)
+        self.queue_size = config['ADMISSION_QUEUE_SIZE']
+        self.queue_timeout = config['ADMISSION_QUEUE_TIMEOUT_MS'] / 1000
+        self.weights = {**DEFAULT_WEIGHTS, **config['ADMISSION_WEIGHTS']}
+        self.rows_per_unit = max(config['ADMISSION_ROWS_PER_UNIT'], 1)
+
+        url = config['ADMISSION_REDIS_URL']
+        if url and redis is None:
+            raise RuntimeError('ADMISSION_REDIS_URL needs the redis package')
+        self.backend = RedisBackend(url, config['ADMISSION_SLOT_TTL']) if url else LocalBackend()
+
+    def request_cost(self, endpoint, args):
+        """
+        weight of the endpoint, plus one unit per ADMISSION_ROWS_PER_UNIT rows of
+        ?per_page, so a 1000 row page costs more than the default 10 rows
+        """
+        cost = self.weights.get(endpoint, 1)
+        per_page = args.get('per_page', 0, type=int)
+        if per_page > 0:
+            cost += per_page // self.rows_per_unit
+        # more than the whole capacity could never be admitted
+        return min(cost, self.capacity)
+
+    def admit(self, client, cost, charge=True):
+        """
+        returns (slot, None) when admitted, the slot goes back through release,
+        otherwise (None, (status code, message, retry after seconds)). a request
+        turned away with a 503 gets its tokens back, the server being busy is not
+        the client's doing. charge=False skips the rate limit, for a request that
+        paid its tokens already
+        """
+        tokens = min(cost, self.burst) if self.rate > 0 and charge else 0
+        if tokens:
+            wait = self.backend.take(client, tokens, self.rate, self.burst)
+            if wait > 0:
+                self._count('rate_limited')
+                return None, (429, 'Too many requests', wait)
+
+        slot = self.backend.acquire(cost, self.capacity)
+        if slot is not None:
+            self._count('admitted')
+            return slot, None
+
+        with self._lock:
+            full = self._waiting >= self.queue_size
+            if not full:
+                self._waiting += 1
+        if full:
+            self._count('queue_full')
+            return self._busy(client, tokens)
+
+        self._count('queued')
+        try:
+            deadline = time.monotonic() + self.queue_timeout
+            while (remaining := deadline - time.monotonic()) > 0:
+                self.backend.wait(remaining)
+                slot = self.backend.acquire(cost, self.capacity)
+                if slot is not None:
+                    self._count('admitted')
+                    return slot, None
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        self._count('queue_timeout')
+        return self._busy(client, tokens)
+
+    def release(self, slot):
+        self.backend.release(slot)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._counts,
+                'waiting': self._waiting,
+                'in_flight': self.backend.in_flight(),
+                'capacity': self.capacity,
+                'backend': 'redis' if isinstance(self.backend, RedisBackend) else 'local'
+            }
+
+    def _busy(self, client, tokens):
+        if tokens:
+            self.backend.refund(client, tokens, self.burst)
+        return None, (503, 'Server busy, try again later', self.queue_timeout)
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+
+admission = AdmissionControl()
+
+
+def admit_request(charge=True):
+    """
+    take a slot for the current request
+
+    params:
+    - charge: whether the request pays its tokens, False when it is admitted again
+      after release_request_slot
+
+    returns:
+        None when admitted, otherwise the 429/503 response
+    """
+    cost = admission.request_cost(request.endpoint, request.args)
+    slot, rejected = admission.admit(request.remote_addr or 'unknown', cost, charge)
+    if rejected is not None:
+        status, message, retry_after = rejected
+        return jsonify({"error": message}), status, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+    g.admission_slot = slot
+
+
+def release_request_slot():
+    """
+    give back the current request's slot while it waits for the work of another
+    request (see api.utils.coalescing), returns whether it held one
+    """
+    slot = g.pop('admission_slot', None)
+    if slot is None:
+        return False
+    admission.release(slot)
+    return True
+
+
+def init_admission(app):
+    """
+    admission control for the actors/films routes, off unless ADMISSION_CONTROL is set
+
+    clients are told apart by request.remote_addr, behind a proxy wrap the app in
+    werkzeug's ProxyFix so that is the real client. under asgi.py a queued request
+    waits with asyncio.sleep, the other requests on the event loop go on meanwhile
+    """
+    if not app.config['ADMISSION_CONTROL']:
+        return
+    admission.configure(app.config)
+
+    @app.before_request
+    def admit():
+        if request.method == 'OPTIONS' or request.blueprint not in BLUEPRINTS:
+            return
+        return admit_request()
+
+    @app.after_request
+    def release_slot(response):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            # streamed responses (the exports) keep their connection until the body is sent
+            if response.is_streamed:
+                response.call_on_close(lambda: admission.release(slot))
+            else:
+                admission.release(slot)
+        return response
+
+    # requests that never got to after_request
+    @app.teardown_request
+    def release_unfinished_slot(exc):
+        slot = g.pop('admission_slot', None)
+        if slot is not None:
+            admission.release(slot)
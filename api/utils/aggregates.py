@@ -0,0 +1,272 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from api.models import db, film_actor
+from api.models.actor import Actor
+from api.models.film import Film
+from api.utils.routing import use_primary
+
+log = logging.getLogger(__name__)
+
+# minutes per bucket of the film length distribution
+LENGTH_BUCKET = 30
+
+CENTS = Decimal('0.01')
+
+
+class Summary:
+    """
+    in-process summary of a table, kept as one small value per row plus the
+    aggregates of those values
+
+    built on first use, then kept current by refresh, which the write handlers
+    call with the ids they touched (see invalidate_films/invalidate_actors): the
+    rows are read again and their old values taken out of the aggregates and the
+    new ones put in. writes of other workers are only seen by the rebuild every
+    STATS_RECONCILE_SECONDS, which also repairs any drift
+
+    subclasses implement _load, _empty, _apply and _render
+    """
+
+    def __init__(self):
+        self._rows = None
+        self._state = None
+        self._touched = None
+        self.reconciled_at = None
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # one refresh at a time: the values a refresh read must not overwrite newer ones
+        # another refresh read and applied meanwhile
+        self._refresh_lock = threading.Lock()
+
+    def snapshot(self):
+        """
+        the aggregates as a dict ready for jsonify, built first if needed
+        """
+        start_reconciler()
+        if self._rows is None:
+            with self._build_lock:
+                if self._rows is None:
+                    self.rebuild()
+        with self._lock:
+            return {**self._render(self._state), 'reconciled_at': self.reconciled_at.isoformat()}
+
+    def rebuild(self):
+        # a replica may not have the latest writes yet, the refreshes only go by the ids
+        use_primary()
+        with self._lock:
+            # rows refreshed while the table is read may be missing from what is read
+            self._touched = set()
+        try:
+            rows = self._load()
+        except Exception:
+            with self._lock:
+                self._touched = None
+            raise
+
+        state = self._empty()
+        for value in rows.values():
+            self._apply(state, value, 1)
+        with self._lock:
+            self._rows, self._state = rows, state
+            self.reconciled_at = datetime.now(timezone.utc)
+            touched, self._touched = self._touched, None
+        self.refresh(touched)
+
+    def refresh(self, ids):
+        """
+        bring the rows of `ids` up to date, a no-op until the summary is built
+        """
+        if not ids or (self._rows is None and self._touched is None):
+            return
+        ids = {int(ident) for ident in ids}
+        with self._refresh_lock:
+            try:
+                current = self._load(ids)
+            except SQLAlchemyError as err:
+                # the write itself went through, start over on the next request instead of failing it
+                log.warning('summary refresh failed, rebuilding on next use: %s', err)
+                self.reset()
+                return
+
+            with self._lock:
+                if self._touched is not None:
+                    self._touched.update(ids)
+                if self._rows is None:
+                    return
+                for ident in ids:
+                    old = self._rows.pop(ident, None)
+                    if old is not None:
+                        self._apply(self._state, old, -1)
+                    new = current.get(ident)
+                    if new is not None:
+                        self._rows[ident] = new
+                        self._apply(self._state, new, 1)
+
+    def reset(self):
+        with self._lock:
+            self._rows = self._state = None
+
+    def _load(self, ids=None):
+        """
+        {id: value} of every row, or of the rows in ids that still exist
+        """
+        raise NotImplementedError
+
+    def _empty(self):
+        raise NotImplementedError
+
+    def _apply(self, state, value, sign):
+        """
+        add (sign 1) or take out (sign -1) one row's value
+        """
+        raise NotImplementedError
+
+    def _render(self, state):
+        raise NotImplementedError
+
+
+class FilmStats(Summary):
+    """
+    films by rating, average rental rate and replacement cost by rental duration,
+    and the length distribution
+    """
+
+    def _load(self, ids=None):
+        query = db.session.query(
+            Film.film_id, Film.rating, Film.rental_duration, Film.rental_rate, Film.replacement_cost, Film.length
+        )
+        if ids is not None:
+            query = query.filter(Film.film_id.in_(ids))
+        return {film_id: tuple(values) for film_id, *values in query}
+
+    def _empty(self):
+        return {
+            'films': 0,
+            'ratings': Counter(),
+            # rental duration -> [films, rental rate sum, replacement cost sum]
+            'durations': {},
+            'lengths': Counter(),
+            'length_sum': 0,
+            'no_length': 0
+        }
+
+    def _apply(self, state, value, sign):
+        rating, duration, rental_rate, replacement_cost, length = value
+        state['films'] += sign
+        state['ratings'][rating] += sign
+
+        totals = state['durations'].setdefault(duration, [0, Decimal(0), Decimal(0)])
+        totals[0] += sign
+        totals[1] += sign * Decimal(rental_rate)
+        totals[2] += sign * Decimal(replacement_cost)
+        if not totals[0]:
+            del state['durations'][duration]
+
+        if length is None:
+            state['no_length'] += sign
+        else:
+            state['lengths'][length // LENGTH_BUCKET] += sign
+            state['length_sum'] += sign * length
+
+    def _render(self, state):
+        with_length = state['films'] - state['no_length']
+        return {
+            'films': state['films'],
+            'by_rating': {rating or 'unrated': n for rating, n in sorted(state['ratings'].items(), key=str) if n},
+            'by_rental_duration': {
+                str(duration): {
+                    'films': films,
+                    'avg_rental_rate': (rate_sum / films).quantize(CENTS),
+                    'avg_replacement_cost': (cost_sum / films).quantize(CENTS)
+                }
+                for duration, (films, rate_sum, cost_sum) in sorted(state['durations'].items())
+            },
+            'length': {
+                'avg': round(state['length_sum'] / with_length, 1) if with_length else None,
+                'unknown': state['no_length'],
+                'distribution': [
+                    {'from': bucket * LENGTH_BUCKET, 'to': (bucket + 1) * LENGTH_BUCKET - 1, 'films': n}
+                    for bucket, n in sorted(state['lengths'].items()) if n
+                ]
+            }
+        }
+
+
+class ActorStats(Summary):
+    """
+    actor count and the filmography sizes, i.e. how many actors are in how many films
+    """
+
+    def _load(self, ids=None):
+        # one GROUP BY, actors without films included
+        query = db.session.query(Actor.actor_id, db.func.count(film_actor.c.film_id)) \
+            .outerjoin(film_actor, film_actor.c.actor_id == Actor.actor_id) \
+            .group_by(Actor.actor_id)
+        if ids is not None:
+            query = query.filter(Actor.actor_id.in_(ids))
+        return dict(query.all())
+
+    def _empty(self):
+        return {'actors': 0, 'films': 0, 'sizes': Counter()}
+
+    def _apply(self, state, value, sign):
+        state['actors'] += sign
+        state['films'] += sign * value
+        state['sizes'][value] += sign
+
+    def _render(self, state):
+        sizes = {size: n for size, n in sorted(state['sizes'].items()) if n}
+        return {
+            'actors': state['actors'],
+            'films_per_actor': {
+                'avg': round(state['films'] / state['actors'], 1) if state['actors'] else None,
+                'max': max(sizes, default=None),
+                'distribution': [{'films': size, 'actors': n} for size, n in sizes.items()]
+            }
+        }
+
+
+film_stats = FilmStats()
+actor_stats = ActorStats()
+SUMMARIES = (film_stats, actor_stats)
+
+_reconciler_pid = None
+_reconciler_lock = threading.Lock()
+
+
+def _reconcile(app):
+    interval = app.config['STATS_RECONCILE_SECONDS']
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            for summary in SUMMARIES:
+                if summary._rows is None:
+                    continue
+                try:
+                    summary.rebuild()
+                except Exception:
+                    log.exception('summary reconcile failed')
+
+
+def start_reconciler():
+    """
+    start this worker's reconcile thread, once per process (threads do not survive a fork)
+    """
+    global _reconciler_pid
+    if _reconciler_pid == os.getpid() or current_app.config['STATS_RECONCILE_SECONDS'] <= 0:
+        return
+    with _reconciler_lock:
+        if _reconciler_pid == os.getpid():
+            return
+        _reconciler_pid = os.getpid()
+        app = current_app._get_current_object()
+        threading.Thread(target=_reconcile, args=(app,), name='stats-reconcile', daemon=True).start()
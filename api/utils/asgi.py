@@ -0,0 +1,226 @@
+import asyncio
+import io
+import sys
+import time
+
+from flask import request
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.util.concurrency import await_
+
+from api.models import db
+from api.utils.pool import TimedAsyncQueuePool
+from api.utils.routing import RoutingSession
+
+# asyncio DBAPI driver per database backend, MySQL's comes from ASYNC_MYSQL_DRIVER
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite'}
+# where a request's session travels from the ASGI handler to the flask request
+SESSION_ENVIRON_KEY = 'sakila.async_session'
+
+
+def async_url(uri, mysql_driver='aiomysql'):
+    """
+    the same database URI with its asyncio driver, e.g. mysql:// -> mysql+aiomysql://
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    driver = mysql_driver if backend == 'mysql' else ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise ValueError(f'No asyncio driver for {backend}')
+    return url.set(drivername=f'{backend}+{driver}')
+
+
+def on_event_loop():
+    """
+    whether this is a request served by AsgiApp, i.e. code running on the event loop
+    (inside AsyncSession.run_sync) that must not block
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def blocking(fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs) for calls that block (files, network), run in a worker
+    thread when on the event loop so the other requests go on meanwhile
+
+    returns:
+        fn's result
+    """
+    if not on_event_loop():
+        return fn(*args, **kwargs)
+    return await_(asyncio.to_thread(fn, *args, **kwargs))
+
+
+def sleep(seconds):
+    """
+    time.sleep, or asyncio.sleep when on the event loop
+    """
+    if on_event_loop():
+        await_(asyncio.sleep(seconds))
+    else:
+        time.sleep(seconds)
+
+
+class AsyncRoutingSession(RoutingSession):
+    """
+    RoutingSession whose primary/replica choice lands on the matching asyncio engine
+    """
+
+    def __init__(self, db, engine_map, **kwargs):
+        super().__init__(db, **kwargs)
+        # {flask-sqlalchemy engine: sync facade of the asyncio engine on the same database}
+        self._engine_map = engine_map
+
+    def get_bind(self, *args, **kwargs):
+        engine = super().get_bind(*args, **kwargs)
+        return self._engine_map.get(engine, engine)
+
+
+class AsgiApp:
+    """
+    ASGI server for the flask app, with the database on asyncio engines
+
+    every request gets an AsyncSession and runs the normal flask dispatch through
+    AsyncSession.run_sync, so the views, schemas and pagination are the very same
+    code as under WSGI, but each query awaits the asyncio driver instead of
+    blocking a thread. a worker keeps thousands of requests in flight on one event
+    loop, only the ones holding a pooled connection use the database at a time
+
+    params:
+    - app: flask app from create_app
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.engines = {}
+        self._engine_map = {}
+        app.before_request(_bind_async_session)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'websocket':
+            # no websocket routes, turn the handshake down
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1000})
+            return
+        if scope['type'] != 'http':
+            # nothing to answer on other (future) scope types
+            return
+
+        if not self.engines:
+            # servers without lifespan support
+            self._create_engines()
+
+        environ = _environ(scope, await _read_body(receive))
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+
+        async with AsyncSession(sync_session_class=AsyncRoutingSession, db=db, engine_map=self._engine_map) as session:
+            environ[SESSION_ENVIRON_KEY] = session.sync_session
+            result = await session.run_sync(lambda _: self.app.wsgi_app(environ, start_response))
+            chunks = iter(result)
+            try:
+                await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+                # streamed bodies (the exports) query between chunks, so each chunk is pulled through run_sync too
+                while (chunk := await session.run_sync(lambda _: next(chunks, None))) is not None:
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                await send({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(result, 'close'):
+                    await session.run_sync(lambda _: result.close())
+
+    def _create_engines(self):
+        options = dict(self.app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        if 'poolclass' in options:
+            options['poolclass'] = TimedAsyncQueuePool
+        mysql_driver = self.app.config['ASYNC_MYSQL_DRIVER']
+
+        with self.app.app_context():
+            for key, engine in db.engines.items():
+                self.engines[key] = create_async_engine(async_url(engine.url, mysql_driver), **options)
+                self._engine_map[engine] = self.engines[key].sync_engine
+                # the blocking pools are not used any more, give back the warmed up connections
+                engine.dispose()
+        self.app.extensions['asgi_engines'] = self.engines
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    self._create_engines()
+                except Exception as err:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(err)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for engine in self.engines.values():
+                    await engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def _bind_async_session():
+    # make db.session (and Model.query) the request's asyncio backed session
+    session = request.environ.get(SESSION_ENVIRON_KEY)
+    if session is not None:
+        db.session.registry.set(session)
+
+
+async def _read_body(receive):
+    body = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        body.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(body)
+
+
+def _environ(scope, body):
+    """
+    WSGI environ for an ASGI http scope
+    """
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else f'HTTP_{name}'
+        value = value.decode('latin1')
+        # repeated headers are folded into one, as a WSGI server does
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    # the body is read in full already, also covers chunked uploads without a length
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
@@ -0,0 +1,98 @@
+from collections import namedtuple
+
+from sqlalchemy import delete, insert, select, tuple_
+
+from api.models import db
+
+# requested change to a many-to-many association of one entity
+# - replace: the complete new set of related ids, None to keep the current ones
+# - add/remove: ids to link/unlink on top of that (remove wins over add)
+AssociationChange = namedtuple('AssociationChange', ['replace', 'add', 'remove'])
+
+
+def association_change(data, ids_key):
+    """
+    take ids_key, add_<ids_key> and remove_<ids_key> out of loaded data
+
+    returns:
+        AssociationChange, or None when the data does not touch the association
+        (on a partial update leaving out the ids, or sending null, keeps the current links)
+    """
+    replace = data.pop(ids_key, None)
+    add = data.pop(f'add_{ids_key}', None) or ()
+    remove = data.pop(f'remove_{ids_key}', None) or ()
+
+    if replace is None and not add and not remove:
+        return None
+    return AssociationChange(None if replace is None else set(replace), set(add), set(remove))
+
+
+def full_replacement(change):
+    """
+    the change a full replacement (PUT) applies: leaving out the ids, or sending
+    null, unlinks everything that is not added
+
+    params:
+    - change: AssociationChange or None, as returned by association_change
+
+    returns:
+        AssociationChange with a replace set
+    """
+    if change is None:
+        return AssociationChange(set(), set(), set())
+    return change._replace(replace=change.replace or set())
+
+
+def existing_ids(column, values):
+    """
+    the subset of values present in a primary key column, one id-only query
+    """
+    if not values:
+        return set()
+    return set(db.session.execute(select(column).where(column.in_(values))).scalars())
+
+
+def sync_associations(relationship, changes):
+    """
+    apply association changes with a set diff against the current rows
+
+    one SELECT of the current rows, then only the needed DELETE and multi-row
+    INSERT on the association table, no entity objects are loaded. the ORM
+    collections of instances in the session are not updated, the caller commits
+    (which expires them)
+
+    params:
+    - relationship: many-to-many relationship attribute, e.g. Film.actors
+    - changes: {entity id: AssociationChange}
+
+    returns:
+        set of related ids that were linked or unlinked
+    """
+    changes = {ident: change for ident, change in changes.items() if change is not None}
+    if not changes:
+        return set()
+
+    prop = relationship.property
+    (_, fk), = prop.synchronize_pairs
+    (_, target_fk), = prop.secondary_synchronize_pairs
+
+    current = {}
+    for ident, related in db.session.execute(select(fk, target_fk).where(fk.in_(changes.keys()))):
+        current.setdefault(ident, set()).add(related)
+
+    to_add, to_remove = [], []
+    for ident, change in changes.items():
+        before = current.get(ident, set())
+        after = (before if change.replace is None else change.replace) | change.add
+        after -= change.remove
+        to_add += [(ident, related) for related in after - before]
+        to_remove += [(ident, related) for related in before - after]
+
+    if to_remove:
+        db.session.execute(delete(prop.secondary).where(tuple_(fk, target_fk).in_(to_remove)))
+    if to_add:
+        db.session.execute(insert(prop.secondary), [
+            {fk.key: ident, target_fk.key: related} for ident, related in to_add
+        ])
+
+    return {related for _, related in to_add + to_remove}
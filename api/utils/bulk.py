@@ -0,0 +1,216 @@
+from flask import current_app
+from marshmallow import ValidationError
+from sqlalchemy import case, insert, literal, select, text, update
+
+from api.models import db
+from api.utils.associations import association_change, existing_ids, sync_associations
+from api.utils.dumpers import get_dumper
+from api.utils.timing import measure
+
+
+def bulk_write(model, schema, relationship, ids_key, items, partial=False):
+    """
+    create (or with partial=True, update) many entities in one transaction
+
+    every item is validated on its own, then all referenced ids (and ids a new
+    item brings along) are checked with a single query each and the valid items
+    are written with one statement per BULK_BATCH_SIZE rows. invalid items are
+    reported and skipped, the rest still go in. the caller commits
+
+    params:
+    - model: model being written, e.g. Film
+    - schema: schema loading plain dicts (load_instance=False) without its own id lookups
+    - relationship: the model's many-to-many relationship, e.g. Film.actors
+    - ids_key: field holding the related ids, e.g. 'actor_ids' (add_/remove_ variants included)
+    - items: list of raw JSON objects
+    - partial: update existing entities (the primary key is required) instead of creating new ones
+
+    returns:
+        (results, written ids, related ids) -> results holds one dict per item,
+        related ids are the entities on either side of an association change
+    """
+    prop = relationship.property
+    (pk, _), = prop.synchronize_pairs
+    (target_pk, _), = prop.secondary_synchronize_pairs
+    target_name = prop.mapper.class_.__name__.lower()
+    batch_size = current_app.config['BULK_BATCH_SIZE']
+
+    results = [None] * len(items)
+    loaded = {}
+    changes = {}
+
+    # validate every item, no database access yet
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[index] = _error(index, 400, {'_schema': ['Invalid input type.']})
+            continue
+        try:
+            data = schema.load(item, partial=partial)
+        except ValidationError as err:
+            results[index] = _error(index, 400, err.messages)
+            continue
+        if partial and data.get(pk.key) is None:
+            results[index] = _error(index, 400, {pk.key: ['Missing data for required field.']})
+            continue
+        changes[index] = association_change(data, ids_key)
+        loaded[index] = data
+
+    # one query for all related ids of the batch (and the updated entities themselves)
+    requested = {
+        related for change in changes.values() if change is not None
+        for related in (change.replace or set()) | change.add
+    }
+    existing_related = existing_ids(target_pk, requested)
+    # updated entities must exist, ids given to new ones must not (a concurrent
+    # insert of the same id still fails the whole batch on commit)
+    existing = existing_ids(pk, {data[pk.key] for data in loaded.values() if data.get(pk.key) is not None})
+    claimed = set()
+
+    for index, data in list(loaded.items()):
+        change = changes[index]
+        ident = data.get(pk.key)
+        invalid = [] if change is None else sorted(((change.replace or set()) | change.add) - existing_related)
+        if invalid:
+            results[index] = _error(index, 400, {ids_key: [f'Invalid {target_name} IDs: {invalid}']})
+            del loaded[index]
+        elif partial and ident not in existing:
+            results[index] = _error(index, 404, {pk.key: [f'{model.__name__} not found']})
+            del loaded[index]
+        elif not partial and ident is not None and (ident in existing or ident in claimed):
+            results[index] = _error(index, 409, {pk.key: [f'{model.__name__} {ident} already exists']})
+            del loaded[index]
+        elif not partial and ident is not None:
+            claimed.add(ident)
+
+    indexes = list(loaded)
+    rows = [loaded[index] for index in indexes]
+    if partial:
+        ids = [row[pk.key] for row in rows]
+        _update(model, pk, [row for row in rows if len(row) > 1], batch_size)
+    else:
+        ids = _insert(model.__table__, pk, rows, batch_size)
+
+    # association rows: one diff against the association table for the whole batch
+    related_ids = sync_associations(relationship, {
+        ident: changes[index] for index, ident in zip(indexes, ids)
+    })
+
+    for index, ident in zip(indexes, ids):
+        results[index] = {'index': index, 'status': 200 if partial else 201, pk.key: ident}
+
+    return results, ids, related_ids
+
+
+def bulk_response(results, name, schema):
+    """
+    serialize the written items of a bulk_write (one SELECT after the commit) and
+    pick the overall status: 200/201 when everything was written, 207 when only some
+    items were, 400 (or 404) when none were
+
+    returns:
+        (response body, status)
+    """
+    dumper = get_dumper(schema)
+    pk = schema.opts.model.__mapper__.primary_key[0]
+    # an update batch may name the same entity more than once
+    written = {}
+    for result in results:
+        if result['status'] < 400:
+            written.setdefault(result.pop(pk.key), []).append(result)
+
+    if written:
+        rows = db.session.execute(select(*dumper.columns).where(pk.in_(written.keys()))).all()
+        key_index = [col.key for col in dumper.columns].index(pk.key)
+        with measure('serialize'):
+            for row in rows:
+                data = dumper.dump_row(row)
+                for result in written[row[key_index]]:
+                    result[name] = data
+
+    failed = sum(result['status'] >= 400 for result in results)
+    written = len(results) - failed
+    if not failed and results:
+        status = results[0]['status']
+    elif written:
+        status = 207
+    else:
+        status = min((result['status'] for result in results), default=400)
+
+    return {'results': results, 'written': written, 'failed': failed}, status
+
+
+def _insert(table, pk, rows, batch_size):
+    """
+    multi-row INSERTs, returns the ids of the rows in their order
+
+    rows with an id go in apart from rows without one: the ids the database
+    generates for a multi-row INSERT of only the latter are one contiguous range
+    (MySQL, innodb_autoinc_lock_mode 0, 1, or 2 without concurrent INSERT ... SELECT /
+    LOAD DATA), and the driver reports one end of it
+    """
+    ids = [row.get(pk.key) for row in rows]
+    dialect = db.session.get_bind().dialect
+    for generated in (False, True):
+        indexes = [index for index, ident in enumerate(ids) if (ident is None) == generated]
+        # every row of a multi-row INSERT needs the same keys, columns a row left out are NULL
+        keys = {key for index in indexes for key in rows[index]} - ({pk.key} if generated else set())
+        for start in range(0, len(indexes), batch_size):
+            batch = indexes[start:start + batch_size]
+            values = [{key: rows[index].get(key) for key in keys} for index in batch]
+            if not generated:
+                db.session.execute(insert(table).values(values))
+            elif dialect.name in ('mysql', 'sqlite'):
+                result = db.session.execute(insert(table).values(values))
+                for index, ident in zip(batch, _generated_ids(dialect, result.lastrowid, len(batch))):
+                    ids[index] = ident
+            else:
+                # backends with RETURNING hand the ids back in the order of the rows
+                returned = db.session.execute(insert(table).returning(pk, sort_by_parameter_order=True), values)
+                for index, ident in zip(batch, returned.scalars()):
+                    ids[index] = ident
+    return ids
+
+
+# MySQL engine -> auto_increment_increment, the step between generated ids
+_increments = {}
+
+
+def _generated_ids(dialect, lastrowid, count):
+    if dialect.name == 'sqlite':
+        # the rowid of the last row, one apart each
+        return range(lastrowid - count + 1, lastrowid + 1)
+    bind = db.session.get_bind()
+    step = _increments.get(bind)
+    if step is None:
+        step = _increments[bind] = db.session.execute(text('SELECT @@auto_increment_increment')).scalar()
+    # LAST_INSERT_ID(), the id of the first row
+    return range(lastrowid, lastrowid + count * step, step)
+
+
+def _update(model, pk, rows, batch_size):
+    """
+    UPDATE by primary key, one statement per BULK_BATCH_SIZE rows changing the
+    same columns: SET column = CASE id WHEN .. THEN .. END WHERE id IN (..)
+
+    an id named more than once gets the value of its last row, like one UPDATE
+    per row in order would
+    """
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(key for key in row if key != pk.key)), []).append(row)
+
+    for names, group in groups.items():
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            values = {}
+            for name in names:
+                column = model.__mapper__.columns[name]
+                cases = {row[pk.key]: literal(row[name], column.type) for row in batch}
+                values[column] = case(cases, value=pk)
+            db.session.execute(
+                update(model.__table__).where(pk.in_({row[pk.key] for row in batch})).values(values)
+            )
+
+
+def _error(index, status, messages):
+    return {'index': index, 'status': status, 'errors': messages}
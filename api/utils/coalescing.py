@@ -0,0 +1,146 @@
+import threading
+
+from flask import current_app, g, make_response, request
+
+from api.utils.admission import admit_request, release_request_slot
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """
+    runs a function once for all concurrent callers with the same key, the
+    callers arriving while it runs wait for it and share its result
+
+    nothing is kept once the call returns, a caller arriving after that runs the
+    function again, so unlike a cache there is nothing that can go stale
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counts = {'leaders': 0, 'shared': 0, 'fallbacks': 0}
+        self._waiting = 0
+
+    def do(self, key, fn, share, timeout, on_wait=None, fallback=None):
+        """
+        params:
+        - key: hashable key of the call
+        - fn: the call, its result is returned to the leader as is
+        - share: turns the leader's result into what the waiting callers get, returns
+          None when it can not be shared (they then run fn themselves)
+        - timeout: seconds a waiting caller waits before running fn itself
+        - on_wait: called before a caller starts waiting
+        - fallback: what a waiting caller runs instead of fn when it has to run it itself
+
+        returns:
+            fn's result for the leader, share's output for the callers that waited
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self._counts['leaders'] += 1
+
+        if leader:
+            try:
+                result = fn()
+                flight.result = share(result)
+                return result
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+
+        if on_wait is not None:
+            on_wait()
+        with self._lock:
+            self._waiting += 1
+        try:
+            done = flight.done.wait(timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if done and flight.result is not None:
+            self._count('shared')
+            return flight.result
+        # the leader failed, timed out or had nothing to share
+        self._count('fallbacks')
+        return (fallback or fn)()
+
+    def stats(self):
+        with self._lock:
+            return {**self._counts, 'in_flight': len(self._flights), 'waiting': self._waiting}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+
+single_flight = SingleFlight()
+
+
+def _frozen(response):
+    # status, headers and body of a finished response, safe to hand to other threads
+    if response.is_streamed:
+        return None
+    return response.status_code, list(response.headers.items()), response.get_data()
+
+
+def coalesce(view_key, compute):
+    """
+    run compute() once for identical concurrent GET requests, the ones that
+    arrive while it runs get a copy of its response
+
+    identical means same host, endpoint, view arguments and query arguments (in any
+    order), version numbers and primary/replica reads. the version numbers make a
+    write a barrier: once it bumped them later requests start a new computation
+    instead of joining one that may have read the old rows. streamed responses (the
+    exports) are not shared. per worker, and off under asgi.py where waiting would
+    block the event loop the leader runs on
+
+    a waiting request gives its admission slot back (see api.utils.admission), it
+    does no work of its own meanwhile. if it has to run the view itself after all
+    it is admitted again first, without paying its tokens twice
+
+    params:
+    - view_key: hashable description of the view call, with the versions it depends on
+    - compute: function returning the view's flask response
+
+    returns:
+        flask response
+    """
+    config = current_app.config
+    if not config['COALESCE_REQUESTS'] or 'asgi_engines' in current_app.extensions:
+        return compute()
+
+    key = (
+        request.host_url,
+        request.endpoint,
+        view_key,
+        tuple(sorted(request.args.items(multi=True))),
+        bool(g.get('read_primary'))
+    )
+    released = False
+
+    def on_wait():
+        nonlocal released
+        released = release_request_slot()
+
+    def fallback():
+        if released:
+            rejected = admit_request(charge=False)
+            if rejected is not None:
+                return make_response(rejected)
+        return compute()
+
+    result = single_flight.do(key, compute, _frozen, config['COALESCE_TIMEOUT_MS'] / 1000, on_wait, fallback)
+    if isinstance(result, tuple):
+        status, headers, body = result
+        return current_app.response_class(body, status=status, headers=headers)
+    return result
@@ -0,0 +1,149 @@
+import gzip
+import threading
+import zlib
+
+from flask import current_app, request
+
+# zstd is optional, only offered when the zstandard package is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# server preference when the client rates several encodings the same
+ENCODINGS = ('zstd', 'gzip', 'deflate')
+
+
+class BodyCache:
+    """
+    LRU cache of compressed response bodies, bounded by their total size
+
+    entries are keyed by (ETag, encoding). an ETag changes whenever anything the
+    body depends on is written (see api.utils.etags), so entries never go stale,
+    superseded ones just age out of the LRU
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # re-insert so the dict stays ordered from least to most recently used
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, body, content_type):
+        max_bytes = current_app.config['COMPRESSION_CACHE_BYTES']
+        if len(body) > max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            while self._entries and self._size + len(body) > max_bytes:
+                oldest = self._entries.pop(next(iter(self._entries)))
+                self._size -= len(oldest[0])
+            self._entries[key] = (body, content_type)
+            self._size += len(body)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+body_cache = BodyCache()
+
+
+def negotiate_encoding():
+    """
+    best encoding of ENCODINGS the client accepts (by Accept-Encoding quality), None for identity
+    """
+    offered = [encoding for encoding in ENCODINGS if encoding != 'zstd' or zstandard is not None]
+    return request.accept_encodings.best_match(offered)
+
+
+def compress(body, encoding):
+    level = current_app.config['COMPRESSION_LEVEL']
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=current_app.config['COMPRESSION_ZSTD_LEVEL']).compress(body)
+    if encoding == 'gzip':
+        # fixed mtime so the same body always compresses to the same bytes
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    # HTTP deflate is the zlib format
+    return zlib.compress(body, level)
+
+
+def etag_variants(etag):
+    """
+    the ETag of every representation of a body: identity plus one per encoding
+    """
+    return [etag] + [f'{etag}-{encoding}' for encoding in ENCODINGS]
+
+
+def cached_response(etag):
+    """
+    response straight from the compressed body cache, no view and no compression,
+    None when the client takes no encoding or the body is not cached
+    """
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return None
+    entry = body_cache.get((etag, encoding))
+    if entry is None:
+        return None
+
+    body, content_type = entry
+    response = current_app.response_class(body, content_type=content_type)
+    _mark_encoded(response, etag, encoding)
+    return response
+
+
+def init_compression(app):
+    """
+    compress /api/* responses of at least COMPRESSION_MIN_SIZE bytes with the
+    negotiated encoding, and keep the compressed bytes of ETag tagged ones
+    """
+
+    @app.after_request
+    def compress_response(response):
+        if not request.path.startswith('/api/'):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        # streamed bodies (the exports) and error pages go out as they are
+        if (
+            response.status_code != 200
+            or response.is_streamed
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+        ):
+            return response
+
+        encoding = negotiate_encoding()
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < app.config['COMPRESSION_MIN_SIZE']:
+            return response
+
+        compressed = compress(body, encoding)
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            body_cache.set((etag, encoding), compressed, response.content_type)
+
+        response.set_data(compressed)
+        _mark_encoded(response, etag, encoding)
+        return response
+
+
+def _mark_encoded(response, etag, encoding):
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # a strong ETag names one exact byte sequence, so each encoding gets its own
+    if etag:
+        response.set_etag(f'{etag}-{encoding}')
@@ -0,0 +1,164 @@
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, inspect, select, text
+
+from api.models import db
+from api.utils.versions import versions
+
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+class CountCache:
+    """
+    small TTL cache for COUNT(*) results
+
+    entries are keyed by (endpoint, normalized filter arguments, versions) so page
+    2, 3, ... of the same listing reuse the total worked out for page 1. the versions
+    are the ones the request's ETag was made of (see api.utils.versions), a write
+    through another worker bumps them and the next page counts again
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint, filters, versions=()):
+        # drop unset filters and stringify so ?x=1 and x=1 (int) hit the same entry
+        normalized = tuple(sorted(
+            (name, str(value)) for name, value in filters.items() if value is not None
+        ))
+        return (endpoint, normalized, versions)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            total, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            return total
+
+    def set(self, key, total):
+        ttl = current_app.config['COUNT_CACHE_TTL']
+        max_size = current_app.config['COUNT_CACHE_SIZE']
+        # a size of 0 (or less) turns the cache off
+        if max_size <= 0:
+            return
+        with self._lock:
+            # dicts keep insertion order, so the first key is the oldest entry
+            while len(self._entries) >= max_size:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (total, time.monotonic() + ttl)
+
+    def invalidate(self, *endpoints):
+        """
+        drop cached totals for the given endpoints (all of them if none given)
+        """
+        with self._lock:
+            if not endpoints:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] in endpoints]:
+                del self._entries[key]
+
+
+count_cache = CountCache()
+
+
+def count_total(query, mode, endpoint, filters):
+    """
+    work out the total number of rows for a paginated listing
+
+    params:
+    - query: filtered SQLAlchemy query (before limit/offset)
+    - mode: one of COUNT_MODES
+    - endpoint, filters: used as the cache key
+
+    returns:
+        total (int) or None when mode is 'none'
+    """
+    if mode == 'none':
+        return None
+
+    key = CountCache.make_key(endpoint, filters, versions.seen())
+    total = count_cache.get(key)
+    if total is not None:
+        return total
+
+    if mode == 'estimate':
+        total = estimate_count(query)
+        if total is not None:
+            # estimates are not cached, a later exact count should not be served an estimate
+            return total
+
+    total = exact_count(query)
+    count_cache.set(key, total)
+    return total
+
+
+def exact_count(query):
+    """
+    SELECT count(*) over the query's primary key only, Query.count() would select
+    every mapped column in its subquery, deferred ones too (and e.g.
+    film.special_features_mask is not there before its migration)
+    """
+    entity = query.column_descriptions[0]['entity']
+    keys = query.order_by(None).with_entities(*inspect(entity).primary_key).subquery()
+    return db.session.execute(select(func.count()).select_from(keys)).scalar()
+
+
+def estimate_count(query):
+    """
+    row estimate from the database's own table statistics
+
+    MySQL: the optimizer's row estimate from EXPLAIN
+    SQLite: sqlite_stat1 (only for unfiltered single table queries, needs ANALYZE to have run)
+
+    returns:
+        estimated total, or None when no estimate is available
+    """
+    # a connection of its own: a failed EXPLAIN (or a missing sqlite_stat1) must not
+    # end the transaction of the request's session. same engine, so a read-only
+    # request still asks its replica
+    engine = db.session.get_bind()
+    try:
+        with engine.connect() as connection:
+            return _estimate(connection, query)
+    except Exception:
+        # statistics are best effort, the caller falls back to an exact count
+        return None
+
+
+def _estimate(connection, query):
+    dialect = connection.dialect
+    if dialect.name == 'mysql':
+        sql = query.order_by(None).statement.compile(
+            dialect=dialect,
+            compile_kwargs={'literal_binds': True}
+        )
+        plan = connection.exec_driver_sql(f'EXPLAIN {sql}').mappings().all()
+        # nested loop estimate: rows examined times the share kept by the filter, per table
+        estimate = 1.0
+        for step in plan:
+            estimate *= (step['rows'] or 0) * float(step.get('filtered') or 100) / 100
+        return int(estimate)
+
+    if dialect.name == 'sqlite' and query.whereclause is None:
+        entity = query.column_descriptions[0]['entity']
+        table = inspect(entity).local_table
+        # a join (e.g. the ?q= search) filters rows without a WHERE clause
+        if query.statement.get_final_froms() != [table]:
+            return None
+        stat = connection.execute(
+            text("SELECT stat FROM sqlite_stat1 WHERE tbl = :tbl LIMIT 1"),
+            {'tbl': table.name}
+        ).scalar()
+        if stat:
+            return int(stat.split()[0])
+
+    return None
@@ -0,0 +1,112 @@
+from flask import current_app, request
+from sqlalchemy import func, select
+
+from api.models import db
+from api.models.actor import Actor
+from api.models.film import Film
+from api.schemas.actor import actor_schema
+from api.schemas.film import film_schema
+from api.utils.dumpers import get_dumper
+from api.utils.links import collection_link_templates, link_mode
+from api.utils.versions import collection_key
+from api.utils.timing import measure
+
+# ?embed= options of each resource: name -> (relationship, schema of the related items)
+FILM_EMBEDS = {'actors': (Film.actors, actor_schema)}
+ACTOR_EMBEDS = {'films': (Actor.films, film_schema)}
+
+
+def parse_embed(embeds, embed_arg):
+    """
+    work out which relationships ?embed=a,b asks for
+
+    params:
+    - embeds: {name: (relationship attribute, schema of the related items)}
+    - embed_arg: raw value of the embed query parameter, may be None
+
+    returns:
+        (list of requested names, error message) -> error message is None when valid
+    """
+    if not embed_arg:
+        return [], None
+
+    requested = [name.strip() for name in embed_arg.split(',') if name.strip()]
+    invalid = sorted(set(requested) - set(embeds))
+    if invalid:
+        return None, f"Invalid embed: {', '.join(invalid)}. Options are: {', '.join(embeds)}"
+
+    # keep the order they were declared in, drop repeats
+    return [name for name in embeds if name in requested], None
+
+
+def embed_keys(embeds):
+    """
+    ETag version keys of the relationships embedded in this request (see api.utils.etags)
+    """
+    names, _ = parse_embed(embeds, request.args.get('embed'))
+    keys = []
+    for name in names or ():
+        relationship, _ = embeds[name]
+        keys += [collection_key(relationship.property.mapper.class_), collection_key(relationship.property.secondary)]
+    return keys
+
+
+def embed_related(items, name, relationship, schema):
+    """
+    nest the related rows of a page of serialized items under items[i][name]
+
+    one batched SELECT for the whole page (the column row equivalent of selectinload),
+    capped at EMBED_LIMIT related rows per item in SQL with ROW_NUMBER() so a prolific
+    actor can not blow up the response. the full list stays available through _links.
+    the related rows are collection members, with ?links=templated they go without
+    _links (see embed_templates)
+
+    params:
+    - items: serialized parent dicts, they must contain the parent's primary key
+    - name: key the related list is stored under
+    - relationship: many-to-many relationship attribute, e.g. Film.actors
+    - schema: schema of the related model
+    """
+    if not items:
+        return items
+
+    prop = relationship.property
+    (parent_pk, parent_fk), = prop.synchronize_pairs
+    (target_pk, target_fk), = prop.secondary_synchronize_pairs
+    dumper = get_dumper(schema)
+    limit = current_app.config['EMBED_LIMIT']
+
+    rank = func.row_number().over(partition_by=parent_fk, order_by=target_pk)
+    ranked = (
+        select(parent_fk.label('parent_id'), *dumper.columns, rank.label('embed_rank'))
+        .join_from(prop.mapper.local_table, prop.secondary, target_pk == target_fk)
+        .where(parent_fk.in_({item[parent_pk.key] for item in items}))
+        .subquery()
+    )
+    # same column order as dumper.columns, after the parent id
+    columns = [ranked.c.parent_id] + [ranked.c[col.key] for col in dumper.columns]
+    rows = db.session.execute(
+        select(*columns).where(ranked.c.embed_rank <= limit).order_by(ranked.c.parent_id, ranked.c.embed_rank)
+    ).all()
+
+    related = {}
+    with measure('serialize'):
+        for row in rows:
+            related.setdefault(row[0], []).append(dumper.dump_row(row[1:], many=True))
+
+    for item in items:
+        item[name] = related.get(item[parent_pk.key], [])
+    return items
+
+
+def embed_templates(embeds, names):
+    """
+    ?links=templated: one set of link templates per embedded relationship, for the
+    response's _links.embedded, standing in for the _links of the embedded items
+
+    returns:
+        {name: templates}, empty in the other link modes
+    """
+    if link_mode() != 'templated':
+        return {}
+    return {name: collection_link_templates(embeds[name][1].link_spec) for name in names}
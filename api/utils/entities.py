@@ -0,0 +1,103 @@
+import threading
+import time
+
+from flask import current_app, request
+
+from api.utils.dumpers import get_dumper
+from api.utils.links import link_mode
+from api.utils.versions import entity_ident, entity_key, versions
+
+
+class EntityCache:
+    """
+    bounded LRU cache (with a TTL) for serialized single entities
+
+    entries are keyed by (model, id, variant), the variant covers everything else
+    the serialized dict depends on (sparse fields, link mode, host in the links) and
+    the entity's version (see api.utils.versions). the cache is per process but the
+    versions are shared, an entity written through another worker is a miss here.
+    writes drop every variant of an entity through invalidate()
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model, ident, variant):
+        return (model.__name__, entity_ident(model, ident), variant)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            # re-insert so the dict stays ordered from least to most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, data):
+        ttl = current_app.config['ENTITY_CACHE_TTL']
+        max_size = current_app.config['ENTITY_CACHE_SIZE']
+        with self._lock:
+            self._entries.pop(key, None)
+            while self._entries and len(self._entries) >= max_size:
+                del self._entries[next(iter(self._entries))]
+                self.evictions += 1
+            if max_size > 0:
+                self._entries[key] = (data, time.monotonic() + ttl)
+
+    def invalidate(self, model, *idents):
+        """
+        drop every cached variant of the given entities
+        """
+        idents = {entity_ident(model, ident) for ident in idents}
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == model.__name__ and k[1] in idents]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': current_app.config['ENTITY_CACHE_SIZE'],
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+entity_cache = EntityCache()
+
+
+def fetch_entity(schema, ident):
+    """
+    serialized single entity, from the cache or a primary key lookup
+
+    params:
+    - schema: single item schema, may be a sparse one (see api.utils.fields)
+    - ident: primary key value
+
+    returns:
+        serialized dict, or None if the entity does not exist (misses are not cached)
+    """
+    model = schema.opts.model
+    ident = entity_ident(model, ident)
+    variant = (tuple(schema.dump_fields), link_mode(), request.host_url, versions.get(entity_key(model, ident)))
+    key = EntityCache.make_key(model, ident, variant)
+
+    data = entity_cache.get(key)
+    if data is None:
+        data = get_dumper(schema).fetch_one(ident)
+        if data is not None:
+            entity_cache.set(key, data)
+    return data
@@ -0,0 +1,60 @@
+import functools
+import hashlib
+
+from flask import make_response, request
+
+from api.utils.coalescing import coalesce
+from api.utils.compression import cached_response, etag_variants
+from api.utils.versions import versions
+
+
+def make_etag(keys):
+    """
+    strong ETag for the current request given the version keys its response depends on
+
+    the full url (host, path and query string) is part of it since fields, links,
+    paging etc. all change the body
+    """
+    source = repr((versions.epoch(), request.url, keys, versions.get(*keys)))
+    return hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+
+
+def conditional(keys):
+    """
+    decorator for GET views: answer If-None-Match with 304 before the view runs,
+    otherwise tag the view's 200 response
+
+    params:
+    - keys: function of the view's keyword arguments returning the version keys
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**kwargs):
+            # nothing to tag with before the api_version table exists
+            if not versions.available():
+                return view(**kwargs)
+
+            # read the versions before the view so a concurrent write can only make the tag older,
+            # they come from the same primary/replica as the view's rows (see VersionStore)
+            view_keys = keys(**kwargs)
+            etag = make_etag(view_keys)
+            # the client may hold the tag of a compressed representation (see api.utils.compression)
+            matched = next((tag for tag in etag_variants(etag) if request.if_none_match.contains(tag)), None)
+            if matched:
+                response = make_response('', 304)
+                response.set_etag(matched)
+                return response
+
+            # the same body compressed before: no view, no serialization, no compression
+            response = cached_response(etag)
+            if response is not None:
+                return response
+
+            # identical requests running right now share one view call
+            view_call = (tuple(sorted(kwargs.items())), tuple(view_keys), versions.get(*view_keys))
+            response = coalesce(view_call, lambda: make_response(view(**kwargs)))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
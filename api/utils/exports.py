@@ -0,0 +1,85 @@
+import csv
+import io
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import inspect
+
+from api.utils.dumpers import get_dumper
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+# ?links= of the exports: a stream of rows has no place for templated mode's one set of templates
+EXPORT_LINK_MODES = ('full', 'none')
+
+MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+
+def export_response(query, schema, fmt, name, sort_key=None, sort_desc=False):
+    """
+    stream every row of a query as NDJSON or CSV
+
+    rows come from a server-side cursor (yield_per) and are written out chunk by
+    chunk, so memory stays flat however many rows there are and there is no
+    OFFSET/COUNT per page like when paging through the listing
+
+    params:
+    - query: filtered SQLAlchemy query
+    - schema: many=True schema, may be a sparse one (see api.utils.fields)
+    - fmt: one of EXPORT_FORMATS
+    - name: file name (without extension) suggested to the client
+    - sort_key, sort_desc: as paginate_query, the primary key is always the tie breaker
+
+    returns:
+        streaming flask Response
+    """
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    dumper = get_dumper(schema)
+
+    entity = query.column_descriptions[0]['entity']
+    columns = list(inspect(entity).primary_key)
+    if sort_key is not None:
+        columns.insert(0, sort_key)
+    query = query.order_by(*[col.desc() if sort_desc else col.asc() for col in columns])
+
+    # yield_per implies stream_results, i.e. an unbuffered cursor on MySQL
+    rows = query.with_entities(*dumper.columns).execution_options(yield_per=batch_size)
+
+    def generate():
+        if fmt == 'csv':
+            # plain columns only, _links and other nested values do not fit a flat row
+            keys = dumper.keys
+            yield _write_csv([keys])
+            write = lambda items: _write_csv([item.get(key) for key in keys] for item in items)
+        else:
+            write = _write_ndjson
+
+        try:
+            chunk = []
+            for row in rows:
+                chunk.append(dumper.dump_row(row, many=True))
+                if len(chunk) >= batch_size:
+                    yield write(chunk)
+                    chunk = []
+            if chunk:
+                yield write(chunk)
+        finally:
+            # the request's teardown already removed this session from db.session before
+            # the body was sent, so give its connection back to the pool here
+            rows.session.close()
+
+    response = Response(stream_with_context(generate()), mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={name}.{fmt}'
+    return response
+
+
+def _write_ndjson(items):
+    dumps = current_app.json.dumps
+    return ''.join(dumps(item) + '\n' for item in items)
+
+
+def _write_csv(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
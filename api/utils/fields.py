@@ -0,0 +1,41 @@
+from functools import lru_cache
+
+
+def sparse_schema(schema, fields_arg):
+    """
+    narrow a schema to the fields asked for in ?fields=a,b,c
+
+    the primary key is always kept since the _links are built from it.
+    the returned schema only selects these columns (see api.utils.dumpers), so
+    unrequested columns never leave the database
+
+    params:
+    - schema: base schema instance (e.g. films_schema)
+    - fields_arg: raw value of the fields query parameter, may be None
+
+    returns:
+        (schema, error message) -> error message is None when the fields are valid
+    """
+    if not fields_arg:
+        return schema, None
+
+    requested = {name.strip() for name in fields_arg.split(',') if name.strip()}
+    available = schema.dump_fields
+
+    invalid = sorted(requested - set(available))
+    if invalid:
+        options = ', '.join(available)
+        return None, f"Invalid fields: {', '.join(invalid)}. Options are: {options}"
+
+    primary_key = schema.opts.model.__mapper__.primary_key[0].key
+    requested.add(primary_key)
+
+    # keep the schema's own field order so responses look the same as the full ones
+    only = tuple(name for name in available if name in requested)
+    return _build(type(schema), only, schema.many), None
+
+
+# one schema (and compiled dumper) per distinct field selection
+@lru_cache(maxsize=256)
+def _build(schema_cls, only, many):
+    return schema_cls(only=only, many=many)
@@ -0,0 +1,106 @@
+from flask.json.provider import DefaultJSONProvider
+
+from api.utils.timing import measure
+
+# fastest available encoder: orjson, then msgspec, otherwise the stdlib through flask's provider
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _orjson_encoder(default):
+    # dates are handed to flask's default (http_date) instead of orjson's own
+    # ISO format, Decimals to str as before
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def encode(obj, sort_keys=True, newline=False):
+        option = options
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if newline:
+            option |= orjson.OPT_APPEND_NEWLINE
+        return orjson.dumps(obj, default=default, option=option)
+    return encode
+
+
+def _msgspec_encoder(default):
+    # Decimals are encoded natively, as the same strings str(Decimal) gives. msgspec
+    # has no way to hand dates to the default, they come out as ISO 8601 (the schemas
+    # already format every date field, so no raw dates reach the provider)
+    encoders = {
+        sort_keys: msgspec.json.Encoder(enc_hook=default, decimal_format='string', order='sorted' if sort_keys else None)
+        for sort_keys in (True, False)
+    }
+
+    def encode(obj, sort_keys=True, newline=False):
+        data = encoders[bool(sort_keys)].encode(obj)
+        return data + b'\n' if newline else data
+    return encode
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider on orjson or msgspec, with flask's stdlib provider as the fallback
+
+    the output follows the provider's settings like the default one: compact,
+    keys sorted unless sort_keys is False, Decimals as strings ("4.99"), dates as
+    HTTP dates (ISO 8601 with msgspec). the fast encoders can not write \\u escapes,
+    so with ensure_ascii on (flask's default) only bodies that are plain ASCII
+    anyway take the fast path, the rest go through the stdlib. it decodes to the
+    same values, except NaN/Infinity which become null, but some floats are spelled
+    differently (1e16, not 1e+16). pretty printing (debug mode or compact=False)
+    and dumps with extra arguments go through the stdlib as before
+    """
+
+    def __init__(self, app):
+        super().__init__(app)
+        if orjson is not None:
+            self.backend = 'orjson'
+            self._encode = _orjson_encoder(self.default)
+        elif msgspec is not None:
+            self.backend = 'msgspec'
+            self._encode = _msgspec_encoder(self.default)
+        else:
+            self.backend = 'stdlib'
+            self._encode = None
+
+    def _fast_encode(self, obj, newline=False):
+        """
+        obj as JSON bytes from the fast encoder, None when the stdlib has to write it
+        """
+        if self._encode is None:
+            return None
+        # read on every call, the app may change the settings after the provider is made
+        data = self._encode(obj, sort_keys=self.sort_keys, newline=newline)
+        if self.ensure_ascii and not data.isascii():
+            return None
+        return data
+
+    def dumps(self, obj, **kwargs):
+        data = None if kwargs else self._fast_encode(obj)
+        if data is None:
+            return super().dumps(obj, **kwargs)
+        return data.decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        with measure('json'):
+            if (self.compact is None and self._app.debug) or self.compact is False:
+                return super().response(*args, **kwargs)
+
+            obj = self._prepare_response_obj(args, kwargs)
+            data = self._fast_encode(obj, newline=True)
+            if data is None:
+                return super().response(*args, **kwargs)
+            # bytes straight into the response, no str round trip
+            return self._app.response_class(data, mimetype=self.mimetype)
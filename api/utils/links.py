@@ -0,0 +1,67 @@
+from flask import g, has_request_context, request, url_for
+
+LINK_MODES = ('full', 'templated', 'none')
+
+
+def link_mode():
+    """
+    how item links should be rendered for this request (?links=full|templated|none)
+
+    anything unrecognised falls back to full, the routes reject it before we get here
+    """
+    if not has_request_context():
+        return 'full'
+    mode = request.args.get('links', 'full')
+    return mode if mode in LINK_MODES else 'full'
+
+
+def url_template(endpoint, param):
+    """
+    RFC 6570 template for an endpoint with a single path parameter,
+    e.g. http://localhost/api/films/{film_id}
+
+    url_for runs once per (endpoint, param) per request, not once per row
+    """
+    templates = g.setdefault('_url_templates', {})
+    key = (endpoint, param)
+    template = templates.get(key)
+    if template is None:
+        # braces get percent encoded by url_for, put them back afterwards
+        href = url_for(endpoint, _external=True, **{param: '{' + param + '}'})
+        template = href.replace('%7B' + param + '%7D', '{' + param + '}')
+        templates[key] = template
+    return template
+
+
+def item_links(spec, data, many=False):
+    """
+    build the _links of one serialized item
+
+    params:
+    - spec: {rel: (endpoint, param)}, param is both the url parameter and the key in data
+    - data: the serialized item
+    - many: True when the item is part of a collection
+
+    returns:
+        links dictionary, or None when the item should not carry links
+    """
+    mode = link_mode()
+    # templated collections carry one set of templates instead (see collection_link_templates)
+    if mode == 'none' or (mode == 'templated' and many):
+        return None
+
+    links = {}
+    for rel, (endpoint, param) in spec.items():
+        prefix, _, suffix = url_template(endpoint, param).partition('{' + param + '}')
+        links[rel] = {'href': f'{prefix}{data[param]}{suffix}'}
+    return links
+
+
+def collection_link_templates(spec):
+    """
+    collection level templates standing in for the per item links in templated mode
+    """
+    return {
+        rel: {'href': url_template(endpoint, param), 'templated': True}
+        for rel, (endpoint, param) in spec.items()
+    }
@@ -0,0 +1,152 @@
+import os
+import time
+
+from flask import current_app, g, request
+
+from api.models import db
+from api.utils.pool import pool_status
+
+# prometheus_client is optional, without it no metrics are collected and /api/metrics says so
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, multiprocess
+except ImportError:
+    prometheus_client = None
+
+# multi worker servers: point PROMETHEUS_MULTIPROC_DIR at an empty directory shared by the
+# workers (wiped on every start), each process then keeps its values in mmap files there and
+# a scrape of any worker adds them all up. with gunicorn also call mark_process_dead from the
+# child_exit hook so the gauges of dead workers are dropped
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+LATENCY_BUCKETS = (0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+PER_PAGE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+if prometheus_client is not None:
+    REQUESTS = Counter(
+        'sakila_http_requests_total', 'HTTP requests handled',
+        ['endpoint', 'method', 'status']
+    )
+    LATENCY = Histogram(
+        'sakila_http_request_duration_seconds', 'Time from request start to response, in seconds',
+        ['endpoint', 'status'], buckets=LATENCY_BUCKETS
+    )
+    RESPONSE_SIZE = Histogram(
+        'sakila_http_response_size_bytes', 'Response body size as sent (after compression), in bytes',
+        ['endpoint', 'status'], buckets=SIZE_BUCKETS
+    )
+    PER_PAGE = Histogram(
+        'sakila_per_page', 'Page size of paginated listings',
+        ['endpoint'], buckets=PER_PAGE_BUCKETS
+    )
+    # pool gauges are summed over the live workers
+    POOL_CONNECTIONS = Gauge(
+        'sakila_db_pool_connections', 'Pooled database connections by state',
+        ['pool', 'state'], multiprocess_mode='livesum'
+    )
+    POOL_CHECKOUTS = Counter('sakila_db_pool_checkouts_total', 'Connections checked out of the pool', ['pool'])
+    POOL_TIMEOUTS = Counter('sakila_db_pool_timeouts_total', 'Checkouts that timed out waiting', ['pool'])
+    POOL_WAIT = Counter(
+        'sakila_db_pool_checkout_wait_seconds_total', 'Time spent waiting for a pooled connection', ['pool']
+    )
+
+
+def mark_process_dead(pid):
+    """
+    gunicorn child_exit hook helper, see MULTIPROCESS
+    """
+    if prometheus_client is not None and MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+def render_metrics():
+    """
+    (body, content type) of a scrape, None when prometheus_client is not installed
+    """
+    if prometheus_client is None:
+        return None
+    if MULTIPROCESS:
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
+
+
+# last PoolStats totals seen per pool in this process, the counters get the difference
+_pool_totals = {}
+
+
+def _engines():
+    # served through asgi.py the pools in use are the asyncio engines' ones
+    async_engines = current_app.extensions.get('asgi_engines')
+    if async_engines:
+        return {key or 'primary': engine.sync_engine for key, engine in async_engines.items()}
+    return {key or 'primary': engine for key, engine in db.engines.items()}
+
+
+def record_pools():
+    """
+    copy the pool numbers of this worker into the metrics
+    """
+    for name, engine in _engines().items():
+        status = pool_status(engine)
+        for state in ('in_use', 'idle', 'overflow'):
+            POOL_CONNECTIONS.labels(name, state).set(max(status[state], 0))
+        if 'checkouts' not in status:
+            continue
+
+        # a disposed pool (after fork) starts from zero again
+        pool = engine.pool
+        before = _pool_totals.get(name)
+        if before is None or before[0] is not pool:
+            before = (pool, 0, 0, 0.0)
+        stats = pool.stats
+        POOL_CHECKOUTS.labels(name).inc(stats.checkouts - before[1])
+        POOL_TIMEOUTS.labels(name).inc(stats.timeouts - before[2])
+        POOL_WAIT.labels(name).inc(stats.wait_total - before[3])
+        _pool_totals[name] = (pool, stats.checkouts, stats.timeouts, stats.wait_total)
+
+
+def init_metrics(app):
+    """
+    count and time every request by endpoint and status, the pool numbers are
+    refreshed after every request too
+
+    call before db.init_app and before any after_request hook that changes the body
+    (compression): hooks run in reverse order, so the sizes are the ones sent and the
+    pools are read after flask-sqlalchemy gave the request's connection back
+    """
+    if prometheus_client is None:
+        return
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+
+        # unmatched urls share one label, so scanners can not blow up the series count
+        endpoint = request.url_rule.endpoint if request.url_rule else 'none'
+        status = str(response.status_code)
+
+        REQUESTS.labels(endpoint, request.method, status).inc()
+        LATENCY.labels(endpoint, status).observe(time.perf_counter() - start)
+        # streamed bodies (the exports) have no length up front
+        if response.content_length is not None:
+            RESPONSE_SIZE.labels(endpoint, status).observe(response.content_length)
+
+        # set by paginate_query, the page size actually used
+        per_page = g.get('per_page')
+        if per_page is not None:
+            PER_PAGE.labels(endpoint).observe(per_page)
+        return response
+
+    @app.teardown_appcontext
+    def refresh_pools(exc):
+        record_pools()
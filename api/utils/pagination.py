@@ -1,52 +1,166 @@
-from flask import request, url_for
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
 
-def paginate_query(query, schema, endpoint, **kwargs):
+from flask import g, request, url_for
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.orm import load_only
+
+from api.utils.counts import COUNT_MODES, count_total
+from api.utils.dumpers import get_dumper
+from api.utils.links import LINK_MODES, collection_link_templates
+
+# query params that only shape the response, carried over into every pagination link
+PASSTHROUGH_ARGS = ('fields', 'links', 'embed')
+
+
+# sort key values json has no type for, written as {tag: string} and read back as the same type
+CURSOR_TYPES = {
+    '$dec': (Decimal, str, Decimal),
+    '$dt': (datetime, datetime.isoformat, datetime.fromisoformat),
+    '$date': (date, date.isoformat, date.fromisoformat)
+}
+
+
+def _encode_value(value):
+    # datetime before date, a datetime is a date too
+    for tag, (kind, encode, _) in CURSOR_TYPES.items():
+        if isinstance(value, kind):
+            return {tag: encode(value)}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if len(value) != 1:
+            raise ValueError('Invalid cursor')
+        (tag, text), = value.items()
+        if tag not in CURSOR_TYPES or not isinstance(text, str):
+            raise ValueError('Invalid cursor')
+        return CURSOR_TYPES[tag][2](text)
+    return value
+
+
+def encode_cursor(key, direction):
+    """
+    turn a seek key (list of column values) and a direction into an opaque token
+    """
+    payload = json.dumps({'k': [_encode_value(value) for value in key], 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    inverse of encode_cursor, returns (key, direction)
+
+    raises ValueError if the token was tampered with or is malformed
+    """
+    try:
+        # put back the padding we stripped when encoding
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        key, direction = payload['k'], payload['d']
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValueError('Invalid cursor')
+
+    if direction not in ('next', 'prev') or not isinstance(key, list):
+        raise ValueError('Invalid cursor')
+
+    try:
+        key = [_decode_value(value) for value in key]
+    except (ValueError, ArithmeticError):
+        # bad dates raise ValueError, bad Decimals decimal.InvalidOperation
+        raise ValueError('Invalid cursor')
+    return key, direction
+
+
+def paginate_query(query, schema, endpoint, sort_key=None, sort_desc=False, **kwargs):
     """
     helper function to paginate any SQLAlchemy query
-    
+
     params:
     - query: SQLAlchemy query object
     - schema: marshmallow schema for serialization
     - endpoint: flask endpoint name for generating links
+    - sort_key: optional column/expression the results are ordered by (primary key is always the tie breaker)
+    - sort_desc: order by sort_key (and primary key) descending
         **kwargs: additional URL parameters to include in links -> queries etc
-    
+
     returns:
         dictionary with paginated results and metadata
     """
-    # request args gets info about parsed contents of the query string (in dictionary) 
+    # here we get info about items displayed per page (default to 10)
+    per_page = request.args.get('per_page', 10, type=int)
+
+    if per_page < 1:
+        return {'error': 'Items per page must be 1 or greater'}, 400
+    # page size distribution in the metrics (see api.utils.metrics)
+    g.per_page = per_page
+
+    if request.args.get('links', 'full') not in LINK_MODES:
+        return {'error': 'Invalid links. Options are full, templated and none'}, 400
+
+    # cursor mode is opt in, an empty ?cursor= asks for the first page
+    if 'cursor' in request.args:
+        return keyset_paginate(
+            query, schema, endpoint, per_page,
+            cursor=request.args.get('cursor'),
+            sort_key=sort_key,
+            sort_desc=sort_desc,
+            **kwargs
+        )
+
+    # request args gets info about parsed contents of the query string (in dictionary)
     # here we get info about current page (default to page 1)
     page = request.args.get("page", 1, type=int)
 
-    # here we get info about items displayed per page (default to 10)
-    per_page = request.args.get('per_page', 10, type=int)
+    # how the total should be worked out, counting is the expensive half of a page
+    count_mode = request.args.get('count', 'exact')
 
     # validating parameters
     if page < 1:
         return {'error': 'Page number must be 1 or greater'}, 400
 
-    if per_page < 1:
-        return {'error': 'Items per page must be 1 or greater'}, 400
+    if count_mode not in COUNT_MODES:
+        return {'error': 'Invalid count. Options are exact, estimate and none'}, 400
 
-    # paginate the query
-    pagination = query.paginate(
-        page=page,
-        per_page=per_page,
-        error_out=False
-    )
+    if sort_key is not None:
+        columns = _order_columns(query, sort_key)
+        query = query.order_by(*[col.desc() if sort_desc else col.asc() for col in columns])
 
+    # total comes from the count cache when page 1 (or any other page) already paid for it
+    total = count_total(query, count_mode, endpoint, kwargs)
+    pages = -(-total // per_page) if total is not None else None
 
     # check if page exists
-    if page > pagination.pages and pagination.pages > 0:
-        return {'error': f'Page {page} does not exist. Maximum page is {pagination.pages}'}, 404
-    
+    if count_mode == 'exact' and page > pages and pages > 0:
+        return {'error': f'Page {page} does not exist. Maximum page is {pages}'}, 404
+
+    # fetch plain column rows rather than ORM instances when the schema allows it
+    query, dump = _row_source(query, schema)
+
+    # fetch one extra row so has_next does not depend on the (possibly estimated) total
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    has_next = len(rows) > per_page
+    has_prev = page > 1
+    rows = rows[:per_page]
+
+    if not rows and page > 1 and count_mode != 'exact':
+        return {'error': f'Page {page} does not exist'}, 404
 
     # serialize the items
-    items_data = schema.dump(pagination.items)
+    items_data = dump(rows)
 
     # build base URL parameters
     url_params = {'page': page, 'per_page': per_page, '_external': True}
+    # keep the count mode in the links so the next pages skip/estimate the count too
+    if count_mode != 'exact':
+        url_params['count'] = count_mode
     # update with all queries (if there are any)
     url_params.update(kwargs)
+    url_params.update(_passthrough_args())
 
     # build navigation links
     links = {
@@ -55,13 +169,13 @@ def paginate_query(query, schema, endpoint, **kwargs):
 
     # if there's a previous page
     # add link to previous page adn first page to links
-    if pagination.has_prev:
+    if has_prev:
 
         # copy url param, and update page with previous page number
         url_params_prev = url_params.copy()
-        url_params_prev['page'] = pagination.prev_num
+        url_params_prev['page'] = page - 1
         links['prev'] = url_for(endpoint, **url_params_prev)
-        
+
         # copy url param, and update page with first page number
         url_params_first = url_params.copy()
         url_params_first['page'] = 1
@@ -69,29 +183,167 @@ def paginate_query(query, schema, endpoint, **kwargs):
 
     # if there's a next page
     # add link to next page and last page to links
-    if pagination.has_next:
+    if has_next:
 
         # copy url param, and update page with next page number
         url_params_next = url_params.copy()
-        url_params_next['page'] = pagination.next_num
+        url_params_next['page'] = page + 1
         links['next'] = url_for(endpoint, **url_params_next)
-        
-        # copy url param, and update page with last page number
-        url_params_last = url_params.copy()
-        url_params_last['page'] = pagination.pages
-        links['last'] = url_for(endpoint, **url_params_last)
 
-                                
+        # last page is only known when we counted
+        if pages:
+            # copy url param, and update page with last page number
+            url_params_last = url_params.copy()
+            url_params_last['page'] = max(pages, page + 1)
+            links['last'] = url_for(endpoint, **url_params_last)
+
+    _add_item_templates(links, schema)
+
     # build response
     return {
         'items': items_data,
         'pagination': {
-            'page': pagination.page,
-            'pages': pagination.pages,
-            'per_page': pagination.per_page,
-            'total': pagination.total,
-            'has_next': pagination.has_next,
-            'has_prev': pagination.has_prev
+            'page': page,
+            'pages': pages,
+            'per_page': per_page,
+            'total': total,
+            'has_next': has_next,
+            'has_prev': has_prev
+        },
+        '_links': links
+    }, 200
+
+
+def keyset_paginate(query, schema, endpoint, per_page, cursor=None, sort_key=None, sort_desc=False, **kwargs):
+    """
+    seek (keyset) pagination: instead of LIMIT/OFFSET we filter on the last seen
+    (sort key, primary key) and never run a COUNT, so every page costs the same
+    no matter how deep it is
+
+    params:
+    - cursor: opaque token from a previous page's links, empty/None for the first page
+    other params as paginate_query
+
+    returns:
+        dictionary with results, cursor metadata and links
+    """
+    columns = _order_columns(query, sort_key)
+
+    key, direction = None, 'next'
+    if cursor:
+        try:
+            key, direction = decode_cursor(cursor)
+        except ValueError:
+            return {'error': 'Invalid cursor'}, 400
+        if len(key) != len(columns):
+            return {'error': 'Invalid cursor'}, 400
+
+    # walking backwards means flipping both the comparison and the order
+    backwards = direction == 'prev'
+    descending = sort_desc != backwards
+
+    seek = tuple_(*columns)
+    # the filters without the seek, for looking past the page in the other direction
+    unseeked = query
+    if key is not None:
+        query = query.filter(seek < tuple_(*key) if descending else seek > tuple_(*key))
+
+    query = query.order_by(*[col.desc() if descending else col.asc() for col in columns])
+    query, dump = _row_source(query, schema, columns)
+
+    # fetch one extra row to find out if there is anything beyond this page
+    rows = query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        rows.reverse()
+        # whatever follows the page in the normal order, one LIMIT 1 probe on the same index
+        has_next = False
+        if rows:
+            last = tuple_(*_row_key(rows[-1], [col.key for col in columns]))
+            beyond = seek < last if sort_desc else seek > last
+            has_next = unseeked.filter(beyond).with_entities(*columns).limit(1).first() is not None
+        has_prev = has_more
+    else:
+        has_prev, has_next = key is not None, has_more
+
+    # serialize the items
+    items_data = dump(rows)
+
+    # build base URL parameters
+    url_params = {'per_page': per_page, '_external': True}
+    url_params.update(kwargs)
+    url_params.update(_passthrough_args())
+
+    links = {
+        'self': url_for(endpoint, cursor=cursor or '', **url_params)
+    }
+
+    next_cursor = prev_cursor = None
+    if rows:
+        key_names = [col.key for col in columns]
+        if has_next:
+            next_cursor = encode_cursor(_row_key(rows[-1], key_names), 'next')
+            links['next'] = url_for(endpoint, cursor=next_cursor, **url_params)
+        if has_prev:
+            prev_cursor = encode_cursor(_row_key(rows[0], key_names), 'prev')
+            links['prev'] = url_for(endpoint, cursor=prev_cursor, **url_params)
+        links['first'] = url_for(endpoint, cursor='', **url_params)
+
+    _add_item_templates(links, schema)
+
+    return {
+        'items': items_data,
+        'pagination': {
+            'per_page': per_page,
+            'has_next': next_cursor is not None,
+            'has_prev': prev_cursor is not None,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
         },
         '_links': links
     }, 200
+
+
+def _order_columns(query, sort_key=None):
+    # primary key of the entity being paginated is always the final tie breaker
+    entity = query.column_descriptions[0]['entity']
+    primary_key = list(inspect(entity).primary_key)
+
+    if sort_key is None:
+        return primary_key
+    return [sort_key] + primary_key
+
+
+def _row_source(query, schema, key_columns=()):
+    """
+    switch the query to the schema's columns (plus any seek key columns) so rows come
+    back as plain tuples for the precompiled dumper, returns (query, dump function)
+    """
+    dumper = get_dumper(schema)
+    if dumper is None:
+        # ORM fallback, still only load what a sparse schema is going to dump
+        if schema.only:
+            entity = query.column_descriptions[0]['entity']
+            query = query.options(load_only(*[getattr(entity, name) for name in schema.only]))
+        return query, schema.dump
+
+    selected = {col.key for col in dumper.columns}
+    extra = [col for col in key_columns if col.key not in selected]
+    return query.with_entities(*dumper.columns, *extra), dumper.dump
+
+
+def _add_item_templates(links, schema):
+    # templated mode: the items go without _links, one set of templates covers them all
+    link_spec = getattr(schema, 'link_spec', None)
+    if link_spec and request.args.get('links') == 'templated':
+        links['items'] = collection_link_templates(link_spec)
+
+
+def _passthrough_args():
+    return {name: request.args[name] for name in PASSTHROUGH_ARGS if name in request.args}
+
+
+def _row_key(row, key_names):
+    return [getattr(row, name) for name in key_names]
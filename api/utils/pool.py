@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+import weakref
+
+from flask import current_app
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class PoolStats:
+    """
+    checkout counters of one pool, read by pool_status
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+
+class TimedCheckout:
+    """
+    pool mixin that measures how long each checkout waited for a connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+class TimedQueuePool(TimedCheckout, QueuePool):
+    pass
+
+
+# the asyncio engines (see api.utils.asgi) need an asyncio aware queue
+class TimedAsyncQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+# engines set up by setup_pool, disposed in forked children
+_engines = weakref.WeakSet()
+
+
+def _dispose_after_fork():
+    # close=False: the parent's sockets are left alone and the child opens its own
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+def setup_pool(engine, warmup=0):
+    """
+    make an engine fork safe and open warmup connections up front
+
+    a database that is down at startup is logged, not raised, the pool
+    connects lazily later as it would without the warmup
+    """
+    _engines.add(engine)
+
+    connections = []
+    try:
+        for _ in range(min(warmup, engine.pool.size())):
+            connections.append(engine.connect())
+    except Exception as err:
+        current_app.logger.warning('Connection pool warmup failed: %s', err)
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def pool_status(engine):
+    """
+    sizing numbers of an engine's pool, for the current worker process
+    """
+    pool = engine.pool
+    status = {
+        'pid': os.getpid(),
+        'size': pool.size(),
+        'in_use': pool.checkedout(),
+        'idle': pool.checkedin(),
+        # negative while the pool has not opened all of pool_size yet
+        'overflow': pool.overflow(),
+        'max_overflow': pool._max_overflow
+    }
+
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        waits = stats.checkouts + stats.timeouts
+        status.update({
+            'checkouts': stats.checkouts,
+            'timeouts': stats.timeouts,
+            'wait_avg_ms': round(stats.wait_total / waits * 1000, 3) if waits else 0.0,
+            'wait_max_ms': round(stats.wait_max * 1000, 3)
+        })
+    return status
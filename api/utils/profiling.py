@@ -0,0 +1,252 @@
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+from collections import Counter
+
+from flask import g, request
+from itsdangerous import BadSignature, TimestampSigner
+
+from api.utils.asgi import blocking
+
+# a request carrying a valid token here is profiled whatever the sample rate,
+# see profile_token for making one
+PROFILE_HEADER = 'X-Profile'
+PROFILERS = ('stack', 'cprofile')
+
+_SALT = 'sakila-profile'
+
+# only one cProfile profiler can run at a time (python 3.12+ refuses a second one),
+# a request sampled while another one is being profiled just goes unprofiled
+_cprofile_lock = threading.Lock()
+
+
+def profile_token(secret):
+    """
+    value for the X-Profile header, valid for PROFILE_TOKEN_MAX_AGE seconds
+
+    python -c "from api.utils.profiling import profile_token; print(profile_token('<PROFILE_SECRET>'))"
+    """
+    return TimestampSigner(secret, salt=_SALT).sign('profile').decode()
+
+
+def _valid_token(token, secret, max_age):
+    try:
+        TimestampSigner(secret, salt=_SALT).unsign(token, max_age=max_age)
+    except BadSignature:
+        return False
+    return True
+
+
+# "module:qualname" per code object, frames are labelled a lot while sampling
+_labels = {}
+
+
+def _label(frame):
+    code = frame.f_code
+    label = _labels.get(code)
+    if label is None:
+        label = f'{frame.f_globals.get("__name__", "?")}:{getattr(code, "co_qualname", code.co_name)}'
+        _labels[code] = label
+    return label
+
+
+def _collapse(frame):
+    # root first, the collapsed stack format flamegraph.pl/speedscope/inferno read
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler(threading.Thread):
+    """
+    records the stack of one thread every `interval` seconds until stopped
+
+    under asgi.py every request runs on the event loop thread, samples taken while
+    another request has the loop are counted for this one too
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[_collapse(frame)] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.stacks
+
+
+class _ProfiledBody:
+    # streamed body whose profile ends when the server closes it, i.e. once it is sent
+    # (or the client went away), teardown already ran before the first chunk
+
+    def __init__(self, body, stop):
+        self.body = body
+        self.stop = stop
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            self.stop()
+
+
+class RouteProfiles:
+    """
+    samples added up per endpoint for this worker, rewritten to the profile
+    directory after every profiled request:
+
+        <endpoint>.<pid>.collapsed   "frame;frame;frame count" lines (stack sampler)
+        <endpoint>.<pid>.pstats      cProfile stats, pstats.Stats/snakeviz read them
+
+    the pid keeps workers from overwriting each other's files. on the event loop
+    (asgi.py) the files are written from a worker thread
+    """
+
+    def __init__(self):
+        self.directory = None
+        self._stacks = {}
+        self._stats = {}
+        self._requests = Counter()
+        self._lock = threading.Lock()
+
+    def add_stacks(self, endpoint, stacks):
+        with self._lock:
+            self._requests[endpoint] += 1
+            total = self._stacks.setdefault(endpoint, Counter())
+            total.update(stacks)
+            data = ''.join(f'{stack} {count}\n' for stack, count in total.items()).encode()
+        blocking(self._write, self._path(endpoint, 'collapsed'), data)
+
+    def add_profile(self, endpoint, profile):
+        with self._lock:
+            self._requests[endpoint] += 1
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                stats = self._stats[endpoint] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            # marshalled under the lock, stats is added to by other requests
+            data = marshal.dumps(stats.stats)
+        blocking(self._write, self._path(endpoint, 'pstats'), data)
+
+    def requests(self):
+        """
+        number of profiled requests per endpoint
+        """
+        with self._lock:
+            return dict(self._requests)
+
+    def clear(self):
+        with self._lock:
+            self._stacks.clear()
+            self._stats.clear()
+            self._requests.clear()
+
+    @staticmethod
+    def _write(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def _path(self, endpoint, extension):
+        return os.path.join(self.directory, f'{endpoint}.{os.getpid()}.{extension}')
+
+
+route_profiles = RouteProfiles()
+
+
+def init_profiling(app):
+    """
+    profile a sample of the requests, per endpoint, into PROFILE_DIR
+
+    with PROFILING on a PROFILE_SAMPLE_RATE fraction of the requests (or the rates
+    of PROFILE_ENDPOINTS) are profiled. with PROFILE_SECRET set a request sending a
+    signed X-Profile header is profiled even with PROFILING off, so production
+    traffic can be looked at without a redeploy
+
+    register before the other after_request hooks so compression is profiled too.
+    streamed responses (the exports) are profiled until the body is sent
+    """
+    sampling = app.config['PROFILING']
+    secret = app.config['PROFILE_SECRET']
+    if not sampling and not secret:
+        return
+
+    profiler = app.config['PROFILER']
+    if profiler not in PROFILERS:
+        raise ValueError(f'PROFILER must be one of {", ".join(PROFILERS)}, not {profiler!r}')
+    rates = app.config['PROFILE_ENDPOINTS']
+    default_rate = 0.0 if rates else app.config['PROFILE_SAMPLE_RATE']
+    interval = app.config['PROFILE_INTERVAL_MS'] / 1000
+    max_age = app.config['PROFILE_TOKEN_MAX_AGE']
+
+    route_profiles.directory = app.config['PROFILE_DIR']
+    os.makedirs(route_profiles.directory, exist_ok=True)
+
+    def wanted():
+        token = request.headers.get(PROFILE_HEADER)
+        if token and secret and _valid_token(token, secret, max_age):
+            return True
+        return sampling and random.random() < rates.get(request.endpoint, default_rate)
+
+    @app.before_request
+    def start_profile():
+        # unmatched urls are not worth a profile
+        if request.endpoint is None or not wanted():
+            return
+        if profiler == 'cprofile':
+            if not _cprofile_lock.acquire(blocking=False):
+                return
+            profile = cProfile.Profile()
+            profile.enable()
+            g.profile = (request.endpoint, profile)
+        else:
+            sampler = StackSampler(threading.get_ident(), interval)
+            sampler.start()
+            g.profile = (request.endpoint, sampler)
+
+    def stop(profile):
+        endpoint, running = profile
+        if isinstance(running, StackSampler):
+            # joining the sampler waits for its current sample
+            route_profiles.add_stacks(endpoint, blocking(running.stop))
+        else:
+            running.disable()
+            _cprofile_lock.release()
+            route_profiles.add_profile(endpoint, running)
+
+    @app.after_request
+    def stop_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            if response.is_streamed:
+                response.response = _ProfiledBody(response.response, lambda: stop(profile))
+            else:
+                stop(profile)
+        return response
+
+    # requests that never got to after_request
+    @app.teardown_request
+    def stop_unfinished_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            stop(profile)
@@ -0,0 +1,119 @@
+import itertools
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+# requests that only read, their queries may go to a replica
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+REPLICA_STRATEGIES = ('round_robin', 'least_loaded')
+# bind keys the replica engines are registered under in SQLALCHEMY_BINDS
+REPLICA_PREFIX = 'replica_'
+# set after a write, holds the time until which the client reads from the primary
+STICKY_COOKIE = 'read_primary_until'
+# the same value as a header, for clients without a cookie jar: echo it back on the next requests
+STICKY_HEADER = 'X-Read-Primary-Until'
+
+_next_replica = itertools.count()
+
+
+def replica_binds(uris):
+    """
+    SQLALCHEMY_BINDS entries for the replica URIs, one engine (and pool) each
+    """
+    return {f'{REPLICA_PREFIX}{index}': uri for index, uri in enumerate(uris)}
+
+
+def replica_engines(engines):
+    """
+    {bind key: engine} of the replicas among db.engines
+    """
+    return {key: engine for key, engine in engines.items() if key is not None and key.startswith(REPLICA_PREFIX)}
+
+
+def use_primary():
+    """
+    send the rest of this request's queries to the primary
+    """
+    g.read_primary = True
+
+
+class RoutingSession(Session):
+    """
+    session that sends the queries of read-only requests to a replica
+
+    everything else goes to the primary: requests with other methods, flushes and
+    INSERT/UPDATE/DELETE statements, clients inside their read-your-writes window
+    and requests that called use_primary(). a request sticks to one replica, so
+    e.g. a page and its count come from the same copy of the data
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        # an explicit bind, or a model on a bind of its own
+        if bind is not None or engine is not self._db.engines[None]:
+            return engine
+        if self._flushing or isinstance(clause, UpdateBase) or not _reads_from_replica():
+            return engine
+
+        if 'replica' not in g:
+            g.replica = _pick_replica(list(replica_engines(self._db.engines).values())) or engine
+        return g.replica
+
+
+def _reads_from_replica():
+    return (
+        has_request_context()
+        and request.method in SAFE_METHODS
+        and not g.get('read_primary', False)
+    )
+
+
+def _pick_replica(engines):
+    if not engines:
+        return None
+    if current_app.config['REPLICA_STRATEGY'] == 'least_loaded':
+        # fewest connections in use in this worker's pools
+        return min(engines, key=lambda engine: engine.pool.checkedout())
+    return engines[next(_next_replica) % len(engines)]
+
+
+def init_routing(app):
+    """
+    read-your-writes: after a successful write the client is told to keep its reads
+    on the primary for READ_PRIMARY_WINDOW seconds, long enough for the replicas to
+    catch up
+
+    browsers get the read_primary_until cookie. other clients (no cookie jar, or a
+    different host for reads and writes) copy the X-Read-Primary-Until response
+    header of a write into their following requests. either one only ever moves
+    the client's own reads, other clients keep reading from the replicas and may
+    see the old rows until replication caught up (their ETags stay consistent with
+    what they read, see api.utils.versions)
+    """
+
+    def sticky_until(value):
+        try:
+            until = float(value or 0)
+        except ValueError:
+            return 0
+        # a value further out than a window was not set by us, do not pin the client forever
+        return until if until <= time.time() + app.config['READ_PRIMARY_WINDOW'] else 0
+
+    @app.before_request
+    def stick_to_primary():
+        until = max(sticky_until(request.cookies.get(STICKY_COOKIE)), sticky_until(request.headers.get(STICKY_HEADER)))
+        if until > time.time():
+            use_primary()
+
+    @app.after_request
+    def mark_write(response):
+        window = app.config['READ_PRIMARY_WINDOW']
+        if not app.config['SQLALCHEMY_REPLICA_URIS'] or window <= 0:
+            return response
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            until = str(time.time() + window)
+            response.set_cookie(STICKY_COOKIE, until, max_age=window, httponly=True, samesite='Lax')
+            response.headers[STICKY_HEADER] = until
+        return response
@@ -0,0 +1,55 @@
+from sqlalchemy import column, func, literal_column, or_, select, table
+from sqlalchemy.dialects.mysql import match
+
+from api.models import db
+from api.models.search import fts_table_name
+
+# longest ?q= we accept
+MAX_SEARCH_LENGTH = 255
+
+
+def apply_search(query, model, columns, q):
+    """
+    restrict a query to rows matching a full-text search, best matches first
+
+    MySQL uses the FULLTEXT index (natural language mode), SQLite the FTS5 table
+    (see api.models.search). any other database falls back to an unranked LIKE
+
+    params:
+    - query: SQLAlchemy query over model
+    - model: the searched model
+    - columns: the indexed model attributes
+    - q: the search text
+
+    returns:
+        (query, score column) -> pass the score as paginate_query's sort_key with
+        sort_desc=True, it is None when the backend can not rank
+    """
+    terms = q.split()
+    primary_key = model.__mapper__.primary_key[0]
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        against = match(*columns, against=' '.join(terms)).in_natural_language_mode()
+        search = select(primary_key.label('id'), against.label('score')).where(against).subquery('search')
+
+    elif dialect == 'sqlite':
+        fts = fts_table_name(model)
+        # quote every term so user input can not use FTS5 query syntax, any term may match
+        expression = ' OR '.join('"' + term.replace('"', '""') + '"' for term in terms)
+        search = (
+            select(
+                column('rowid').label('id'),
+                # bm25 is lower for better matches, negate it so higher is better like MySQL
+                (-func.bm25(literal_column(fts))).label('score')
+            )
+            .select_from(table(fts))
+            .where(literal_column(fts).op('MATCH')(expression))
+            .subquery('search')
+        )
+
+    else:
+        return query.filter(or_(*[col.ilike(f'%{term}%') for col in columns for term in terms])), None
+
+    query = query.join(search, primary_key == search.c.id)
+    return query, search.c.score
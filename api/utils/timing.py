@@ -0,0 +1,123 @@
+import json
+import logging
+import time
+from contextlib import nullcontext
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# structured slow query log, one JSON object per statement over SLOW_QUERY_MS
+slow_query_log = logging.getLogger('api.slow_queries')
+
+# set by init_timing, while False nothing is measured and no engine events are hooked
+enabled = False
+_slow_query_seconds = None
+_disabled = nullcontext()
+
+
+class _Measure:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if has_request_context():
+            timings = _request_timings()
+            timings[self.name] = timings.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+def measure(name):
+    """
+    context manager adding the time spent inside to the request's Server-Timing
+    entry `name` (serialize, json), a shared no-op when timing is disabled
+    """
+    return _Measure(name) if enabled else _disabled
+
+
+class TimedDump:
+    """
+    schema mixin timing Schema.dump as serialization
+    """
+
+    def dump(self, obj, *, many=None):
+        with measure('serialize'):
+            return super().dump(obj, many=many)
+
+
+def _request_timings():
+    if 'timings' not in g:
+        g.timings = {'db': 0.0, 'statements': 0}
+    return g.timings
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append((statement, time.perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()[1]
+    in_request = has_request_context()
+    if in_request:
+        timings = _request_timings()
+        timings['db'] += elapsed
+        timings['statements'] += 1
+
+    if elapsed >= _slow_query_seconds:
+        slow_query_log.warning(json.dumps({
+            'event': 'slow_query',
+            'endpoint': request.endpoint if in_request else None,
+            'duration_ms': round(elapsed * 1000, 3),
+            'statement': statement,
+            # types only, the values may be personal data and are not needed to reproduce a plan
+            'parameters': _parameter_shape(parameters, executemany)
+        }))
+
+
+def _handle_error(context):
+    # a failed statement never gets to after_cursor_execute, drop its start so the
+    # next statement on the (pooled) connection is not timed from it. errors raised
+    # before the statement was sent (e.g. binding its parameters) have no start
+    starts = context.connection.info.get('query_start') if context.connection is not None else None
+    if starts and starts[-1][0] == context.statement:
+        starts.pop()
+
+
+def _parameter_shape(parameters, executemany):
+    if executemany:
+        rows = list(parameters)
+        return {'rows': len(rows), 'row': _parameter_shape(rows[0], False) if rows else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def init_timing(app):
+    """
+    per request SQL statement count, DB time, serialization and JSON encode time
+    as a Server-Timing header, plus the slow query log
+
+    off unless SQL_TIMING is set, then every engine (asyncio ones too) is hooked
+    """
+    global enabled, _slow_query_seconds
+    if not app.config['SQL_TIMING']:
+        return
+
+    enabled = True
+    _slow_query_seconds = app.config['SLOW_QUERY_MS'] / 1000
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = _request_timings()
+        entries = [f'db;dur={timings["db"] * 1000:.2f};desc="{timings["statements"]} statements"']
+        entries += [
+            f'{name};dur={timings[name] * 1000:.2f}' for name in ('serialize', 'json') if name in timings
+        ]
+        response.headers.add('Server-Timing', ', '.join(entries))
+        return response
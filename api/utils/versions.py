@@ -0,0 +1,168 @@
+import logging
+import secrets
+
+from flask import g, has_request_context
+from sqlalchemy import bindparam, inspect, insert, select, update
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from api.models import db
+from api.models.version import ApiVersion
+
+log = logging.getLogger(__name__)
+
+# row holding the random epoch of this database's versions, see VersionStore.epoch
+EPOCH_KEY = ('',)
+
+_UPSERTS = {'mysql': mysql.insert, 'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+def entity_ident(model, ident):
+    """
+    primary key value as the primary key's python type, so the '5' and '05' of two
+    urls and the 5 a write handler has all name the same entity. values that do not
+    convert are kept as strings, they match no row anyway
+    """
+    try:
+        return model.__mapper__.primary_key[0].type.python_type(ident)
+    except (TypeError, ValueError, NotImplementedError):
+        return str(ident)
+
+
+def entity_key(model, ident):
+    # path parameters arrive as strings, '5', '05' and 5 are the same entity
+    return (model.__table__.name, entity_ident(model, ident))
+
+
+def collection_key(model):
+    """
+    key for all rows of a model, or of a plain table such as film_actor
+    """
+    table = getattr(model, '__table__', model)
+    return (table.name,)
+
+
+def _key_name(key):
+    # ('film', 5) -> 'film:5', ('film',) -> 'film'
+    return ':'.join(str(part) for part in key)
+
+
+class VersionStore:
+    """
+    version numbers of entities and collections, kept in the api_version table so
+    every worker (on every host) sees the same ones
+
+    keys are tuples: (table name,) for a whole collection and (table name, id) for
+    a single entity, see entity_key/collection_key. the write handlers bump them on
+    the primary right after their commit. reads go through db.session, a request
+    reading from a replica gets the versions of that same copy of the data, so
+    what a view reads is never older than the versions it is tagged with. a request
+    reads each key once (g.versions)
+
+    without the table (a database the migration has not run on yet) available()
+    is False, every version reads as 0 and conditional() sends no ETags
+    """
+
+    def __init__(self):
+        # engine -> whether it has the table, looked up once
+        self._tables = {}
+
+    def available(self, engine=None):
+        engine = engine or db.session.get_bind()
+        present = self._tables.get(engine)
+        if present is None:
+            present = self._tables[engine] = inspect(engine).has_table(ApiVersion.__tablename__)
+            if not present:
+                log.warning('no %s table on %s, ETags are off until python -m migrations.api_version ran '
+                            'and the workers restarted', ApiVersion.__tablename__, engine.url.render_as_string())
+        return present
+
+    def get(self, *keys):
+        """
+        tuple of the keys' versions, 0 for keys never bumped
+        """
+        seen = g.setdefault('versions', {}) if has_request_context() else {}
+        missing = [key for key in keys if key not in seen]
+        if missing:
+            seen.update(self._read(missing))
+        return tuple(seen[key] for key in keys)
+
+    def seen(self):
+        """
+        (key, version) pairs this request read so far, for caches whose entries
+        depend on the same rows as the response
+        """
+        if not has_request_context():
+            return ()
+        return tuple(sorted(g.get('versions', {}).items(), key=lambda item: _key_name(item[0])))
+
+    def epoch(self):
+        """
+        random number of this api_version table, part of every ETag so a recreated
+        table (or database) never makes the ETags of the old one valid again
+        """
+        epoch, = self.get(EPOCH_KEY)
+        if epoch or not self.available():
+            return epoch
+        # first use, whichever worker inserts it first wins
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    insert(ApiVersion), {'key_name': _key_name(EPOCH_KEY), 'version': secrets.randbits(62) + 1}
+                )
+        except IntegrityError:
+            pass
+        with db.engine.connect() as connection:
+            epoch = connection.execute(
+                select(ApiVersion.version).where(ApiVersion.key_name == _key_name(EPOCH_KEY))
+            ).scalar_one()
+        if has_request_context():
+            g.versions[EPOCH_KEY] = epoch
+        return epoch
+
+    def bump(self, *keys):
+        """
+        add one to the versions of the keys, on the primary in a transaction of its own
+
+        call it after the write committed: a request that reads in between gets the
+        new rows under the old versions, which only makes its ETag go stale sooner
+        """
+        names = sorted({_key_name(key) for key in keys})
+        if not names or not self.available(db.engine):
+            return
+        try:
+            # sorted, so concurrent bumps lock the rows in the same order
+            with db.engine.begin() as connection:
+                upsert = _UPSERTS.get(connection.dialect.name)
+                if upsert is None:
+                    for name in names:
+                        changed = connection.execute(
+                            update(ApiVersion).where(ApiVersion.key_name == name)
+                            .values(version=ApiVersion.version + 1)
+                        ).rowcount
+                        if not changed:
+                            connection.execute(insert(ApiVersion), {'key_name': name, 'version': 1})
+                    return
+                statement = upsert(ApiVersion).values(key_name=bindparam('name'), version=1)
+                if connection.dialect.name == 'mysql':
+                    statement = statement.on_duplicate_key_update(version=ApiVersion.version + 1)
+                else:
+                    statement = statement.on_conflict_do_update(
+                        index_elements=[ApiVersion.key_name], set_={'version': ApiVersion.version + 1}
+                    )
+                connection.execute(statement, [{'name': name} for name in names])
+        except SQLAlchemyError:
+            # the write itself went through, failing its response now would only invite a retry
+            log.exception('versions not bumped, ETags of %s stay valid until their next write', names)
+
+    def _read(self, keys):
+        if not self.available():
+            return {key: 0 for key in keys}
+        names = {_key_name(key): key for key in keys}
+        found = dict(db.session.execute(
+            select(ApiVersion.key_name, ApiVersion.version).where(ApiVersion.key_name.in_(names))
+        ).all())
+        return {key: found.get(name, 0) for name, key in names.items()}
+
+
+versions = VersionStore()
@@ -10,13 +10,56 @@ def create_app():
     app = Flask(__name__)
     # set configuration
     app.config.from_object(config)
-    # apply CORS to all blueprints (global)
-    CORS(app, resources={r"/api/*": {"origins": app.config["CORS_ORIGINS"]}})
+    # orjson/msgspec for jsonify and the exports when installed (see api.utils.json_provider)
+    from api.utils.json_provider import FastJSONProvider
+    app.json = FastJSONProvider(app)
+    # apply CORS to all blueprints (global), scripts on other origins may read the
+    # read-your-writes header (see api.utils.routing)
+    from api.utils.routing import STICKY_HEADER
+    CORS(app, resources={r"/api/*": {"origins": app.config["CORS_ORIGINS"]}}, expose_headers=[STICKY_HEADER])
     
+    # request/latency/size/pool metrics for /api/metrics, registered first so its
+    # after_request hook sees the final (compressed) response
+    from api.utils.metrics import init_metrics
+    init_metrics(app)
+
+    # rate and concurrency limits in front of the database, after the metrics so
+    # shed requests are counted and before the profiler so they are not profiled
+    from api.utils.admission import init_admission
+    init_admission(app)
+
+    # sampled per endpoint profiles, or on demand through a signed X-Profile header.
+    # early too, so the compression of the response is part of the profile
+    from api.utils.profiling import init_profiling
+    init_profiling(app)
+
+    # read replicas are extra binds, the session picks between them and the primary
+    from api.utils.routing import init_routing, replica_binds
+    app.config["SQLALCHEMY_BINDS"] = {
+        **app.config.get("SQLALCHEMY_BINDS", {}),
+        **replica_binds(app.config["SQLALCHEMY_REPLICA_URIS"])
+    }
+    init_routing(app)
+
+    # gzip/deflate/zstd for the api responses
+    from api.utils.compression import init_compression
+    init_compression(app)
+
+    # Server-Timing header and slow query log, only hooked when SQL_TIMING is on
+    from api.utils.timing import init_timing
+    init_timing(app)
+
     # set up models
     from api.models import db
     db.init_app(app)
 
+    # open some connections now instead of on the first requests, and make the
+    # engines drop inherited connections in forked workers
+    from api.utils.pool import setup_pool
+    with app.app_context():
+        for engine in db.engines.values():
+            setup_pool(engine, app.config["DB_POOL_WARMUP"])
+
     # set up schemas
     from api.schemas import ma
     ma.init_app(app)
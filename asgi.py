@@ -0,0 +1,9 @@
+# asgi entry point: the same app and routes, with the database on asyncio engines
+# run with e.g. uvicorn --factory asgi:create_asgi_app --workers 4
+
+from api.utils.asgi import AsgiApp
+from app import create_app
+
+
+def create_asgi_app():
+    return AsgiApp(create_app())
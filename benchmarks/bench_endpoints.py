@@ -0,0 +1,236 @@
+# end to end benchmark of every /api/actors and /api/films route through the flask test client
+#
+# reports p50/p95/p99 latency, SQL statements and response bytes per case and compares
+# them with a saved baseline, so a change can be measured before and after
+#
+# usage: python benchmarks/bench_endpoints.py [--profile small|large] [--repeat 50]
+#                                             [--warm] [--save-baseline] [--baseline PATH]
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from seed import create_bench_app, seed
+
+# rows seeded per profile: (actors, films, film_actor)
+PROFILES = {
+    'small': (1000, 1000, 5000),
+    'large': (10000, 20000, 100000)
+}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+ACTOR = {'first_name': 'BENCH', 'last_name': 'ACTOR'}
+FILM = {
+    'title': 'BENCH FILM', 'language_id': 1, 'rental_duration': 3,
+    'rental_rate': '2.99', 'replacement_cost': '19.99', 'rating': 'PG'
+}
+
+
+def cases(actors, films):
+    """
+    (name, method, url builder, body) per benchmarked request
+
+    the url builder gets the test client, so DELETE can create what it deletes
+    (untimed) and every iteration removes a fresh row
+    """
+    def url(path):
+        return lambda client: path
+
+    def created(create_path, item_path, body, key):
+        def build(client):
+            ident = client.post(create_path, json=body).get_json()[key]
+            return f'{item_path}/{ident}'
+        return build
+
+    deep_actors = actors // 10 // 2
+    deep_films = films // 10 // 2
+    return [
+        # actors
+        ('actors list', 'GET', url('/api/actors/'), None),
+        ('actors list per_page=100', 'GET', url('/api/actors/?per_page=100'), None),
+        ('actors list deep page', 'GET', url(f'/api/actors/?page={deep_actors}'), None),
+        ('actors list cursor', 'GET', url('/api/actors/?cursor='), None),
+        ('actors list count=none', 'GET', url(f'/api/actors/?page={deep_actors}&count=none'), None),
+        ('actors filter last_name', 'GET', url('/api/actors/?last_name=SHARK1'), None),
+        ('actors search', 'GET', url('/api/actors/?q=shark'), None),
+        ('actors embed films', 'GET', url('/api/actors/?embed=films'), None),
+        ('actors export ndjson', 'GET', url('/api/actors/export?format=ndjson'), None),
+        ('actors stats', 'GET', url('/api/actors/stats'), None),
+        ('actor get', 'GET', url('/api/actors/1'), None),
+        ('actor get fields', 'GET', url('/api/actors/1?fields=first_name'), None),
+        ('actor films', 'GET', url('/api/actors/1/films'), None),
+        ('actor create', 'POST', url('/api/actors/'), ACTOR),
+        ('actor put', 'PUT', url('/api/actors/2'), {**ACTOR, 'film_ids': [1, 2, 3]}),
+        ('actor patch', 'PATCH', url('/api/actors/2'), {'add_film_ids': [4], 'remove_film_ids': [1]}),
+        ('actor delete', 'DELETE', created('/api/actors/', '/api/actors', ACTOR, 'actor_id'), None),
+        ('actors bulk create', 'POST', url('/api/actors/bulk'), [ACTOR] * 50),
+        ('actors bulk patch', 'PATCH', url('/api/actors/bulk'),
+         [{'actor_id': i, 'last_name': 'BULK'} for i in range(1, 51)]),
+
+        # films
+        ('films list', 'GET', url('/api/films'), None),
+        ('films list per_page=100', 'GET', url('/api/films?per_page=100'), None),
+        ('films list deep page', 'GET', url(f'/api/films?page={deep_films}'), None),
+        ('films list cursor', 'GET', url('/api/films?cursor='), None),
+        ('films list count=estimate', 'GET', url(f'/api/films?page={deep_films}&count=estimate'), None),
+        ('films filter rating', 'GET', url('/api/films?rating=PG-13&rental_duration=5'), None),
+        ('films filter features', 'GET', url('/api/films?special_features=Trailers,Commentaries'), None),
+        ('films search', 'GET', url('/api/films?q=shark%20mine'), None),
+        ('films sparse fields', 'GET', url('/api/films?per_page=100&fields=title,rating'), None),
+        ('films embed actors', 'GET', url('/api/films?embed=actors'), None),
+        ('films links templated', 'GET', url('/api/films?per_page=100&links=templated'), None),
+        ('films export csv', 'GET', url('/api/films/export?format=csv'), None),
+        ('films stats', 'GET', url('/api/films/stats'), None),
+        ('film get', 'GET', url('/api/films/1'), None),
+        ('film get embed', 'GET', url('/api/films/1?embed=actors'), None),
+        ('film actors', 'GET', url('/api/films/1/actors'), None),
+        ('film create', 'POST', url('/api/films'), {**FILM, 'actor_ids': [1, 2]}),
+        ('film put', 'PUT', url('/api/films/2'), {**FILM, 'actor_ids': [1, 2, 3]}),
+        ('film patch', 'PATCH', url('/api/films/2'), {'add_actor_ids': [4], 'remove_actor_ids': [1]}),
+        ('film delete', 'DELETE', created('/api/films', '/api/films', FILM, 'film_id'), None),
+        ('films bulk create', 'POST', url('/api/films/bulk'), [FILM] * 50),
+        ('films bulk patch', 'PATCH', url('/api/films/bulk'),
+         [{'film_id': i, 'length': 100} for i in range(1, 51)])
+    ]
+
+
+def percentile(samples, pct):
+    if len(samples) < 2:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def clear_caches():
+    from api.utils.aggregates import SUMMARIES
+    from api.utils.compression import body_cache
+    from api.utils.counts import count_cache
+    from api.utils.entities import entity_cache
+
+    count_cache.invalidate()
+    entity_cache.clear()
+    body_cache.clear()
+    for summary in SUMMARIES:
+        summary.reset()
+
+
+def run(app, repeat, warm, headers):
+    from sqlalchemy import event
+
+    from api.models import db
+
+    statements = [0]
+
+    def count_statement(*args):
+        statements[0] += 1
+
+    with app.app_context():
+        actors, films = db.session.execute(db.text(
+            'SELECT (SELECT COUNT(*) FROM actor), (SELECT COUNT(*) FROM film)'
+        )).one()
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+    client = app.test_client()
+    results = {}
+    for name, method, build_url, body in cases(actors, films):
+        samples = []
+        counts = []
+        size = 0
+        for _ in range(repeat):
+            url = build_url(client)
+            if not warm:
+                clear_caches()
+
+            statements[0] = 0
+            start = time.perf_counter()
+            response = client.open(url, method=method, json=body, headers=headers)
+            # reading the body drains streamed responses (the exports) inside the timing
+            size = len(response.get_data())
+            samples.append(time.perf_counter() - start)
+            counts.append(statements[0])
+
+            if response.status_code >= 400:
+                raise SystemExit(f'{name}: {method} {url} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+
+        results[name] = {
+            'p50_ms': round(percentile(samples, 50) * 1000, 3),
+            'p95_ms': round(percentile(samples, 95) * 1000, 3),
+            'p99_ms': round(percentile(samples, 99) * 1000, 3),
+            'statements': max(counts),
+            'bytes': size
+        }
+    return results
+
+
+def report(results, baseline, tolerance):
+    """
+    print the results next to the baseline, returns the names of cases that regressed
+    """
+    regressed = []
+    print(f'{"case":<28} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"sql":>4} {"bytes":>9}  vs baseline')
+    for name, result in results.items():
+        line = (
+            f'{name:<28} {result["p50_ms"]:>8.2f} {result["p95_ms"]:>8.2f} {result["p99_ms"]:>8.2f} '
+            f'{result["statements"]:>4} {result["bytes"]:>9}'
+        )
+        before = baseline.get(name)
+        if before:
+            change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0.0
+            line += f'  p50 {change:+.0f}%'
+            if result['statements'] != before['statements']:
+                line += f', sql {before["statements"]} -> {result["statements"]}'
+            # more statements is a regression whatever the timing noise says
+            if change > tolerance or result['statements'] > before['statements']:
+                regressed.append(name)
+                line += '  REGRESSED'
+        print(line)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--profile', choices=PROFILES, default='small')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--warm', action='store_true', help='keep the count/entity/body caches between requests')
+    parser.add_argument('--accept-encoding', default=None, help='Accept-Encoding sent with every request')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='write this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=20.0, help='p50 increase in percent flagged as a regression')
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+
+    actors, films, film_actors = PROFILES[args.profile]
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = create_bench_app(db_path)
+    seed(app, actors=actors, films=films, film_actors=film_actors)
+
+    headers = {'Accept-Encoding': args.accept_encoding} if args.accept_encoding else {}
+    results = run(app, args.repeat, args.warm, headers)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        # a baseline only means something for the same data and settings
+        if saved.get('profile') == args.profile and saved.get('warm') == args.warm:
+            baseline = saved['results']
+        else:
+            print(f'baseline {args.baseline} is for another profile/cache setting, not comparing')
+
+    regressed = report(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'profile': args.profile, 'warm': args.warm, 'repeat': args.repeat, 'results': results}, f, indent=2)
+        print(f'baseline saved to {args.baseline}')
+
+    if regressed and args.fail_on_regression:
+        sys.exit(f'{len(regressed)} case(s) regressed: {", ".join(regressed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+# compares flask's stdlib JSON provider with FastJSONProvider (orjson/msgspec)
+# encoding serialized film pages, Decimals included
+#
+# usage: python benchmarks/bench_json.py [--films 5000] [--repeat 50]
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from seed import create_bench_app, seed
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--films', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = create_bench_app(db_path)
+    seed(app, actors=1000, films=args.films, film_actors=args.films * 5)
+
+    from flask.json.provider import DefaultJSONProvider
+
+    from api.models.film import Film
+    from api.schemas.film import films_schema
+    from api.utils.dumpers import get_dumper
+
+    dumper = get_dumper(films_schema)
+    stdlib = DefaultJSONProvider(app)
+    fast = app.json
+
+    print(f'backend: {fast.backend}')
+    print(f'{"per_page":>8} {"stdlib ms":>10} {f"{fast.backend} ms":>10} {"speedup":>8}')
+    with app.test_request_context('/api/films'):
+        for per_page in (100, 1000):
+            rows = Film.query.with_entities(*dumper.columns).order_by(Film.film_id).limit(per_page).all()
+            # the same shape get_all_films returns
+            page = {'films': dumper.dump(rows), 'pagination': {'page': 1, 'per_page': per_page}}
+
+            # byte for byte the same body, Decimals as strings included
+            assert stdlib.response(page).get_data() == fast.response(page).get_data()
+
+            slow = timed(lambda: stdlib.response(page), args.repeat)
+            quick = timed(lambda: fast.response(page), args.repeat)
+            print(f'{per_page:>8} {slow * 1000:>10.2f} {quick * 1000:>10.2f} {slow / quick:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# compares the marshmallow read path (ORM instances + Schema.dump) with the
+# column-row path (with_entities + precompiled RowDumper)
+#
+# usage: python benchmarks/bench_serialization.py [--films 5000] [--repeat 20]
+
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+from seed import create_bench_app, seed
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--films', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app = create_bench_app(db_path)
+    seed(app, actors=1000, films=args.films, film_actors=args.films * 5)
+
+    from api.models import db
+    from api.models.film import Film
+    from api.schemas.film import films_schema
+    from api.utils.dumpers import get_dumper
+
+    dumper = get_dumper(films_schema)
+
+    print(f'{"per_page":>8} {"marshmallow ms":>15} {"row dumper ms":>14} {"speedup":>8}')
+    with app.test_request_context('/api/films'):
+        for per_page in (10, 100, 1000):
+
+            def orm_path():
+                db.session.expunge_all()
+                return films_schema.dump(Film.query.order_by(Film.film_id).limit(per_page).all())
+
+            def row_path():
+                rows = Film.query.with_entities(*dumper.columns).order_by(Film.film_id).limit(per_page).all()
+                return dumper.dump(rows)
+
+            # both paths have to agree before their timings mean anything
+            assert json.dumps(orm_path(), sort_keys=True, default=str) == \
+                json.dumps(row_path(), sort_keys=True, default=str)
+
+            orm = timed(orm_path, args.repeat)
+            rows = timed(row_path, args.repeat)
+            print(f'{per_page:>8} {orm * 1000:>15.2f} {rows * 1000:>14.2f} {orm / rows:>7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
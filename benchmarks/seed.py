@@ -0,0 +1,81 @@
+# seeded Sakila-shaped SQLite database for the benchmarks
+# the app picks its config at import time, so call create_bench_app before importing anything from api
+
+import os
+import random
+import sys
+
+# make the repo root importable when running benchmarks/<script>.py directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17']
+FEATURES = ['Trailers', 'Commentaries', 'Deleted Scenes', 'Behind the Scenes']
+WORDS = [
+    'Academy', 'Dinosaur', 'Epic', 'Drama', 'Astronaut', 'Boat', 'Feminist', 'Mad Scientist',
+    'Database Administrator', 'Moose', 'Car', 'Crocodile', 'Shark', 'Monkey', 'Lumberjack',
+    'Canadian Rockies', 'Abandoned Mine Shaft', 'Gulf of Mexico', 'Ancient China', 'Baloon'
+]
+
+
+def create_bench_app(db_path):
+    """
+    build the app through create_app against a SQLite file
+    """
+    os.environ['ENV'] = 'PRODUCTION'
+    os.environ['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.abspath(db_path)}'
+
+    from app import create_app
+    return create_app()
+
+
+def seed(app, actors=1000, films=1000, film_actors=5000, seed_value=0):
+    """
+    create the tables and fill them with random but repeatable rows
+    """
+    from api.models import db, film_actor
+    from api.models.actor import Actor
+    from api.models.film import Film
+
+    rng = random.Random(seed_value)
+
+    with app.app_context():
+        # the primary only, replicas get the rows through replication
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+
+        db.session.execute(Actor.__table__.insert(), [
+            {
+                'actor_id': i,
+                'first_name': rng.choice(WORDS).split()[0].upper(),
+                'last_name': f'{rng.choice(WORDS).split()[-1].upper()}{i}'
+            }
+            for i in range(1, actors + 1)
+        ])
+
+        db.session.execute(Film.__table__.insert(), [
+            {
+                'film_id': i,
+                'title': f'{rng.choice(WORDS).upper()} {rng.choice(WORDS).upper()} {i}',
+                'description': f'A {rng.choice(WORDS)} {rng.choice(WORDS)} of a {rng.choice(WORDS)} '
+                               f'And a {rng.choice(WORDS)} who must Meet a {rng.choice(WORDS)} in {rng.choice(WORDS)}',
+                'release_year': 2006,
+                'language_id': 1,
+                'original_language_id': None,
+                'rental_duration': rng.randint(3, 7),
+                'rental_rate': rng.choice([0.99, 2.99, 4.99]),
+                'length': rng.randint(46, 185),
+                'replacement_cost': rng.choice([9.99, 14.99, 19.99, 24.99, 29.99]),
+                'rating': rng.choice(RATINGS),
+                'special_features': ','.join(rng.sample(FEATURES, rng.randint(1, 4)))
+            }
+            for i in range(1, films + 1)
+        ])
+
+        pairs = set()
+        while len(pairs) < min(film_actors, actors * films):
+            pairs.add((rng.randint(1, actors), rng.randint(1, films)))
+        db.session.execute(film_actor.insert(), [
+            {'actor_id': actor_id, 'film_id': film_id} for actor_id, film_id in sorted(pairs)
+        ])
+
+        db.session.commit()
@@ -0,0 +1,37 @@
+# creates the api_version table (see api.models.version) in a database that was not
+# created by db.create_all(), e.g. the stock sakila schema. safe to run more than once:
+#
+#   python -m migrations.api_version
+#
+# until it exists the api sends no ETags. restart the workers afterwards, they look
+# the table up once (see api.utils.versions.VersionStore.available)
+
+import os
+import sys
+
+# make the repo root importable when running migrations/<script>.py directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import inspect  # noqa: E402
+
+
+def migrate(engine):
+    """
+    returns:
+        True when the table was created
+    """
+    from api.models.version import ApiVersion
+
+    if inspect(engine).has_table(ApiVersion.__tablename__):
+        return False
+    ApiVersion.__table__.create(engine)
+    return True
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from api.models import db
+
+    with create_app().app_context():
+        created = migrate(db.engine)
+    print('created api_version' if created else 'api_version already exists')
@@ -0,0 +1,74 @@
+# adds film.special_features_mask (and its index) to a database that was not created by
+# db.create_all(), e.g. the stock sakila schema. safe to run more than once:
+#
+#   python -m migrations.film_special_features_mask
+#
+# uses the app's config (ENV, SQLALCHEMY_DATABASE_URI), replicas get it through replication.
+# restart the workers afterwards, they look the column up once (see api.models.film.mask_filter)
+
+import os
+import sys
+
+# make the repo root importable when running migrations/<script>.py directly
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import column, inspect  # noqa: E402
+
+COLUMN = 'special_features_mask'
+INDEX = 'ix_film_special_features_mask'
+
+
+def statements(connection):
+    """
+    the DDL for the connection's database, empty when there is nothing to do
+    """
+    from api.models.film import _mask_expression
+
+    inspector = inspect(connection)
+    columns = {col['name']: col for col in inspector.get_columns('film')}
+    if COLUMN in columns:
+        return []
+
+    dialect = connection.dialect
+    # the expression create_all uses, with the column unqualified as generated columns need
+    expression = str(_mask_expression(column('special_features')).compile(
+        dialect=dialect, compile_kwargs={'literal_binds': True}
+    ))
+    if dialect.name == 'mysql':
+        # sakila's SET column + 0 is the bitmask of its members, in the SET's order
+        if 'SET' in str(columns['special_features']['type']).upper():
+            expression = 'COALESCE(special_features + 0, 0)'
+        return [
+            f'ALTER TABLE film ADD COLUMN {COLUMN} SMALLINT GENERATED ALWAYS AS ({expression}) STORED, '
+            f'ADD INDEX {INDEX} ({COLUMN})'
+        ]
+
+    if dialect.name == 'sqlite':
+        # sqlite can only add VIRTUAL generated columns, the index stores the values anyway
+        return [
+            f'ALTER TABLE film ADD COLUMN {COLUMN} SMALLINT GENERATED ALWAYS AS ({expression}) VIRTUAL',
+            f'CREATE INDEX {INDEX} ON film ({COLUMN})'
+        ]
+
+    raise RuntimeError(f'no migration for {dialect.name}, add the column by hand')
+
+
+def migrate(engine):
+    """
+    returns:
+        the statements that were run
+    """
+    with engine.begin() as connection:
+        ddl = statements(connection)
+        for statement in ddl:
+            connection.exec_driver_sql(statement)
+    return ddl
+
+
+if __name__ == '__main__':
+    from app import create_app
+    from api.models import db
+
+    with create_app().app_context():
+        ran = migrate(db.engine)
+    print('\n'.join(ran) if ran else f'film.{COLUMN} already exists')
@@ -0,0 +1,68 @@
+# tests run the real app against seeded SQLite files (see benchmarks/seed.py)
+#
+# the config classes are read once at import time, so every app gets its
+# settings by patching them before create_app
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+os.environ['ENV'] = 'PRODUCTION'
+os.environ.setdefault('SQLALCHEMY_DATABASE_URI', 'sqlite://')
+
+from seed import seed  # noqa: E402
+
+
+def clear_state():
+    """
+    empty the per process caches and registries shared by every app
+    """
+    from api.utils.aggregates import SUMMARIES
+    from api.utils.compression import body_cache
+    from api.utils.counts import count_cache
+    from api.utils.entities import entity_cache
+    from api.utils.profiling import route_profiles
+
+    count_cache.invalidate()
+    entity_cache.clear()
+    body_cache.clear()
+    route_profiles.clear()
+    for summary in SUMMARIES:
+        summary.reset()
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    """
+    factory for a seeded app: make_app(actors=20, films=20, film_actors=60, **config)
+    """
+    from api.config import config
+
+    def make(actors=20, films=20, film_actors=60, db_name='main.sqlite', **settings):
+        settings.setdefault('SQLALCHEMY_DATABASE_URI', f'sqlite:///{tmp_path / db_name}')
+        for name, value in settings.items():
+            monkeypatch.setattr(config, name, value, raising=False)
+
+        from app import create_app
+        app = create_app()
+        seed(app, actors=actors, films=films, film_actors=film_actors)
+        clear_state()
+        return app
+
+    yield make
+    clear_state()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
@@ -0,0 +1,48 @@
+import pytest
+
+from api.utils.admission import AdmissionControl, RedisBackend
+
+CONFIG = {
+    'ADMISSION_RATE': 0.001,   # tokens per second, i.e. no refill during a test
+    'ADMISSION_BURST': 4,
+    'ADMISSION_MAX_CONCURRENCY': 2,
+    'ADMISSION_QUEUE_SIZE': 0,
+    'ADMISSION_QUEUE_TIMEOUT_MS': 10,
+    'ADMISSION_WEIGHTS': {},
+    'ADMISSION_ROWS_PER_UNIT': 100,
+    'ADMISSION_REDIS_URL': '',
+    'ADMISSION_SLOT_TTL': 30
+}
+
+
+@pytest.fixture(params=['local', 'redis'])
+def admission(request, tmp_path):
+    control = AdmissionControl()
+    control.configure(CONFIG)
+    if request.param == 'redis':
+        redislite = pytest.importorskip('redislite')
+        server = redislite.Redis(str(tmp_path / 'admission.rdb'))
+        control.backend = RedisBackend(f'unix://{server.socket_file}', CONFIG['ADMISSION_SLOT_TTL'])
+        yield control
+        server.shutdown()
+    else:
+        yield control
+
+
+@pytest.mark.parametrize('queue_size', [0, 1], ids=['queue_full', 'queue_timeout'])
+def test_busy_requests_get_their_tokens_back(admission, queue_size):
+    admission.queue_size = queue_size
+    slot, rejected = admission.admit('other', 2)
+    assert rejected is None
+
+    # the concurrency is used up: 503, twice, which would drain a bucket of 4 without the refund
+    for _ in range(2):
+        assert admission.admit('client', 2) == (None, (503, 'Server busy, try again later', admission.queue_timeout))
+    admission.release(slot)
+
+    slot, rejected = admission.admit('client', 2)
+    assert rejected is None
+    admission.release(slot)
+    assert admission.admit('client', 2)[0] is not None
+    # the bucket is empty now, the rate limit itself still applies
+    assert admission.admit('client', 2)[1][0] == 429
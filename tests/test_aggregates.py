@@ -0,0 +1,52 @@
+import shutil
+import sqlite3
+import threading
+
+from api.utils.aggregates import actor_stats
+
+
+def test_rebuild_reads_the_primary(make_app, tmp_path):
+    replica = tmp_path / 'replica.sqlite'
+    app = make_app(actors=5, films=2, film_actors=2, SQLALCHEMY_REPLICA_URIS=[f'sqlite:///{replica}'])
+    shutil.copy(tmp_path / 'main.sqlite', replica)
+    # a row the replica has not caught up with yet
+    with sqlite3.connect(tmp_path / 'main.sqlite') as connection:
+        connection.execute("INSERT INTO actor (actor_id, first_name, last_name) VALUES (6, 'NEW', 'ACTOR')")
+
+    response = app.test_client().get('/api/actors/stats')
+    assert response.get_json()['actors'] == 6
+
+
+def test_concurrent_refreshes_keep_the_latest_values(app, monkeypatch):
+    with app.app_context():
+        actor_stats.rebuild()
+        loads = []
+        load = actor_stats._load
+
+        # the first refresh reads an old value and is slow to apply it, the second reads the new one
+        first_read = threading.Event()
+
+        def slow_load(ids=None):
+            loads.append(ids)
+            if len(loads) == 1:
+                first_read.set()
+                value = {ident: 0 for ident in ids}
+                threading.Event().wait(0.1)
+                return value
+            return load(ids)
+
+        monkeypatch.setattr(actor_stats, '_load', slow_load)
+        context = app.app_context()
+
+        def refresh():
+            with context:
+                actor_stats.refresh([1])
+
+        thread = threading.Thread(target=refresh)
+        thread.start()
+        first_read.wait(1)
+        actor_stats.refresh([1])
+        thread.join()
+
+        # the refreshes ran one after the other, the last value read is the one kept
+        assert actor_stats._rows[1] == load({1})[1]
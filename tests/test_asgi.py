@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from api.utils.asgi import AsgiApp, blocking, on_event_loop, sleep
+
+# a hand written ASGI server, the app runs on the real aiosqlite driver
+
+
+async def _call(asgi, scope, messages):
+    # feeds `messages` to the app and returns what it sent
+    received = asyncio.Queue()
+    for message in messages:
+        received.put_nowait(message)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi(scope, received.get, send)
+    return sent
+
+
+async def _request(asgi, method, path, body=None, query=b''):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+        'scheme': 'http', 'path': path, 'root_path': '', 'query_string': query,
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+        'client': ('127.0.0.1', 5000), 'server': ('testserver', 80)
+    }
+    payload = json.dumps(body).encode() if body is not None else b''
+    start, *chunks = await _call(asgi, scope, [{'type': 'http.request', 'body': payload, 'more_body': False}])
+    assert start['type'] == 'http.response.start'
+    assert chunks[-1] == {'type': 'http.response.body', 'body': b''}
+    return start['status'], b''.join(chunk['body'] for chunk in chunks)
+
+
+def serve(asgi, scenario):
+    """
+    run `scenario` between the lifespan startup and shutdown of the app, on one event loop
+    """
+
+    async def run():
+        events, sent = asyncio.Queue(), asyncio.Queue()
+        lifespan = asyncio.create_task(asgi({'type': 'lifespan', 'asgi': {'version': '3.0'}}, events.get, sent.put))
+        await events.put({'type': 'lifespan.startup'})
+        assert await sent.get() == {'type': 'lifespan.startup.complete'}
+        try:
+            return await scenario()
+        finally:
+            await events.put({'type': 'lifespan.shutdown'})
+            assert await sent.get() == {'type': 'lifespan.shutdown.complete'}
+            await lifespan
+
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def asgi(make_app):
+    return AsgiApp(make_app(actors=5, films=3, film_actors=4))
+
+
+def test_requests_run_on_the_asyncio_engine(asgi):
+    statements = []
+
+    async def scenario():
+        assert asgi.engines[None].url.drivername == 'sqlite+aiosqlite'
+        event.listen(asgi.engines[None].sync_engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+
+        status, body = await _request(asgi, 'POST', '/api/actors/', {'first_name': 'ASYNC', 'last_name': 'ACTOR'})
+        assert status == 201
+        actor_id = json.loads(body)['actor_id']
+
+        # concurrent requests share the event loop
+        return await asyncio.gather(
+            _request(asgi, 'GET', f'/api/actors/{actor_id}'),
+            _request(asgi, 'GET', '/api/actors/', query=b'per_page=2'),
+            _request(asgi, 'GET', '/api/actors/export')
+        )
+
+    single, listing, export = serve(asgi, scenario)
+    assert single[0] == 200 and json.loads(single[1])['first_name'] == 'ASYNC'
+    assert listing[0] == 200 and len(json.loads(listing[1])['actors']) == 2
+    # the streamed export queries between its chunks
+    assert export[0] == 200 and len(export[1].splitlines()) == 6
+    assert any(statement.startswith('INSERT') for statement in statements)
+    assert any(statement.startswith('SELECT') for statement in statements)
+
+
+def test_blocking_calls_leave_the_event_loop(asgi):
+    loop_thread = threading.get_ident()
+    threads = []
+    asgi.app.before_request(lambda: threads.append(blocking(threading.get_ident)))
+
+    async def scenario():
+        return await _request(asgi, 'GET', '/api/actors/1')
+
+    assert serve(asgi, scenario)[0] == 200
+    assert threads and threads[0] != loop_thread
+    # a plain call anywhere else
+    assert not on_event_loop() and blocking(threading.get_ident) == loop_thread
+
+
+def test_websockets_are_turned_down(asgi):
+    async def scenario():
+        scope = {'type': 'websocket', 'path': '/api/actors/', 'headers': []}
+        return await _call(asgi, scope, [{'type': 'websocket.connect'}])
+
+    assert serve(asgi, scenario) == [{'type': 'websocket.close', 'code': 1000}]
+
+
+def test_queued_requests_wait_without_blocking_the_loop(make_app):
+    app = make_app(
+        actors=5, films=3, film_actors=4, ADMISSION_CONTROL=True, ADMISSION_RATE=0,
+        ADMISSION_MAX_CONCURRENCY=1, ADMISSION_QUEUE_SIZE=5, ADMISSION_QUEUE_TIMEOUT_MS=5000
+    )
+    # each request holds the only slot for a while, yielding the loop meanwhile
+    app.before_request(lambda: sleep(0.1))
+    asgi = AsgiApp(app)
+
+    async def scenario():
+        return await asyncio.gather(*[_request(asgi, 'GET', f'/api/actors/{ident}') for ident in (1, 2, 3)])
+
+    assert [status for status, body in serve(asgi, scenario)] == [200, 200, 200]
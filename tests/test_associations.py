@@ -0,0 +1,73 @@
+import threading
+
+from api.schemas.film import film_create_update_schema
+
+
+FILM = {
+    'title': 'SHARED SCHEMA', 'language_id': 1, 'rental_duration': 3,
+    'rental_rate': 2.99, 'replacement_cost': 9.99
+}
+
+
+def test_concurrent_loads_keep_their_own_association_change(app):
+    from flask import g
+
+    loaded = threading.Event()
+    other_loaded = threading.Event()
+    go_on = threading.Event()
+    go_on.set()
+    seen = {}
+
+    def load(actor_ids, wait_for, then_set):
+        with app.test_request_context(method='POST'):
+            film_create_update_schema.load({**FILM, 'actor_ids': actor_ids})
+            then_set.set()
+            wait_for.wait(5)
+            seen[tuple(actor_ids)] = g.actor_changes.replace
+
+    first = threading.Thread(target=load, args=([1, 2], other_loaded, loaded))
+    second = threading.Thread(target=lambda: (loaded.wait(5), load([3], go_on, other_loaded)))
+    first.start()
+    second.start()
+    first.join()
+    second.join()
+
+    # the first request loaded before the second and read its change after it
+    assert seen == {(1, 2): {1, 2}, (3,): {3}}
+
+
+def test_create_links_the_requested_actors(client):
+    response = client.post('/api/films', json={**FILM, 'actor_ids': [1, 2]})
+    assert response.status_code == 201
+    film_id = response.get_json()['film_id']
+    actors = client.get(f'/api/films/{film_id}/actors?links=none').get_json()['actors']
+    assert sorted(actor['actor_id'] for actor in actors) == [1, 2]
+
+
+def _linked(client, film_id):
+    actors = client.get(f'/api/films/{film_id}/actors?links=none').get_json()['actors']
+    return sorted(actor['actor_id'] for actor in actors)
+
+
+def test_put_replaces_the_links_and_patch_keeps_them(client):
+    film_id = client.post('/api/films', json={**FILM, 'actor_ids': [1, 2]}).get_json()['film_id']
+    film = {**FILM, 'description': 'REPLACED', 'release_year': 2006}
+
+    # a partial update without actor_ids leaves the cast alone
+    assert client.patch(f'/api/films/{film_id}', json={'title': 'PATCHED'}).status_code == 200
+    assert _linked(client, film_id) == [1, 2]
+
+    # a full replacement only keeps what it names
+    assert client.put(f'/api/films/{film_id}', json={**film, 'add_actor_ids': [3]}).status_code == 200
+    assert _linked(client, film_id) == [3]
+    assert client.put(f'/api/films/{film_id}', json=film).status_code == 200
+    assert _linked(client, film_id) == []
+
+
+def test_put_without_film_ids_unlinks_the_actor(client):
+    actor_id = client.post('/api/actors/', json={
+        'first_name': 'LINKED', 'last_name': 'ACTOR', 'film_ids': [1, 2]
+    }).get_json()['actor_id']
+    response = client.put(f'/api/actors/{actor_id}', json={'first_name': 'LINKED', 'last_name': 'AGAIN'})
+    assert response.status_code == 200
+    assert client.get(f'/api/actors/{actor_id}/films?links=none').get_json()['films'] == []
@@ -0,0 +1,81 @@
+import pytest
+from sqlalchemy import event
+
+from api.models import db
+
+
+@pytest.fixture
+def statements(app):
+    # SQL statements sent to the database, by their first two words
+    sent = []
+    with app.app_context():
+        listener = lambda conn, cursor, statement, *args: sent.append(' '.join(statement.split()[:3]))
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        yield sent
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def _names(client, ids):
+    return [
+        client.get(f'/api/actors/{ident}?links=none').get_json()['last_name'] for ident in ids
+    ]
+
+
+def test_bulk_create_is_one_insert_per_batch(client, statements):
+    items = [{'first_name': 'BULK', 'last_name': f'ACTOR{i}'} for i in range(50)]
+    response = client.post('/api/actors/bulk', json=items)
+    assert response.status_code == 201
+
+    assert statements.count('INSERT INTO actor') == 1
+    ids = [result['actor']['actor_id'] for result in response.get_json()['results']]
+    assert ids == list(range(21, 71))
+    assert _names(client, ids) == [f'ACTOR{i}' for i in range(50)]
+
+
+def test_bulk_create_with_and_without_ids_keeps_the_order(client, statements):
+    items = [
+        {'first_name': 'A', 'last_name': 'FIRST'},
+        {'actor_id': 500, 'first_name': 'A', 'last_name': 'GIVEN'},
+        {'first_name': 'A', 'last_name': 'SECOND'},
+        {'actor_id': 400, 'first_name': 'A', 'last_name': 'OTHER'}
+    ]
+    response = client.post('/api/actors/bulk', json=items)
+    assert response.status_code == 201
+
+    ids = [result['actor']['actor_id'] for result in response.get_json()['results']]
+    assert ids[1] == 500 and ids[3] == 400
+    assert _names(client, ids) == ['FIRST', 'GIVEN', 'SECOND', 'OTHER']
+    # given ids in one statement, generated ones in another
+    assert statements.count('INSERT INTO actor') == 2
+
+
+def test_duplicate_ids_fail_only_their_items(client):
+    items = [
+        {'actor_id': 3, 'first_name': 'A', 'last_name': 'TAKEN'},
+        {'actor_id': 300, 'first_name': 'A', 'last_name': 'NEW'},
+        {'actor_id': 300, 'first_name': 'A', 'last_name': 'TWICE'},
+        {'first_name': 'A', 'last_name': 'GENERATED'}
+    ]
+    response = client.post('/api/actors/bulk', json=items)
+    assert response.status_code == 207
+
+    body = response.get_json()
+    assert [result['status'] for result in body['results']] == [409, 201, 409, 201]
+    assert body['written'] == 2
+    assert _names(client, [3]) != ['TAKEN']
+    assert _names(client, [300]) == ['NEW']
+
+
+def test_bulk_update_is_one_statement_per_set_of_columns(client, statements):
+    items = [{'actor_id': ident, 'first_name': f'FIRST{ident}'} for ident in range(1, 11)]
+    items += [{'actor_id': ident, 'last_name': f'LAST{ident}'} for ident in range(1, 6)]
+    # the last row of an id wins
+    items.append({'actor_id': 1, 'first_name': 'LATEST'})
+    response = client.patch('/api/actors/bulk', json=items)
+    assert response.status_code == 200
+
+    assert statements.count('UPDATE actor SET') == 2
+    actor = client.get('/api/actors/1?links=none').get_json()
+    assert (actor['first_name'], actor['last_name']) == ('LATEST', 'LAST1')
+    actor = client.get('/api/actors/8?links=none').get_json()
+    assert actor['first_name'] == 'FIRST8'
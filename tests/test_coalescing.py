@@ -0,0 +1,88 @@
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+from api.models import db
+from api.utils.admission import admission
+from api.utils.coalescing import single_flight
+
+
+def _until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def _gated_app(make_app, **settings):
+    app = make_app(
+        actors=5, films=2, film_actors=2, COALESCE_REQUESTS=True, ADMISSION_CONTROL=True, ADMISSION_RATE=0,
+        ADMISSION_QUEUE_TIMEOUT_MS=5000, **settings
+    )
+    # the views of GET requests wait for the gate, so the others pile up behind them
+    gate = threading.Event()
+
+    def hold(conn, cursor, statement, *args):
+        if has_request_context() and request.method == 'GET' and 'FROM actor' in statement:
+            gate.wait(5)
+
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', hold)
+    return app, gate
+
+
+def _getter(app, responses):
+    def get():
+        response = app.test_client().get('/api/actors/1?links=none')
+        responses.append((response.status_code, response.get_json().get('first_name')))
+    return get
+
+
+def test_identical_gets_share_one_view_call_until_a_write(make_app):
+    app, gate = _gated_app(make_app, COALESCE_TIMEOUT_MS=5000, ADMISSION_MAX_CONCURRENCY=2, ADMISSION_QUEUE_SIZE=10)
+    responses = []
+    get = _getter(app, responses)
+
+    before = single_flight.stats()
+    threads = [threading.Thread(target=get) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    _until(lambda: single_flight.stats()['waiting'] == 4)
+    assert single_flight.stats()['leaders'] == before['leaders'] + 1
+    # only the leader holds a slot while the others wait, the capacity is 2
+    assert admission.stats()['in_flight'] == 1
+
+    # a write in between: later requests do not join the flight that may have read the old row
+    assert app.test_client().patch('/api/actors/1', json={'first_name': 'CHANGED'}).status_code == 200
+    threads.append(threading.Thread(target=get))
+    threads[-1].start()
+    _until(lambda: single_flight.stats()['leaders'] == before['leaders'] + 2)
+
+    gate.set()
+    for thread in threads:
+        thread.join()
+    after = single_flight.stats()
+    assert after['shared'] - before['shared'] == 4
+    assert after['fallbacks'] == before['fallbacks']
+    # the gate held the first view before its SELECT, so it read the written row too
+    assert responses == [(200, 'CHANGED')] * 6
+    assert admission.stats()['in_flight'] == 0
+
+
+def test_waiting_callers_are_admitted_again_before_running_the_view(make_app):
+    app, gate = _gated_app(make_app, COALESCE_TIMEOUT_MS=50, ADMISSION_MAX_CONCURRENCY=1, ADMISSION_QUEUE_SIZE=0)
+    responses = []
+    leader = threading.Thread(target=_getter(app, responses))
+    leader.start()
+    _until(lambda: admission.stats()['in_flight'] == 1)
+
+    # the leader is still running, the follower gives up waiting and finds the only slot taken
+    _getter(app, responses)()
+    assert responses == [(503, None)]
+
+    gate.set()
+    leader.join()
+    assert responses[1][0] == 200
+    assert admission.stats()['in_flight'] == 0
@@ -0,0 +1,91 @@
+import gzip
+import zlib
+
+import pytest
+
+from api.utils import compression
+
+LISTING = '/api/films?per_page=20'
+
+DECODERS = {'gzip': gzip.decompress, 'deflate': zlib.decompress}
+if compression.zstandard is not None:
+    DECODERS['zstd'] = compression.zstandard.ZstdDecompressor().decompress
+
+needs_zstd = pytest.mark.skipif(compression.zstandard is None, reason='zstandard is not installed')
+
+
+@pytest.fixture
+def compress_calls(monkeypatch):
+    calls = []
+    compress = compression.compress
+
+    def counting(body, encoding):
+        calls.append(encoding)
+        return compress(body, encoding)
+
+    monkeypatch.setattr(compression, 'compress', counting)
+    return calls
+
+
+def test_identity_when_no_encoding_is_accepted(client):
+    response = client.get(LISTING, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    # a cache still has to tell the representations apart
+    assert 'Accept-Encoding' in response.vary
+    assert response.get_json()['films']
+
+
+@pytest.mark.parametrize('accept, encoding', [
+    ('gzip', 'gzip'),
+    pytest.param('gzip, deflate, zstd', 'zstd', marks=needs_zstd),
+    ('zstd;q=0.5, gzip', 'gzip'),
+    ('deflate', 'deflate'),
+])
+def test_negotiates_the_best_encoding(client, accept, encoding):
+    identity = client.get(LISTING, headers={'Accept-Encoding': 'identity'})
+    response = client.get(LISTING, headers={'Accept-Encoding': accept})
+
+    assert response.headers['Content-Encoding'] == encoding
+    assert 'Accept-Encoding' in response.vary
+    # every encoding is its own strong ETag
+    assert response.headers['ETag'] == identity.headers['ETag'][:-1] + f'-{encoding}"'
+
+    assert DECODERS[encoding](response.get_data()) == identity.get_data()
+
+
+def test_small_bodies_are_not_compressed(make_app):
+    client = make_app(COMPRESSION_MIN_SIZE=1024 * 1024).test_client()
+    response = client.get(LISTING, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.vary
+
+
+@needs_zstd
+def test_compressed_bodies_are_cached_by_etag(client, compress_calls):
+    first = client.get(LISTING, headers={'Accept-Encoding': 'gzip'})
+    second = client.get(LISTING, headers={'Accept-Encoding': 'gzip'})
+    assert compress_calls == ['gzip']
+    assert second.get_data() == first.get_data()
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert second.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in second.vary
+
+    # another encoding is another entry
+    client.get(LISTING, headers={'Accept-Encoding': 'zstd'})
+    assert compress_calls == ['gzip', 'zstd']
+
+    # a write changes the ETag, so the new body is compressed again
+    assert client.patch('/api/films/1', json={'title': 'RECOMPRESSED'}).status_code == 200
+    third = client.get(LISTING, headers={'Accept-Encoding': 'gzip'})
+    assert compress_calls == ['gzip', 'zstd', 'gzip']
+    assert b'RECOMPRESSED' in gzip.decompress(third.get_data())
+
+
+def test_not_modified_for_the_tag_of_an_encoding(client, compress_calls):
+    etag = client.get(LISTING, headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+
+    response = client.get(LISTING, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert 'Accept-Encoding' in response.vary
+    assert response.get_data() == b''
+    assert compress_calls == ['gzip']
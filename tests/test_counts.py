@@ -0,0 +1,26 @@
+def _total(client, url):
+    return client.get(url).get_json()['pagination']['total']
+
+
+def test_count_cache_size_zero_disables_the_cache(make_app):
+    from api.utils.counts import count_cache
+
+    app = make_app(actors=5, films=2, film_actors=2, COUNT_CACHE_SIZE=0)
+    client = app.test_client()
+    assert _total(client, '/api/actors/') == 5
+    assert count_cache._entries == {}
+    assert _total(client, '/api/actors/?page=2&per_page=2') == 5
+
+
+def test_failed_estimate_keeps_the_request_transaction(app):
+    from api.models import db
+    from api.models.actor import Actor
+    from api.utils.counts import estimate_count
+
+    with app.test_request_context('/api/actors/', method='POST'):
+        db.session.add(Actor(first_name='PENDING', last_name='ACTOR'))
+        db.session.flush()
+        # no ANALYZE ran, reading sqlite_stat1 fails
+        assert estimate_count(Actor.query) is None
+        assert Actor.query.filter_by(first_name='PENDING').count() == 1
+        db.session.rollback()
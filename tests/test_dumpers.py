@@ -0,0 +1,46 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from marshmallow import fields
+
+from api.models import db
+from api.models.actor import Actor
+from api.models.film import Film
+from api.schemas.actor import actors_schema
+from api.schemas.film import films_schema
+from api.utils.dumpers import _converter, get_dumper
+
+
+def test_rows_dump_like_the_schema(app):
+    with app.app_context():
+        # NULLs in nullable columns, and a rate the Decimal field has to round
+        db.session.query(Film).filter(Film.film_id == 1).update({'length': None, 'rating': None, 'rental_rate': 2.985})
+        db.session.commit()
+
+    with app.test_request_context('/api/films'):
+        # every listing column, Decimals, NULLs and the _links
+        for model, schema in ((Film, films_schema), (Actor, actors_schema)):
+            dumper = get_dumper(schema)
+            instances = model.query.order_by(*model.__mapper__.primary_key).all()
+            rows = db.session.execute(
+                db.select(*dumper.columns).order_by(*model.__mapper__.primary_key)
+            ).all()
+            assert dumper.dump(rows) == schema.dump(instances)
+
+        film = get_dumper(films_schema).fetch_one(1)
+        assert film['length'] is None and film['rating'] is None
+        assert isinstance(film['rental_rate'], Decimal)
+        assert film == films_schema.dump([db.session.get(Film, 1)])[0]
+
+
+@pytest.mark.parametrize('field, value', [
+    (fields.Date(), date(2006, 2, 15)),
+    (fields.DateTime(), datetime(2006, 2, 15, 5, 3, 42)),
+    (fields.Decimal(places=2), Decimal('4.985')),
+    (fields.Decimal(places=2, as_string=True), Decimal('4.99')),
+    (fields.Integer(), 7),
+    (fields.String(), 'ACADEMY'),
+])
+def test_converters_match_the_fields(field, value):
+    assert _converter(field, 'value')(value) == field.serialize('value', {'value': value})
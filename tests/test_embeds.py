@@ -0,0 +1,52 @@
+import pytest
+from sqlalchemy import event
+
+from api.models import db, film_actor
+
+
+@pytest.fixture
+def statements(app):
+    executed = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: executed.append(statement))
+    return executed
+
+
+def _linked(app, column, ident, other):
+    with app.app_context():
+        rows = db.session.execute(
+            db.select(film_actor.c[other]).where(film_actor.c[column] == ident).order_by(film_actor.c[other])
+        ).scalars().all()
+    return rows
+
+
+def test_one_query_per_embedded_relationship(app, client, statements):
+    body = client.get('/api/films?embed=actors&per_page=10&count=none').get_json()
+    assert len(body['films']) == 10
+    # the page and one batched query for all the actors of all ten films
+    assert len([statement for statement in statements if 'film_actor' in statement]) == 1
+    for film in body['films']:
+        assert [actor['actor_id'] for actor in film['actors']] == _linked(app, 'film_id', film['film_id'], 'actor_id')
+
+
+def test_embedded_rows_are_capped(make_app):
+    app = make_app(actors=3, films=20, film_actors=40, EMBED_LIMIT=3)
+    client = app.test_client()
+    capped = 0
+    for actor in client.get('/api/actors/?embed=films&count=none').get_json()['actors']:
+        linked = _linked(app, 'actor_id', actor['actor_id'], 'film_id')
+        capped += len(linked) > 3
+        # the lowest ids first, the rest through the actor's films link
+        assert [film['film_id'] for film in actor['films']] == linked[:3]
+    assert capped
+
+    actor = client.get('/api/actors/1?embed=films').get_json()
+    assert len(actor['films']) == 3
+    assert actor['_links']['films']['href'].endswith('/api/actors/1/films')
+
+
+def test_unknown_embed_is_rejected(client):
+    response = client.get('/api/films?embed=actors,directors')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Invalid embed: directors. Options are: actors'
@@ -0,0 +1,22 @@
+from api.models.actor import Actor
+from api.utils.entities import EntityCache, entity_cache
+from api.utils.versions import entity_ident
+
+
+def test_idents_are_normalized_to_the_primary_key_type():
+    assert entity_ident(Actor, '05') == entity_ident(Actor, '5') == entity_ident(Actor, 5) == 5
+    assert entity_ident(Actor, 'abc') == 'abc'
+    assert EntityCache.make_key(Actor, '05', ()) == EntityCache.make_key(Actor, 5, ())
+
+
+def test_zero_padded_id_shares_the_cache_entry_and_its_invalidation(client):
+    first = client.get('/api/actors/05?links=none')
+    assert first.status_code == 200
+    assert client.get('/api/actors/5?links=none').get_json() == first.get_json()
+    assert len(entity_cache._entries) == 1
+    assert entity_cache.hits == 1
+
+    response = client.patch('/api/actors/5', json={'first_name': 'PENELOPE'})
+    assert response.status_code == 200
+    assert len(entity_cache._entries) == 0
+    assert client.get('/api/actors/05?links=none').get_json()['first_name'] == 'PENELOPE'
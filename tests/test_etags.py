@@ -0,0 +1,66 @@
+from app import create_app
+
+from api.models import db
+from api.models.actor import Actor
+from api.utils.versions import collection_key, entity_key, versions
+
+
+def _write_elsewhere(app, sql, *keys):
+    # a write through another worker: the rows and the shared versions change,
+    # this process's caches are not told
+    with app.app_context():
+        db.session.execute(db.text(sql))
+        db.session.commit()
+        versions.bump(*keys)
+
+
+def test_workers_share_etags(app):
+    # a second worker on the same database
+    other = create_app().test_client()
+    client = app.test_client()
+
+    response = client.get('/api/actors/3')
+    etag = response.headers['ETag']
+    assert other.get('/api/actors/3').headers['ETag'] == etag
+    assert other.get('/api/actors/3', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_write_through_another_worker_changes_the_etag_and_the_body(app):
+    client = app.test_client()
+    response = client.get('/api/actors/3')
+    etag = response.headers['ETag']
+
+    _write_elsewhere(
+        app, "UPDATE actor SET first_name = 'ZERO' WHERE actor_id = 3",
+        entity_key(Actor, 3), collection_key(Actor)
+    )
+    response = client.get('/api/actors/3', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    # not the entity cached before the write
+    assert response.get_json()['first_name'] == 'ZERO'
+
+
+def test_write_through_another_worker_is_counted(app):
+    client = app.test_client()
+    assert client.get('/api/actors/?per_page=5').get_json()['pagination']['total'] == 20
+
+    _write_elsewhere(
+        app, "INSERT INTO actor (actor_id, first_name, last_name) VALUES (21, 'NEW', 'ACTOR')",
+        collection_key(Actor)
+    )
+    assert client.get('/api/actors/?page=2&per_page=5').get_json()['pagination']['total'] == 21
+
+
+def test_no_etags_without_the_version_table(app):
+    with app.app_context():
+        db.session.execute(db.text('DROP TABLE api_version'))
+        db.session.commit()
+    # a worker started on the database before the migration
+    client = create_app().test_client()
+
+    response = client.get('/api/actors/3')
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
+    assert client.patch('/api/actors/3', json={'first_name': 'ZERO'}).status_code == 200
+    assert client.get('/api/actors/3').get_json()['first_name'] == 'ZERO'
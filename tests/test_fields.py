@@ -0,0 +1,36 @@
+import pytest
+from sqlalchemy import event
+
+from api.models import db
+
+
+def test_listing_returns_and_selects_only_the_requested_fields(app, client):
+    statements = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', lambda conn, cursor, statement, *args: statements.append(statement))
+
+    films = client.get('/api/films?fields=title,rating&per_page=2&count=none').get_json()['films']
+    # the primary key stays, the links are built from it
+    assert [sorted(film) for film in films] == [['_links', 'film_id', 'rating', 'title']] * 2
+    page = next(statement for statement in statements if 'LIMIT' in statement)
+    assert 'film.description' not in page and 'film.title' in page
+
+
+@pytest.mark.parametrize('url, keys', [
+    ('/api/actors/1?fields=first_name', ['_links', 'actor_id', 'first_name']),
+    ('/api/films/1?fields= length , title', ['_links', 'film_id', 'length', 'title']),
+])
+def test_single_items(client, url, keys):
+    assert sorted(client.get(url).get_json()) == keys
+
+
+@pytest.mark.parametrize('url', [
+    '/api/films?fields=title,nope',
+    '/api/actors/?fields=password',
+    '/api/actors/1?fields=title',
+    '/api/films/export?fields=nope',
+])
+def test_unknown_fields_are_rejected(client, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Invalid fields:')
@@ -0,0 +1,98 @@
+import pytest
+
+from api.models import db
+from api.models import film as film_model
+
+from migrations.film_special_features_mask import migrate
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(actors=5, films=30, film_actors=10)
+    with app.app_context():
+        # a film without features has mask 0, it matches ?special_features_match=none
+        db.session.execute(db.text("UPDATE film SET special_features = NULL WHERE film_id = 1"))
+        db.session.commit()
+    film_model._has_mask_column.clear()
+    yield app
+    film_model._has_mask_column.clear()
+
+
+def _film_ids(client, features, match):
+    url = f'/api/films?per_page=100&links=none&special_features={features}&special_features_match={match}'
+    response = client.get(url)
+    assert response.status_code == 200
+    return {film['film_id'] for film in response.get_json()['films']}
+
+
+def _drop_mask_column(app):
+    # the stock sakila schema, before the migration
+    with app.app_context():
+        db.session.execute(db.text('DROP INDEX ix_film_special_features_mask'))
+        db.session.execute(db.text('ALTER TABLE film DROP COLUMN special_features_mask'))
+        db.session.commit()
+
+
+def _expected_ids(app, features, match):
+    # worked out in python from the stored features
+    bits = film_model.features_mask(features.split(','))
+    masks = set(film_model.matching_masks(bits, match))
+    with app.app_context():
+        rows = db.session.execute(db.text('SELECT film_id, special_features FROM film')).all()
+    return {
+        film_id for film_id, stored in rows
+        if film_model.features_mask(stored.split(',') if stored else ()) in masks
+    }
+
+
+@pytest.mark.parametrize('match', ['any', 'all', 'none'])
+def test_filter_works_without_the_mask_column(app, match):
+    # dropped before the first request, nothing cached from a database with the column
+    _drop_mask_column(app)
+    client = app.test_client()
+    expected = _expected_ids(app, 'Trailers,Commentaries', match)
+    if match == 'none':
+        assert 1 in expected
+    assert _film_ids(client, 'Trailers,Commentaries', match) == expected
+
+    with app.app_context():
+        assert migrate(db.engine)
+        assert migrate(db.engine) == []
+    film_model._has_mask_column.clear()
+    assert _film_ids(client, 'Trailers,Commentaries', match) == expected
+
+
+@pytest.mark.parametrize('method, url, body, status', [
+    ('GET', '/api/films', None, 200),
+    ('GET', '/api/films?rating=PG&per_page=5', None, 200),
+    ('GET', '/api/films?cursor=&per_page=5', None, 200),
+    ('GET', '/api/films?q=drama', None, 200),
+    ('GET', '/api/films?count=estimate', None, 200),
+    ('GET', '/api/films/1?embed=actors', None, 200),
+    ('GET', '/api/films/1/actors', None, 200),
+    ('GET', '/api/actors/1/films', None, 200),
+    ('GET', '/api/actors/?embed=films', None, 200),
+    ('GET', '/api/films/export', None, 200),
+    ('GET', '/api/films/stats', None, 200),
+    ('POST', '/api/films', {
+        'title': 'NEW FILM', 'description': 'new', 'release_year': 2006, 'language_id': 1,
+        'rental_duration': 3, 'rental_rate': '0.99', 'replacement_cost': '9.99', 'special_features': 'Trailers'
+    }, 201),
+    ('PUT', '/api/films/2', {
+        'title': 'REPLACED', 'description': 'replaced', 'release_year': 2006, 'language_id': 1,
+        'rental_duration': 3, 'rental_rate': '0.99', 'replacement_cost': '9.99'
+    }, 200),
+    ('PATCH', '/api/films/2', {'special_features': 'Commentaries'}, 200),
+    ('POST', '/api/films/bulk', [{
+        'title': 'BULK FILM', 'description': 'bulk', 'release_year': 2006, 'language_id': 1,
+        'rental_duration': 3, 'rental_rate': '0.99', 'replacement_cost': '9.99'
+    }], 201),
+    ('DELETE', '/api/films/3', None, 204),
+])
+def test_endpoints_work_without_the_mask_column(make_app, method, url, body, status):
+    app = make_app(actors=5, films=30, film_actors=10, COUNT_CACHE_SIZE=0)
+    _drop_mask_column(app)
+    film_model._has_mask_column.clear()
+    response = app.test_client().open(url, method=method, json=body)
+    assert response.status_code == status, response.get_data()
+    response.close()
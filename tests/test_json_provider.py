@@ -0,0 +1,72 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+from api.utils.json_provider import FastJSONProvider
+
+# what the views hand to jsonify: nested rows with Decimals, dates and None
+PAGE = {
+    'films': [
+        {'title': 'ACADEMY DINOSAUR', 'rental_rate': Decimal('0.99'), 'length': 86, 'rating': None,
+         'last_update': datetime(2006, 2, 15, 5, 3, 42), 'special_features': ['Trailers']},
+        {'title': 'ACE GOLDFINGER', 'rental_rate': Decimal('4.99'), 'length': 48, 'rating': 'G',
+         'release_date': date(2006, 1, 1), 'score': 0.5}
+    ],
+    'pagination': {'page': 1, 'per_page': 2, 'total': 1000, 'has_next': True}
+}
+
+
+@pytest.fixture
+def providers(app):
+    fast = FastJSONProvider(app)
+    if fast.backend == 'stdlib':
+        pytest.skip('neither orjson nor msgspec is installed')
+    return fast, DefaultJSONProvider(app)
+
+
+def _body(provider, obj):
+    return provider.response(obj).get_data()
+
+
+def test_ascii_bodies_are_byte_identical(app, providers):
+    fast, default = providers
+    if fast.backend == 'msgspec':
+        # dates come out as ISO 8601
+        pytest.skip('msgspec formats dates differently')
+    with app.app_context():
+        assert _body(fast, PAGE) == _body(default, PAGE)
+
+
+def test_non_ascii_bodies_follow_ensure_ascii(app, providers):
+    fast, default = providers
+    obj = {'title': 'CAFÉ ÉTÉ', 'note': '日本'}
+    with app.app_context():
+        # flask's default escapes, the stdlib writes these bodies
+        assert _body(fast, obj) == _body(default, obj)
+        assert fast.dumps(obj) == default.dumps(obj)
+
+        fast.ensure_ascii = default.ensure_ascii = False
+        assert _body(fast, obj) == _body(default, obj)
+        assert 'CAFÉ'.encode() in _body(fast, obj)
+
+
+def test_unsorted_keys_keep_their_order(app, providers):
+    fast, default = providers
+    obj = {'title': 'ZOO', 'actor_id': 3, 'films': [{'z': 1, 'a': 2}]}
+    with app.app_context():
+        fast.sort_keys = default.sort_keys = False
+        assert _body(fast, obj) == _body(default, obj)
+        assert fast.dumps(obj) == '{"title":"ZOO","actor_id":3,"films":[{"z":1,"a":2}]}'
+
+
+def test_other_bodies_decode_to_the_same_values(app, providers):
+    fast, default = providers
+    obj = {'big': 1e16, 'small': 1e-7}
+    with app.app_context():
+        fast_body, default_body = _body(fast, obj), _body(default, obj)
+    # shorter float spellings, not the stdlib's 1e+16
+    assert fast_body != default_body
+    assert json.loads(fast_body) == json.loads(default_body)
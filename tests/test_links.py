@@ -0,0 +1,35 @@
+import pytest
+
+
+def test_templated_listing_with_embeds(client):
+    body = client.get('/api/films?embed=actors&links=templated&per_page=2&count=none').get_json()
+    links = body['_links']
+    assert links['items']['self'] == {'href': 'http://localhost/api/films/{film_id}', 'templated': True}
+    assert links['embedded']['actors']['self'] == {'href': 'http://localhost/api/actors/{actor_id}', 'templated': True}
+    # neither the items nor the items embedded in them carry links of their own
+    for film in body['films']:
+        assert '_links' not in film
+        assert film['actors'] and all('_links' not in actor for actor in film['actors'])
+
+
+def test_templated_single_item_with_embeds(client):
+    film = client.get('/api/films/1?embed=actors&links=templated').get_json()
+    assert film['_links']['self'] == {'href': 'http://localhost/api/films/1'}
+    assert film['_links']['embedded']['actors']['films']['templated'] is True
+    assert all('_links' not in actor for actor in film['actors'])
+    # the cached item is not changed for the next request
+    assert 'embedded' not in client.get('/api/films/1').get_json()['_links']
+
+
+def test_full_links_on_embedded_items(client):
+    actor = client.get('/api/actors/1?embed=films').get_json()
+    assert 'embedded' not in actor['_links']
+    assert all(film['_links']['self']['href'] == f"http://localhost/api/films/{film['film_id']}"
+               for film in actor['films'])
+
+
+@pytest.mark.parametrize('url', ['/api/films/export?links=templated', '/api/actors/export?links=templated'])
+def test_exports_reject_templated_links(client, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid links. Options are full and none'}
@@ -0,0 +1,102 @@
+import pytest
+
+from api.utils import metrics
+
+prometheus_client = pytest.importorskip('prometheus_client')
+from prometheus_client.parser import text_string_to_metric_families  # noqa: E402
+
+
+def _scrape(client):
+    response = client.get('/api/metrics')
+    assert response.status_code == 200
+    assert response.content_type == prometheus_client.CONTENT_TYPE_LATEST
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(response.get_data(as_text=True))
+        for sample in family.samples
+    }
+
+
+def _value(samples, name, **labels):
+    return samples.get((name, tuple(sorted(labels.items()))), 0.0)
+
+
+def _endpoint(app, path):
+    return app.url_map.bind('localhost').match(path)[0]
+
+
+def test_requests_are_counted_timed_and_sized(app, client):
+    endpoint = _endpoint(app, '/api/films/1')
+    before = _scrape(client)
+    bodies = [client.get('/api/films/1').get_data() for _ in range(3)]
+    after = _scrape(client)
+
+    def delta(name, **labels):
+        return _value(after, name, **labels) - _value(before, name, **labels)
+
+    assert delta('sakila_http_requests_total', endpoint=endpoint, method='GET', status='200') == 3
+    assert delta('sakila_http_request_duration_seconds_count', endpoint=endpoint, status='200') == 3
+    assert delta('sakila_http_request_duration_seconds_sum', endpoint=endpoint, status='200') > 0
+    # the sizes are the bodies as sent
+    assert delta('sakila_http_response_size_bytes_sum', endpoint=endpoint, status='200') == sum(map(len, bodies))
+    assert delta('sakila_http_response_size_bytes_bucket', endpoint=endpoint, status='200', le='+Inf') == 3
+
+
+def test_compressed_responses_are_sized_as_sent(app, client):
+    endpoint = _endpoint(app, '/api/films')
+    before = _scrape(client)
+    response = client.get('/api/films?per_page=20', headers={'Accept-Encoding': 'gzip'})
+    after = _scrape(client)
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    name = 'sakila_http_response_size_bytes_sum'
+    assert (
+        _value(after, name, endpoint=endpoint, status='200') - _value(before, name, endpoint=endpoint, status='200')
+        == len(response.get_data())
+    )
+
+
+def test_page_sizes_are_observed(app, client):
+    endpoint = _endpoint(app, '/api/films')
+    before = _scrape(client)
+    client.get('/api/films?per_page=7')
+    after = _scrape(client)
+
+    def delta(name, **labels):
+        return _value(after, name, endpoint=endpoint, **labels) - _value(before, name, endpoint=endpoint, **labels)
+
+    assert delta('sakila_per_page_sum') == 7
+    assert delta('sakila_per_page_bucket', le='5.0') == 0
+    assert delta('sakila_per_page_bucket', le='10.0') == 1
+
+
+def test_unmatched_urls_share_one_label(client):
+    before = _scrape(client)
+    for path in ('/api/nope', '/api/other/thing', '/wp-login.php'):
+        assert client.get(path).status_code == 404
+    after = _scrape(client)
+
+    name, labels = 'sakila_http_requests_total', {'endpoint': 'none', 'method': 'GET', 'status': '404'}
+    assert _value(after, name, **labels) - _value(before, name, **labels) == 3
+    assert not any(dict(key[1]).get('endpoint', '').startswith('/') for key in after)
+
+
+def test_pool_numbers_are_exported(client):
+    before = _scrape(client)
+    client.get('/api/films/1')
+    after = _scrape(client)
+
+    for state in ('in_use', 'idle', 'overflow'):
+        assert ('sakila_db_pool_connections', (('pool', 'primary'), ('state', state))) in after
+    assert _value(after, 'sakila_db_pool_connections', pool='primary', state='in_use') == 0
+    assert (
+        _value(after, 'sakila_db_pool_checkouts_total', pool='primary')
+        > _value(before, 'sakila_db_pool_checkouts_total', pool='primary')
+    )
+
+
+def test_metrics_need_prometheus_client(client, monkeypatch):
+    monkeypatch.setattr(metrics, 'prometheus_client', None)
+    response = client.get('/api/metrics')
+    assert response.status_code == 501
+    assert response.get_json() == {'error': 'Metrics need the prometheus_client package'}
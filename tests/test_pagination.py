@@ -0,0 +1,56 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+
+from api.utils.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trips_decimal_and_dates():
+    key = [Decimal('4.99'), date(2006, 2, 15), datetime(2006, 2, 15, 5, 3, 42), 'ACADEMY', 12, 0.5, None]
+    decoded, direction = decode_cursor(encode_cursor(key, 'prev'))
+    assert decoded == key
+    assert [type(value) for value in decoded] == [type(value) for value in key]
+    assert direction == 'prev'
+
+
+@pytest.mark.parametrize('key', [
+    [{'$dec': 'nope'}],
+    [{'$date': '2006-13-45'}],
+    [{'$dt': 5}],
+    [{'$other': '1'}],
+    [{'$dec': '1', '$date': '2006-01-01'}]
+])
+def test_bad_cursor_values_are_rejected(key):
+    import base64
+    import json
+    token = base64.urlsafe_b64encode(json.dumps({'k': key, 'd': 'next'}).encode()).decode()
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def _ids(page):
+    return [item['actor_id'] for item in page['actors']]
+
+
+def test_backward_page_knows_whether_rows_follow(make_app):
+    app = make_app(actors=10, films=2, film_actors=2)
+    client = app.test_client()
+
+    first = client.get('/api/actors/?cursor=&per_page=4&links=none').get_json()
+    second = client.get(f"/api/actors/?cursor={first['pagination']['next_cursor']}&per_page=4&links=none").get_json()
+    assert _ids(second) == [5, 6, 7, 8]
+
+    prev_cursor = second['pagination']['prev_cursor']
+    back = client.get(f'/api/actors/?cursor={prev_cursor}&per_page=4&links=none').get_json()
+    assert _ids(back) == [1, 2, 3, 4]
+    assert back['pagination']['has_next'] is True
+    assert back['pagination']['has_prev'] is False
+
+    # nothing is left after the first page any more
+    for actor_id in range(5, 11):
+        assert client.delete(f'/api/actors/{actor_id}').status_code in (200, 204)
+    back = client.get(f'/api/actors/?cursor={prev_cursor}&per_page=4&links=none').get_json()
+    assert _ids(back) == [1, 2, 3, 4]
+    assert back['pagination']['has_next'] is False
+    assert back['pagination']['next_cursor'] is None
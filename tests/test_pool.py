@@ -0,0 +1,57 @@
+import pytest
+
+from api.config import engine_options
+from api.models import db
+from api.utils.pool import TimedQueuePool
+
+POOL_ENV = ('DB_POOL_SIZE', 'DB_MAX_OVERFLOW', 'DB_POOL_TIMEOUT', 'DB_POOL_RECYCLE', 'DB_POOL_PRE_PING')
+
+
+@pytest.fixture
+def pool_env(monkeypatch):
+    for name in POOL_ENV:
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_engine_options_default_per_config(pool_env):
+    assert engine_options(pool_size=10, max_overflow=20) == {
+        'poolclass': TimedQueuePool, 'pool_size': 10, 'max_overflow': 20,
+        'pool_timeout': 30, 'pool_recycle': 1800, 'pool_pre_ping': True
+    }
+
+
+def test_engine_options_read_the_environment(pool_env):
+    pool_env.setenv('DB_POOL_SIZE', '4')
+    pool_env.setenv('DB_MAX_OVERFLOW', '0')
+    pool_env.setenv('DB_POOL_TIMEOUT', '5')
+    pool_env.setenv('DB_POOL_RECYCLE', '600')
+    pool_env.setenv('DB_POOL_PRE_PING', 'FALSE')
+
+    assert engine_options(pool_size=10, max_overflow=20) == {
+        'poolclass': TimedQueuePool, 'pool_size': 4, 'max_overflow': 0,
+        'pool_timeout': 5, 'pool_recycle': 600, 'pool_pre_ping': False
+    }
+
+
+def test_engine_options_reject_a_malformed_number(pool_env):
+    pool_env.setenv('DB_POOL_SIZE', 'ten')
+    with pytest.raises(ValueError):
+        engine_options(pool_size=10, max_overflow=20)
+
+
+def test_pool_endpoint_reports_the_configured_pool(make_app, pool_env):
+    pool_env.setenv('DB_POOL_SIZE', '3')
+    pool_env.setenv('DB_MAX_OVERFLOW', '1')
+    app = make_app(SQLALCHEMY_ENGINE_OPTIONS=engine_options(pool_size=10, max_overflow=20), DB_POOL_WARMUP=2)
+    client = app.test_client()
+
+    with app.app_context():
+        assert isinstance(db.engine.pool, TimedQueuePool)
+
+    assert client.get('/api/films/1').status_code == 200
+    stats = client.get('/api/pool').get_json()
+    assert stats['size'] == 3 and stats['max_overflow'] == 1
+    # the warmup and the film request checked out, both returned their connection
+    assert stats['in_use'] == 0 and stats['checkouts'] >= 2
+    assert stats['timeouts'] == 0 and stats['wait_max_ms'] >= 0
@@ -0,0 +1,130 @@
+import os
+import pstats
+import re
+import time
+
+import pytest
+from itsdangerous import TimestampSigner
+
+from api.utils.profiling import PROFILE_HEADER, profile_token, route_profiles
+
+SECRET = 'profile-secret'
+
+
+@pytest.fixture
+def profiled(make_app, tmp_path):
+    """
+    factory for an app profiling into tmp_path/profiles, requests take long enough to be sampled
+    """
+    directory = tmp_path / 'profiles'
+
+    def make(**settings):
+        settings = {
+            'PROFILING': True, 'PROFILER': 'stack', 'PROFILE_SAMPLE_RATE': 1.0, 'PROFILE_ENDPOINTS': {},
+            'PROFILE_INTERVAL_MS': 1, 'PROFILE_DIR': str(directory), 'PROFILE_SECRET': None,
+            'PROFILE_TOKEN_MAX_AGE': 300, **settings
+        }
+        app = make_app(actors=5, films=3, film_actors=4, **settings)
+        app.before_request(lambda: time.sleep(0.02))
+        return app
+
+    make.directory = directory
+    return make
+
+
+def _endpoint(app, path):
+    return app.url_map.bind('localhost').match(path)[0]
+
+
+def _files(directory):
+    return sorted(os.listdir(directory)) if directory.exists() else []
+
+
+def test_sampled_requests_write_collapsed_stacks(profiled):
+    app = profiled()
+    client = app.test_client()
+    endpoint = _endpoint(app, '/api/films/1')
+
+    for _ in range(2):
+        assert client.get('/api/films/1').status_code == 200
+
+    assert route_profiles.requests() == {endpoint: 2}
+    assert _files(profiled.directory) == [f'{endpoint}.{os.getpid()}.collapsed']
+    lines = (profiled.directory / f'{endpoint}.{os.getpid()}.collapsed').read_text().splitlines()
+    # "root;...;leaf count", the two requests added up
+    assert lines and all(re.fullmatch(r'\S+ \d+', line) for line in lines)
+    assert any('flask.app:Flask.wsgi_app' in line for line in lines)
+
+
+def test_nothing_is_profiled_at_rate_zero(profiled):
+    client = profiled(PROFILE_SAMPLE_RATE=0.0).test_client()
+    assert client.get('/api/films/1').status_code == 200
+    assert route_profiles.requests() == {}
+    assert _files(profiled.directory) == []
+
+
+def test_endpoint_rates_replace_the_sample_rate(profiled):
+    app = profiled(PROFILE_ENDPOINTS={'api.films.get_film': 1.0})
+    client = app.test_client()
+    assert _endpoint(app, '/api/films/1') == 'api.films.get_film'
+
+    client.get('/api/films/1')
+    client.get('/api/actors/1')
+    client.get('/api/nowhere')
+    assert route_profiles.requests() == {'api.films.get_film': 1}
+
+
+def test_streamed_responses_are_profiled_until_sent(profiled):
+    app = profiled()
+    client = app.test_client()
+    endpoint = _endpoint(app, '/api/films/export')
+
+    response = client.get('/api/films/export')
+    assert route_profiles.requests() == {}
+    response.get_data()
+    response.close()
+    assert route_profiles.requests() == {endpoint: 1}
+
+
+def test_signed_header_profiles_with_sampling_off(profiled):
+    app = profiled(PROFILING=False, PROFILER='cprofile', PROFILE_SECRET=SECRET)
+    client = app.test_client()
+    endpoint = _endpoint(app, '/api/films/1')
+
+    client.get('/api/films/1')
+    client.get('/api/films/1', headers={PROFILE_HEADER: 'profile.not.signed'})
+    client.get('/api/films/1', headers={PROFILE_HEADER: profile_token('another-secret')})
+    assert route_profiles.requests() == {}
+    assert _files(profiled.directory) == []
+
+    client.get('/api/films/1', headers={PROFILE_HEADER: profile_token(SECRET)})
+    assert route_profiles.requests() == {endpoint: 1}
+    assert _files(profiled.directory) == [f'{endpoint}.{os.getpid()}.pstats']
+    stats = pstats.Stats(str(profiled.directory / f'{endpoint}.{os.getpid()}.pstats'))
+    assert stats.total_calls > 0
+    assert any(name == 'get_film' for _, _, name in stats.stats)
+
+
+def test_expired_tokens_are_ignored(profiled, monkeypatch):
+    client = profiled(PROFILING=False, PROFILE_SECRET=SECRET, PROFILE_TOKEN_MAX_AGE=60).test_client()
+
+    # signed ten minutes ago
+    signed = time.time() - 600
+    with monkeypatch.context() as patch:
+        patch.setattr(TimestampSigner, 'get_timestamp', lambda self: int(signed))
+        token = profile_token(SECRET)
+
+    client.get('/api/films/1', headers={PROFILE_HEADER: token})
+    assert route_profiles.requests() == {}
+
+
+def test_token_is_ignored_without_a_secret(profiled):
+    client = profiled(PROFILING=False).test_client()
+    client.get('/api/films/1', headers={PROFILE_HEADER: profile_token(SECRET)})
+    assert route_profiles.requests() == {}
+    assert _files(profiled.directory) == []
+
+
+def test_unknown_profiler_is_rejected(profiled):
+    with pytest.raises(ValueError, match='PROFILER must be one of stack, cprofile'):
+        profiled(PROFILER='pyspy')
@@ -0,0 +1,84 @@
+import shutil
+import sqlite3
+import time
+
+import pytest
+
+from api.utils.routing import STICKY_COOKIE, STICKY_HEADER
+
+
+@pytest.fixture
+def replicated(make_app, tmp_path):
+    """
+    app with one SQLite file standing in for a replica: a copy of the primary
+    taken after seeding, so it never sees the writes made through the app
+    """
+    replica = tmp_path / 'replica.sqlite'
+    app = make_app(
+        actors=5, films=2, film_actors=2,
+        SQLALCHEMY_REPLICA_URIS=[f'sqlite:///{replica}'],
+        READ_PRIMARY_WINDOW=5
+    )
+    shutil.copy(tmp_path / 'main.sqlite', replica)
+    # a marker to tell the copies apart
+    with sqlite3.connect(replica) as connection:
+        connection.execute("UPDATE actor SET first_name = 'REPLICA' WHERE actor_id = 1")
+    return app
+
+
+def _first_name(client, actor_id=1, **kwargs):
+    return client.get(f'/api/actors/{actor_id}?links=none', **kwargs).get_json()['first_name']
+
+
+def test_reads_go_to_the_replica_and_writes_to_the_primary(replicated):
+    client = replicated.test_client()
+    assert _first_name(client) == 'REPLICA'
+
+    response = client.post('/api/actors/', json={'first_name': 'NEW', 'last_name': 'ACTOR'})
+    assert response.status_code == 201
+    # the write went to the primary, the replica stand-in never gets it
+    other = replicated.test_client()
+    assert other.get(f"/api/actors/{response.get_json()['actor_id']}").status_code == 404
+
+
+def test_writer_reads_its_writes_through_the_cookie(replicated):
+    writer = replicated.test_client()
+    response = writer.patch('/api/actors/2', json={'first_name': 'WRITTEN'})
+    assert STICKY_COOKIE in response.headers['Set-Cookie']
+
+    assert _first_name(writer, 2) == 'WRITTEN'
+    # everyone else stays on the replica
+    assert _first_name(replicated.test_client(), 2) != 'WRITTEN'
+
+
+def test_writer_reads_its_writes_through_the_header(replicated):
+    writer = replicated.test_client(use_cookies=False)
+    response = writer.patch('/api/actors/2', json={'first_name': 'WRITTEN'})
+    until = response.headers[STICKY_HEADER]
+
+    assert _first_name(writer, 2) != 'WRITTEN'
+    assert _first_name(writer, 2, headers={STICKY_HEADER: until}) == 'WRITTEN'
+
+
+@pytest.mark.parametrize('until', ['yesterday', '0', str(time.time() + 3600)])
+def test_invalid_expired_or_far_out_values_are_ignored(replicated, until):
+    client = replicated.test_client(use_cookies=False)
+    assert _first_name(client, headers={STICKY_HEADER: until}) == 'REPLICA'
+    assert _first_name(client, headers={'Cookie': f'{STICKY_COOKIE}={until}'}) == 'REPLICA'
+
+
+def test_window_ends(replicated, monkeypatch):
+    writer = replicated.test_client()
+    writer.patch('/api/actors/2', json={'first_name': 'WRITTEN'})
+    assert _first_name(writer, 2) == 'WRITTEN'
+
+    later = time.time() + 6
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert _first_name(writer, 2) != 'WRITTEN'
+
+
+def test_no_sticky_marker_without_replicas(make_app):
+    client = make_app(actors=3, films=2, film_actors=2).test_client()
+    response = client.patch('/api/actors/2', json={'first_name': 'WRITTEN'})
+    assert STICKY_HEADER not in response.headers
+    assert 'Set-Cookie' not in response.headers
@@ -0,0 +1,49 @@
+import pytest
+
+from api.utils.search import MAX_SEARCH_LENGTH
+
+FILM = {
+    'description': 'A plain film', 'release_year': 2006, 'language_id': 1, 'rental_duration': 3,
+    'rental_rate': '1.00', 'replacement_cost': '9.99'
+}
+
+
+@pytest.fixture
+def zebras(client):
+    for title, description in [('ZEBRA ONCE', 'A plain film'), ('ZEBRA ZEBRA', 'A zebra among zebras, zebra'),
+                               ('NO STRIPES', 'A plain film')]:
+        assert client.post('/api/films', json={**FILM, 'title': title, 'description': description}).status_code == 201
+    return client
+
+
+def _titles(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return [film['title'] for film in response.get_json()['films']]
+
+
+def test_matches_come_best_first(zebras):
+    assert _titles(zebras, '/api/films?q=zebra') == ['ZEBRA ZEBRA', 'ZEBRA ONCE']
+    # any term may match, the rows matching more of them rank higher
+    assert _titles(zebras, '/api/films?q=stripes zebra')[-1] == 'ZEBRA ONCE'
+    assert _titles(zebras, '/api/films?q=zebra&per_page=1&count=none') == ['ZEBRA ZEBRA']
+
+
+def test_search_syntax_is_plain_text(zebras):
+    # FTS5 operators and quotes are searched for, not interpreted
+    assert _titles(zebras, '/api/films?q=zebra OR "') == ['ZEBRA ZEBRA', 'ZEBRA ONCE']
+    # one term, i.e. the phrase "near zebra", no prefix query
+    assert _titles(zebras, '/api/films?q=NEAR(zebra*') == []
+
+
+def test_new_rows_and_edits_are_searchable(zebras):
+    zebras.patch('/api/films/1', json={'title': 'ZEBRA CROSSING'})
+    assert 'ZEBRA CROSSING' in _titles(zebras, '/api/films?q=crossing')
+
+
+@pytest.mark.parametrize('url', ['/api/films', '/api/actors/', '/api/films/export'])
+def test_overlong_search_is_rejected(client, url):
+    assert client.get(f'{url}?q={"a" * MAX_SEARCH_LENGTH}').status_code == 200
+    response = client.get(f'{url}?q={"a" * (MAX_SEARCH_LENGTH + 1)}')
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'Invalid search length'}
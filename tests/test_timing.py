@@ -0,0 +1,17 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from api.models import db
+
+
+def test_failed_statements_leave_no_start_behind(make_app):
+    app = make_app(actors=3, films=2, film_actors=2, SQL_TIMING=True, SLOW_QUERY_MS=1000)
+    with app.app_context(), db.engine.connect() as connection:
+        with pytest.raises(OperationalError):
+            connection.execute(text('SELECT * FROM no_such_table'))
+        assert connection.info['query_start'] == []
+
+        assert connection.execute(text('SELECT count(*) FROM actor')).scalar() == 3
+        assert connection.info['query_start'] == []
+